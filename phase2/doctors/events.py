@@ -0,0 +1,280 @@
+"""
+Live referral notices for the doctor dashboard, as Server-Sent Events.
+
+ReferralStreamApp wraps the Django ASGI application in phase2/asgi.py and
+serves the stream URL itself, without Django's request/middleware cycle: an
+open stream is one coroutine waiting on an asyncio.Queue, so thousands of idle
+dashboards cost no threads or database connections. When an exam referred to
+a consultant commits, publish_referrals() hands a ReferralSummarySerializer
+payload to each of that consultant's open streams through the in-process
+broker.
+
+Event ids are exam ids. A reconnecting browser sends the last one it saw as
+Last-Event-ID (the dashboard passes ``?after=`` on its first connection) and
+receives the referrals it missed from the database, so events published by
+another worker process or while the stream was down are not lost; only more
+than REPLAY_LIMIT of them make the client reload its list instead.
+"""
+import asyncio
+import json
+import threading
+import time
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+from django.http.cookie import parse_cookie
+from django.urls import reverse
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from optometrist.authentication import ClaimsJWTAuthentication
+from optometrist.models import EyeExamination, Optometrist
+
+DEFAULTS = {
+    'HEARTBEAT_SECONDS': 15,
+    'RETRY_MS': 5000,
+    'REPLAY_LIMIT': 50,
+    'QUEUE_SIZE': 100,
+    # Streams are closed after this long and the browser reconnects, which re-checks the login
+    'MAX_AGE_SECONDS': 60 * 60,
+}
+
+
+def stream_config():
+    return {**DEFAULTS, **getattr(settings, 'REFERRAL_STREAM', {})}
+
+
+class Subscription:
+    def __init__(self, consultant_id, queue_size):
+        self.consultant_id = consultant_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def offer(self, event):
+        # Runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class ReferralBroker:
+    """In-process fan-out from publishing threads to the streams open on this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, consultant_id, queue_size):
+        subscription = Subscription(consultant_id, queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(consultant_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.consultant_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.consultant_id, None)
+
+    def listening(self, consultant_ids):
+        with self._lock:
+            return {pk for pk in consultant_ids if pk in self._subscriptions}
+
+    def publish(self, consultant_id, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(consultant_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                pass
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+broker = ReferralBroker()
+
+
+def referral_events(exams):
+    """(exam id, JSON payload) per exam, the payload being a worklist row."""
+    from .serializers import ReferralSummarySerializer
+    rows = ReferralSummarySerializer(exams, many=True).data
+    return [(row['id'], json.dumps(row, separators=(',', ':'))) for row in rows]
+
+
+def publish_referrals(exams):
+    """Push notices for newly committed referrals to the consultants' open streams."""
+    listening = broker.listening({exam.consultant_id for exam in exams if exam.consultant_id})
+    exams = [exam for exam in exams if exam.consultant_id in listening]
+    if not exams:
+        return
+    # Bulk imports pass exams with only optometrist_id set
+    missing = {exam.optometrist_id for exam in exams if not EyeExamination.optometrist.is_cached(exam)}
+    if missing:
+        optometrists = Optometrist.objects.only('id', 'name').in_bulk(missing)
+        for exam in exams:
+            if not EyeExamination.optometrist.is_cached(exam):
+                exam.optometrist = optometrists[exam.optometrist_id]
+    for exam, event in zip(exams, referral_events(exams)):
+        broker.publish(exam.consultant_id, event)
+
+
+def _database(func):
+    """Run func in a worker thread with fresh connections, as Django does around each request."""
+    def inner(*args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(inner)
+
+
+@_database
+def authenticate(headers):
+    """The Optometrist behind a Bearer access token or a session cookie, or None."""
+    authorization = headers.get(b'authorization', b'').decode('latin-1')
+    if authorization.startswith('Bearer '):
+        authentication = ClaimsJWTAuthentication()
+        try:
+            return authentication.get_user(authentication.get_validated_token(authorization[7:].encode()))
+        except (InvalidToken, AuthenticationFailed):
+            return None
+    session_key = parse_cookie(headers.get(b'cookie', b'').decode('latin-1')).get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    user = get_user(SimpleNamespace(session=session))
+    return user if user.is_authenticated else None
+
+
+@_database
+def missed_events(consultant_id, after, limit):
+    """Referrals with an id above ``after``, or None when there are more than ``limit``."""
+    exams = list(
+        EyeExamination.objects.filter(consultant_id=consultant_id, pk__gt=after)
+        .select_related('patient', 'optometrist')
+        .only(
+            'id', 'created_at', 'status', 'patient', 'optometrist',
+            'patient__name', 'patient__age', 'patient__gender', 'optometrist__name'
+        )
+        .order_by('pk')[:limit + 1]
+    )
+    if len(exams) > limit:
+        return None
+    return referral_events(exams)
+
+
+def format_event(event):
+    event_id, data = event
+    return f'id: {event_id}\nevent: referral\ndata: {data}\n\n'.encode()
+
+
+RESET = b'event: reset\ndata: {}\n\n'
+
+
+class ReferralStreamApp:
+    """ASGI application serving the referral stream and passing every other request to Django."""
+
+    def __init__(self, application):
+        self.application = application
+        self._path = None
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = reverse('doctor_referral_stream')
+        return self._path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == self.path:
+            return await self.stream(scope, receive, send)
+        return await self.application(scope, receive, send)
+
+    async def respond(self, send, status, body=b''):
+        await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def last_event_id(self, scope, headers):
+        # The browser sends Last-Event-ID when it reconnects; the dashboard's first connection uses ?after=
+        value = headers.get(b'last-event-id', b'').decode('latin-1')
+        if not value:
+            value = (parse_qs(scope.get('query_string', b'').decode('latin-1')).get('after') or [''])[-1]
+        return int(value) if value.isdigit() else None
+
+    async def stream(self, scope, receive, send):
+        if scope['method'] != 'GET':
+            return await self.respond(send, 405)
+        headers = dict(scope['headers'])
+        user = await authenticate(headers)
+        if user is None:
+            return await self.respond(send, 401, b'Authentication credentials were not provided.')
+        if user.role != 'doctor':
+            return await self.respond(send, 403, b'Only consultants receive referrals.')
+
+        config = stream_config()
+        after = self.last_event_id(scope, headers)
+        # Subscribe before reading missed referrals, so nothing committed in between is lost
+        subscription = broker.subscribe(user.pk, config['QUEUE_SIZE'])
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': f"retry: {config['RETRY_MS']}\n\n".encode(), 'more_body': True})
+
+            replayed = set()
+            if after is not None:
+                missed = await missed_events(user.pk, after, config['REPLAY_LIMIT'])
+                if missed is None:
+                    await send({'type': 'http.response.body', 'body': RESET})
+                    return
+                if missed:
+                    await send({'type': 'http.response.body', 'body': b''.join(map(format_event, missed)), 'more_body': True})
+                    replayed = {event_id for event_id, _ in missed}
+
+            closes_at = time.monotonic() + config['MAX_AGE_SECONDS']
+            while time.monotonic() < closes_at:
+                event = asyncio.ensure_future(subscription.queue.get())
+                done, _ = await asyncio.wait(
+                    {event, disconnected}, timeout=config['HEARTBEAT_SECONDS'], return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnected in done:
+                    event.cancel()
+                    return
+                if subscription.overflowed:
+                    event.cancel()
+                    await send({'type': 'http.response.body', 'body': RESET})
+                    return
+                if event in done:
+                    # Referrals committed while the missed ones were being read arrive twice
+                    if event.result()[0] not in replayed:
+                        await send({'type': 'http.response.body', 'body': format_event(event.result()), 'more_body': True})
+                else:
+                    event.cancel()
+                    # Comment line: keeps proxies from timing out the idle connection
+                    await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            broker.unsubscribe(subscription)
+            disconnected.cancel()
+
+    async def wait_for_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
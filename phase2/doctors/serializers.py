@@ -0,0 +1,38 @@
+from rest_framework import serializers
+from optometrist.models import EyeExamination
+
+
+class ReferralSummarySerializer(serializers.ModelSerializer):
+    patient_name = serializers.CharField(source='patient.name', read_only=True)
+    patient_age = serializers.IntegerField(source='patient.age', read_only=True)
+    patient_gender = serializers.CharField(source='patient.gender', read_only=True)
+    optometrist_name = serializers.CharField(source='optometrist.name', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+
+    class Meta:
+        model = EyeExamination
+        fields = [
+            'id', 'patient_name', 'patient_age', 'patient_gender',
+            'optometrist_name', 'created_at', 'status', 'status_display'
+        ]
+
+from optometrist.serializers import PatientSerializer, MedicationSerializer
+
+
+class ReferralDetailSerializer(serializers.ModelSerializer):
+    patient = PatientSerializer(read_only=True)
+    medications = MedicationSerializer(many=True, read_only=True)
+    optometrist_name = serializers.CharField(source='optometrist.name', read_only=True)
+    consultant_name = serializers.CharField(source='consultant.name', read_only=True, default=None)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+
+    class Meta:
+        model = EyeExamination
+        exclude = ['clinical_values_version']
+
+
+class ReferralSearchResultSerializer(ReferralSummarySerializer):
+    rank = serializers.FloatField(source='search_rank', read_only=True)
+
+    class Meta(ReferralSummarySerializer.Meta):
+        fields = ReferralSummarySerializer.Meta.fields + ['rank']
@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from optometrist.models import EyeExamination
+from optometrist.signals import exams_created
+
+from .events import publish_referrals
+
+
+def publish_on_commit(exams):
+    # robust: the exam is already committed, so a failed notice is logged rather than turned into a 500;
+    # dashboards pick the referral up from the database when their stream reconnects
+    transaction.on_commit(lambda: publish_referrals(exams), robust=True)
+
+
+@receiver(post_save, sender=EyeExamination)
+def push_referral_on_create(sender, instance, created, **kwargs):
+    if created and instance.open_consultant_id:
+        publish_on_commit([instance])
+
+
+@receiver(exams_created, sender=EyeExamination)
+def push_referrals_on_bulk_create(sender, exams, **kwargs):
+    # Imported history arrives closed and is not a new referral
+    referred = [exam for exam in exams if exam.open_consultant_id]
+    if referred:
+        publish_on_commit(referred)
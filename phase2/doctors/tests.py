@@ -1,3 +1,167 @@
-from django.test import TestCase
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from optometrist.authentication import OptometristRefreshToken
+from optometrist.models import EyeExamination, Medication, Optometrist, Patient
+
+
+class ReferralDetailRevalidationTests(TestCase):
+
+    def setUp(self):
+        self.doctor = Optometrist.objects.create_user('7200000001', 'Dr Detail', 'pw', role='doctor')
+        optometrist = Optometrist.objects.create_user('7200000002', 'Opto Detail', 'pw')
+        patient = Patient.objects.create(name='Ravi Kumar', age=52, gender='male')
+        self.exam = EyeExamination.objects.create(patient=patient, optometrist=optometrist, consultant=self.doctor)
+        self.medication = Medication.objects.create(examination=self.exam, name='Timolol 0.5%')
+        token = OptometristRefreshToken.for_user(self.doctor).access_token
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        self.url = f'/doctor/api/referrals/{self.exam.pk}/'
+
+    def revalidate(self, etag):
+        return self.client.get(self.url, HTTP_IF_NONE_MATCH=etag, **self.headers)
+
+    def test_unchanged_referral_is_not_modified(self):
+        etag = self.client.get(self.url, **self.headers)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(etag).status_code, 304)
+
+    def test_medication_edit_changes_etag(self):
+        etag = self.client.get(self.url, **self.headers)['ETag']
+        self.medication.frequency = 'BD'
+        self.medication.save()
+        response = self.revalidate(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['medications'][0]['frequency'], 'BD')
+
+    def test_medication_delete_changes_etag(self):
+        Medication.objects.create(examination=self.exam, name='Carboxymethylcellulose 0.5%')
+        etag = self.client.get(self.url, **self.headers)['ETag']
+        self.medication.delete()
+        response = self.revalidate(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['medications']), 1)
+
+
+class ReferralPublishTests(TestCase):
+
+    def test_failed_publish_does_not_fail_the_request(self):
+        doctor = Optometrist.objects.create_user('7200000011', 'Dr Publish', 'pw', role='doctor')
+        optometrist = Optometrist.objects.create_user('7200000012', 'Opto Publish', 'pw')
+        patient = Patient.objects.create(name='Farah Khan', age=33, gender='female')
+        token = OptometristRefreshToken.for_user(optometrist).access_token
+        with patch('doctors.signals.publish_referrals', side_effect=RuntimeError('broker down')) as publish, \
+                self.assertLogs('django', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/exams/create/',
+                {'patient_id': patient.pk, 'consultant_id': doctor.pk, 'chief_complaints': 'Floaters'},
+                content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}',
+            )
+        self.assertEqual(response.status_code, 201)
+        publish.assert_called_once()
+        self.assertTrue(EyeExamination.objects.filter(pk=response.json()['id']).exists())
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class WorklistPaginationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = Optometrist.objects.create_user('7200000021', 'Dr Worklist', 'pw', role='doctor')
+        other = Optometrist.objects.create_user('7200000022', 'Dr Other', 'pw', role='doctor')
+        optometrist = Optometrist.objects.create_user('7200000023', 'Opto Worklist', 'pw')
+        patient = Patient.objects.create(name='Latha Reddy', age=70, gender='female')
+        exams = [
+            EyeExamination.objects.create(patient=patient, optometrist=optometrist, consultant=self.doctor)
+            for _ in range(23)
+        ]
+        EyeExamination.objects.create(patient=patient, optometrist=optometrist, consultant=other)
+        # Several referrals created in the same instant: the id breaks the tie
+        EyeExamination.objects.filter(pk__in=[exam.pk for exam in exams[5:12]]).update(created_at=exams[5].created_at)
+        self.expected = list(
+            EyeExamination.objects.filter(consultant=self.doctor).order_by('-created_at', '-id').values_list('pk', flat=True)
+        )
+        token = OptometristRefreshToken.for_user(self.doctor).access_token
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def page(self, **params):
+        response = self.client.get('/doctor/api/referrals/', {'page_size': 10, **params}, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_cursor_walks_every_referral_once(self):
+        ids, pages, cursor = [], 0, None
+        while True:
+            body = self.page(**({'cursor': cursor} if cursor else {}))
+            ids += [row['id'] for row in body['results']]
+            pages += 1
+            cursor = body['next_cursor']
+            if cursor is None:
+                break
+            self.assertEqual(parse_qs(urlsplit(body['next']).query)['cursor'], [cursor])
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(pages, 3)
+
+    def test_deep_page_costs_the_same_as_the_first(self):
+        # The page with one extra row and no COUNT(*); the first request also caches the user's claims row
+        with self.assertNumQueries(2):
+            first = self.page()
+        with self.assertNumQueries(1):
+            self.page(cursor=first['next_cursor'])
+
+    def test_page_size_is_capped(self):
+        self.assertEqual(len(self.page(page_size=1000)['results']), 23)
+        self.assertEqual(len(self.page(page_size='x')['results']), 23)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/doctor/api/referrals/', {'cursor': 'bm9wZQ=='}, **self.headers)
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ReferralSearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = Optometrist.objects.create_user('7200000041', 'Dr Search', 'pw', role='doctor')
+        other = Optometrist.objects.create_user('7200000042', 'Dr Other', 'pw', role='doctor')
+        self.optometrist = Optometrist.objects.create_user('7200000043', 'Opto Search', 'pw')
+        self.patient = Patient.objects.create(name='Gopal Krishnan', age=63, gender='male')
+        self.diagnosed = self.exam(provisional_diagnosis='Glaucoma suspect', advice='Review')
+        self.complained = self.exam(chief_complaints='Glaucoma in family', advice='Review')
+        self.advised = self.exam(chief_complaints='Headache', advice='Rule out glaucoma')
+        self.exam(provisional_diagnosis='Glaucoma suspect', consultant=other)
+        token = OptometristRefreshToken.for_user(self.doctor).access_token
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def exam(self, **values):
+        values.setdefault('consultant', self.doctor)
+        return EyeExamination.objects.create(patient=self.patient, optometrist=self.optometrist, **values)
+
+    def search(self, query):
+        response = self.client.get('/doctor/api/referrals/search/', {'q': query}, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()]
+
+    def test_weighted_fields_rank_matches(self):
+        self.assertEqual(self.search('glauc'), [self.diagnosed.pk, self.complained.pk, self.advised.pk])
+        self.assertEqual(self.search('glaucoma review'), [self.diagnosed.pk, self.complained.pk])
+        self.assertEqual(self.search('gopal headache'), [self.advised.pk])
+        self.assertEqual(self.search('g'), [])
+
+    def test_search_costs_two_queries(self):
+        self.search('glaucoma')  # caches the user's claims row
+        with self.assertNumQueries(2):
+            self.search('glaucoma')
+
+    def test_index_follows_edits_and_deletes(self):
+        self.advised.advice = 'Spectacles'
+        self.advised.save()
+        self.diagnosed.delete()
+        self.assertEqual(self.search('glaucoma'), [self.complained.pk])
+        self.patient.name = 'Gopal Iyer'
+        self.patient.save()
+        self.assertEqual(len(self.search('iyer')), 2)
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import LoginDoctor, DoctorDashboardPageView, DoctorListView
+from .views import LoginDoctor, DoctorDashboardPageView, DoctorListView, DoctorWorklistView, ReferralDetailView, ReferralSearchView, referral_stream_unavailable
 from django.views.generic import RedirectView
 
 urlpatterns = [
@@ -9,5 +9,9 @@ urlpatterns = [
 
     # API endpoints
     path('api/list/', DoctorListView.as_view(), name='doctor_list_api'),
+    path('api/referrals/', DoctorWorklistView.as_view(), name='doctor_worklist_api'),
+    path('api/referrals/stream/', referral_stream_unavailable, name='doctor_referral_stream'),
+    path('api/referrals/search/', ReferralSearchView.as_view(), name='doctor_referral_search_api'),
+    path('api/referrals/<int:pk>/', ReferralDetailView.as_view(), name='doctor_referral_detail_api'),
     path('dashboard/', RedirectView.as_view(pattern_name='doctor_dashboard', permanent=True)),
 ]
@@ -1,14 +1,15 @@
 from rest_framework import status, permissions, generics
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate, login
 from django.shortcuts import render
 from django.views.generic import TemplateView
 from optometrist.models import Optometrist, Patient, EyeExamination  # Using the same user model and Patient model
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from optometrist.authentication import OptometristRefreshToken
+from phase2.db_routing import ReplicaReadMixin
 
-class DoctorDashboardPageView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+class DoctorDashboardPageView(ReplicaReadMixin, LoginRequiredMixin, UserPassesTestMixin, TemplateView):
     template_name = 'doctors/dashboard.html'
     login_url = '/doctor/api/login/'
 
@@ -17,8 +18,8 @@ class DoctorDashboardPageView(LoginRequiredMixin, UserPassesTestMixin, TemplateV
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Fetch examinations (referrals) assigned to this doctor
-        context['examinations'] = EyeExamination.objects.filter(consultant=self.request.user).select_related('patient', 'optometrist').order_by('-created_at')
+        # Referral rows are loaded page by page from DoctorWorklistView; only the total is rendered here
+        context['referral_count'] = EyeExamination.objects.filter(consultant=self.request.user).count()
         return context
 
 class LoginDoctor(APIView):
@@ -41,7 +42,7 @@ class LoginDoctor(APIView):
             # Log the user into the session (Built-in Auth support)
             login(request, user)
                 
-            refresh = RefreshToken.for_user(user)
+            refresh = OptometristRefreshToken.for_user(user)
             return Response({
                 'refresh': str(refresh),
                 'access': str(refresh.access_token),
@@ -56,11 +57,120 @@ class LoginDoctor(APIView):
         
         return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
 
-from optometrist.serializers import OptometristProfileSerializer
+from optometrist.cache import DirectoryCacheMixin
+from optometrist.serializers import OptometristProfileSerializer, OPTOMETRIST_PROFILE_PROJECTION
 
-class DoctorListView(generics.ListAPIView):
+class DoctorListView(ReplicaReadMixin, DirectoryCacheMixin, generics.ListAPIView):
     queryset = Optometrist.objects.filter(role='doctor', is_active=True)
     serializer_class = OptometristProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    directory_cache_name = 'doctors'
+    projection = OPTOMETRIST_PROFILE_PROJECTION
 
 
+
+from optometrist.permissions import IsDoctor
+from django.db.models import Count, Max, prefetch_related_objects
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from .pagination import WorklistCursorPagination
+from .serializers import ReferralSummarySerializer, ReferralDetailSerializer
+
+class DoctorWorklistView(ReplicaReadMixin, generics.ListAPIView):
+    serializer_class = ReferralSummarySerializer
+    pagination_class = WorklistCursorPagination
+    permission_classes = [IsDoctor]
+
+    def get_queryset(self):
+        return (
+            EyeExamination.objects.filter(consultant=self.request.user)
+            .select_related('patient', 'optometrist')
+            .only(
+                'id', 'created_at', 'status', 'patient', 'optometrist',
+                'patient__name', 'patient__age', 'patient__gender', 'optometrist__name'
+            )
+        )
+
+class ReferralDetailView(generics.RetrieveAPIView):
+    """
+    One referral with its patient, consultant and medications for the dashboard modal.
+
+    Costs one query when the client's cached copy is still valid (304) and two otherwise.
+    """
+    serializer_class = ReferralDetailSerializer
+    permission_classes = [IsDoctor]
+
+    def get_queryset(self):
+        return (
+            EyeExamination.objects.filter(consultant=self.request.user)
+            .select_related('patient', 'optometrist', 'consultant')
+            # Editing a medication moves the latest updated_at, deleting one the count
+            .annotate(medication_count=Count('medications'), medications_updated_at=Max('medications__updated_at'))
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        exam = self.get_object()
+        last_modified = max(
+            value for value in (
+                exam.updated_at, exam.patient.updated_at, exam.optometrist.updated_at,
+                exam.consultant.updated_at, exam.medications_updated_at,
+            ) if value is not None
+        )
+        etag = quote_etag(f"{exam.pk}-{last_modified.timestamp():.6f}-{exam.medication_count}")
+
+        response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+        if response is None:
+            # Medications are only fetched once we know the client needs a body
+            prefetch_related_objects([exam], 'medications')
+            response = Response(self.get_serializer(exam).data)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
+from optometrist import search
+from .serializers import ReferralSearchResultSerializer
+
+class ReferralSearchView(ReplicaReadMixin, generics.ListAPIView):
+    """
+    Full-text search over the doctor's own referrals, best matches first.
+
+    ``?q=`` terms must all appear (as word prefixes) in the complaints, history,
+    diagnosis, advice or patient name. Costs two queries: the ranked index lookup,
+    already restricted to this consultant, and one fetch of the matching rows.
+    """
+    serializer_class = ReferralSearchResultSerializer
+    permission_classes = [IsDoctor]
+    min_query_length = 2
+    max_results = 50
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        if len(query) < self.min_query_length:
+            return []
+        hits = search.search_exams(
+            EyeExamination.objects.filter(consultant=self.request.user), query, limit=self.max_results
+        )
+        exams = (
+            EyeExamination.objects.select_related('patient', 'optometrist')
+            .only(
+                'id', 'created_at', 'status', 'patient', 'optometrist',
+                'patient__name', 'patient__age', 'patient__gender', 'optometrist__name'
+            )
+            .in_bulk([pk for pk, _ in hits])
+        )
+        results = []
+        for pk, rank in hits:
+            if pk in exams:
+                exams[pk].search_rank = rank
+                results.append(exams[pk])
+        return results
+
+from django.http import HttpResponse
+
+def referral_stream_unavailable(request):
+    # The stream itself is served by doctors.events.ReferralStreamApp under ASGI (phase2/asgi.py).
+    # 204 tells EventSource to stop reconnecting, so a WSGI deployment just has no live updates.
+    return HttpResponse(status=204)
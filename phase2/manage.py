@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'phase2.settings')
+    # The test suite runs with a read replica configured (see phase2/test_settings.py)
+    default_settings = 'phase2.test_settings' if sys.argv[1:2] == ['test'] else 'phase2.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', default_settings)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -1,27 +1,76 @@
 from django.contrib import admin
-from .models import Optometrist, Patient, EyeExamination, Medication
+from .models import Optometrist, Patient, EyeExamination, Medication, FormularyEntry
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .forms import OptometristCreationForm, OptometristChangeForm
+from django.contrib.admin.views.main import ORDER_VAR
+from django.db.models import Case, Count, IntegerField, Value, When
+from . import search
+from .admin_performance import AutocompleteFilter, PerformanceAdminMixin
 
 class MedicationInline(admin.TabularInline):
     model = Medication
     extra = 1
+    autocomplete_fields = ('formulary',)
+
+@admin.register(FormularyEntry)
+class FormularyEntryAdmin(admin.ModelAdmin):
+    list_display = ('drug', 'strength', 'dosage_form', 'default_frequency', 'default_duration', 'prescription_count', 'is_active')
+    list_filter = ('is_active', 'dosage_form')
+    search_fields = ('drug', 'strength', 'dosage_form')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(prescription_count=Count('prescriptions'))
+
+    @admin.display(description='Prescriptions', ordering='prescription_count')
+    def prescription_count(self, obj):
+        return obj.prescription_count
 
 @admin.register(EyeExamination)
-class EyeExaminationAdmin(admin.ModelAdmin):
+class EyeExaminationAdmin(PerformanceAdminMixin, admin.ModelAdmin):
     list_display = ('patient', 'optometrist', 'consultant', 'date_of_visit')
-    list_filter = ('date_of_visit', 'optometrist', 'consultant')
-    search_fields = ('patient__name', 'optometrist__name', 'provisional_diagnosis')
+    list_select_related = ('patient', 'optometrist', 'consultant')
+    list_filter = ('date_of_visit', ('optometrist', AutocompleteFilter), ('consultant', AutocompleteFilter))
+    autocomplete_fields = ('patient', 'optometrist', 'consultant')
+    # Searched through the full-text index (see get_search_results); filter by optometrist from the sidebar
+    search_fields = ('patient__name', 'chief_complaints', 'provisional_diagnosis', 'advice', 'history_eye_disease')
+    search_help_text = 'Patient name, complaints, history, diagnosis or advice. Best matches first.'
+    search_result_limit = 500
     inlines = [MedicationInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        hits = search.search_exams(queryset, search_term, limit=self.search_result_limit)
+        ranks = [When(pk=pk, then=Value(position)) for position, (pk, _) in enumerate(hits)]
+        queryset = queryset.filter(pk__in=[pk for pk, _ in hits]).annotate(
+            search_rank=Case(*ranks, default=Value(len(hits)), output_field=IntegerField())
+        )
+        # Best matches first, unless a column header was clicked
+        if ORDER_VAR not in request.GET:
+            queryset = queryset.order_by('search_rank')
+        return queryset, False
+
 @admin.register(Patient)
-class PatientAdmin(admin.ModelAdmin):
+class PatientAdmin(PerformanceAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'age', 'gender', 'phone_number', 'created_at')
     list_filter = ('gender', 'created_at')
     search_fields = ('name', 'phone_number')
+    search_help_text = 'Start of the name or phone number.'
+    # Same as the changelist default; also gives the autocomplete view a stable order to page through
+    ordering = ('-pk',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Prefix match on the indexed normalized keys, like PatientSearchView, instead of icontains scans
+        key, term = Patient.search_key(search_term)
+        if not term:
+            return queryset, False
+        queryset = Patient.filter_prefix(queryset, key, term)
+        if ORDER_VAR not in request.GET:
+            queryset = queryset.order_by(key, 'pk')
+        return queryset, False
 
 @admin.register(Optometrist)
-class OptometristAdmin(BaseUserAdmin):
+class OptometristAdmin(PerformanceAdminMixin, BaseUserAdmin):
     form = OptometristChangeForm
     add_form = OptometristCreationForm
     
@@ -40,6 +89,12 @@ class OptometristAdmin(BaseUserAdmin):
         ('Important dates', {'fields': ('last_login', 'created_at', 'updated_at')}),
     )
     readonly_fields = ('created_at', 'updated_at', 'last_login')
+
+    def formfield_for_manytomany(self, db_field, request=None, **kwargs):
+        # Permission names include their content type; UserChangeForm joins it, the add form did not
+        if db_field.name == 'user_permissions':
+            kwargs['queryset'] = db_field.remote_field.model.objects.select_related('content_type')
+        return super().formfield_for_manytomany(db_field, request=request, **kwargs)
     
     add_fieldsets = (
         (None, {
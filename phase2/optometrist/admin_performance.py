@@ -0,0 +1,255 @@
+"""
+Admin changelists that stay fast on large tables.
+
+PerformanceAdminMixin swaps the pieces of a changelist whose cost grows with
+table size: the paginator counts at most ADMIN_COUNT_LIMIT rows (or reads the
+planner's row estimate when nothing is filtered), the "next page" link seeks
+past the last row shown instead of using OFFSET, the second unfiltered COUNT(*)
+and the facet counts are switched off, and AutocompleteFilter replaces sidebar
+filters that would list every related row.
+"""
+import operator
+from functools import reduce
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.utils import get_last_value_from_parameters
+from django.contrib.admin.views.main import PAGE_VAR, ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext as _
+
+
+def estimated_row_count(model, using):
+    """The planner's row count for the model's table, or None when statistics are missing."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            # Filled in by ANALYZE / PRAGMA optimize; the first number is the table's row count
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+AFTER_VAR = 'after'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists over large tables.
+
+    ``count`` is exact up to ADMIN_COUNT_LIMIT and stops there; an unfiltered
+    changelist uses the planner's estimate once the table is larger than that.
+    When a filtered count stops at the limit, ``capped`` is set and pages past
+    it stay reachable: each page reads one extra row to learn whether another
+    page follows, and ``num_pages`` grows as they are visited.
+
+    ``after`` is the primary key of the last row of the previous page (the
+    changelist's next-page link carries it). The page is then read with a
+    keyset condition on the ordering columns, so deep pages cost the same as
+    the first. Other page links, and orderings that cannot seek (expressions,
+    relations or nullable columns), fall back to reading the page's primary
+    keys with OFFSET (a narrow, index-only scan) and loading those rows by key.
+    """
+
+    capped = False
+    number = None
+    more = False
+
+    def __init__(self, *args, after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.after = after
+
+    @cached_property
+    def count_limit(self):
+        return getattr(settings, 'ADMIN_COUNT_LIMIT', 10000)
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.count_limit:
+                return estimate
+        count = queryset.order_by().values('pk')[:self.count_limit + 1].count()
+        self.capped = count > self.count_limit
+        return min(count, self.count_limit)
+
+    @property
+    def num_pages(self):
+        pages = super().num_pages
+        if self.capped and self.number is not None:
+            # Past the limit the last page is only known once it is reached
+            return max(pages, self.number + 1 if self.more else self.number)
+        return pages
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if not self.capped or int(number) < 1:
+                raise
+            # page() raises EmptyPage itself when no rows are left
+            return int(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        seek = self.seek_after(self.after) if self.after and number > 1 else None
+        if seek is not None and not self.capped:
+            return self._get_page(self.object_list.filter(seek)[:self.per_page], number, self)
+        limit = self.per_page + 1 if self.capped else self.per_page
+        if seek is not None:
+            keys = list(self.object_list.filter(seek).values_list('pk', flat=True)[:limit])
+        else:
+            bottom = (number - 1) * self.per_page
+            keys = list(self.object_list.values_list('pk', flat=True)[bottom:bottom + limit])
+        if self.capped:
+            if not keys and number > 1:
+                raise EmptyPage(self.error_messages['no_results'])
+            self.number, self.more = number, len(keys) > self.per_page
+            keys = keys[:self.per_page]
+        return self._get_page(self.object_list.filter(pk__in=keys), number, self)
+
+    def seek_ordering(self):
+        """[(field name, descending)] up to the first unique column, or None when the ordering cannot seek."""
+        opts = self.object_list.model._meta
+        ordering = []
+        for term in self.object_list.query.order_by:
+            if not isinstance(term, str) or term == '?':
+                return None
+            name = term.lstrip('-')
+            try:
+                field = opts.pk if name == 'pk' else opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if field.null or field.is_relation or not field.concrete:
+                return None
+            ordering.append((field.name, term.startswith('-')))
+            if field.unique:
+                return ordering
+        # Without a unique column rows that tie would be skipped
+        return None
+
+    def seek_after(self, after):
+        """Q for the rows that follow the row with primary key ``after``, or None."""
+        ordering = self.seek_ordering()
+        if ordering is None:
+            return None
+        try:
+            after = self.object_list.model._meta.pk.to_python(after)
+        except ValidationError:
+            return None
+        values = self.object_list.filter(pk=after).values_list(*[name for name, _ in ordering]).first()
+        if values is None:
+            return None
+        conditions = []
+        for index, (name, descending) in enumerate(ordering):
+            lookups = {tied: value for (tied, _), value in zip(ordering[:index], values)}
+            lookups[f"{name}__{'lt' if descending else 'gt'}"] = values[index]
+            conditions.append(Q(**lookups))
+        return reduce(operator.or_, conditions)
+
+
+class KeysetChangeList(ChangeList):
+    """Changelist whose next-page link passes the page's last primary key to EstimatedCountPaginator."""
+    last_key = None
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        new_params = {AFTER_VAR: None, **(new_params or {})}
+        if new_params.get(PAGE_VAR) == self.page_num + 1 and self.last_key is not None:
+            new_params[AFTER_VAR] = self.last_key
+        return super().get_query_string(new_params, remove)
+
+    def get_results(self, request):
+        super().get_results(request)
+        if self.multi_page and not (self.show_all and self.can_show_all):
+            # Fills the queryset's cache, so the template renders these same rows
+            rows = list(self.result_list)
+            self.last_key = rows[-1].pk if rows else None
+
+
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    """
+    Sidebar filter for a foreign key that picks the value with the admin's
+    autocomplete widget instead of listing every related row. The related
+    model's admin needs ``search_fields``, as for ``autocomplete_fields``.
+    """
+    template = 'admin/optometrist/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.admin_site = model_admin.admin_site
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+    def field_choices(self, field, request, model_admin):
+        return []
+
+    def has_output(self):
+        return True
+
+    def widget_html(self):
+        queryset = self.field.remote_field.model._default_manager.complex_filter(
+            self.field.get_limit_choices_to()
+        )
+        widget = AutocompleteSelect(self.field, self.admin_site)
+        widget.choices = forms.ModelChoiceField(queryset=queryset).choices
+        value = get_last_value_from_parameters({self.lookup_kwarg: self.lookup_val}, self.lookup_kwarg)
+        return widget.render(
+            self.lookup_kwarg, value,
+            attrs={'id': f'filter_{self.lookup_kwarg}', 'data-filter-param': self.lookup_kwarg, 'style': 'width: 100%'},
+        )
+
+    def choices(self, changelist):
+        remove = [self.lookup_kwarg, self.lookup_kwarg_isnull]
+        yield {
+            'selected': self.lookup_val is None and not self.lookup_val_isnull,
+            'query_string': changelist.get_query_string(remove=remove),
+            'display': _('All'),
+        }
+        yield {'widget': self.widget_html(), 'query_string': changelist.get_query_string(remove=remove)}
+        if self.include_empty_choice:
+            yield {
+                'selected': bool(self.lookup_val_isnull),
+                'query_string': changelist.get_query_string({self.lookup_kwarg_isnull: 'True'}, [self.lookup_kwarg]),
+                'display': self.empty_value_display,
+            }
+
+
+class PerformanceAdminMixin:
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, after=request.GET.get(AFTER_VAR))
+
+    @property
+    def media(self):
+        media = super().media
+        if any(
+            isinstance(spec, tuple) and isinstance(spec[1], type) and issubclass(spec[1], AutocompleteFilter)
+            for spec in self.list_filter
+        ):
+            media += AutocompleteSelect(None, self.admin_site).media
+        return media
@@ -0,0 +1,181 @@
+"""
+Incremental maintenance of ExamRollup.
+
+Each examination contributes a small vector of counters to four rollup rows:
+(day, month) x (its optometrist, its consultant). Saving an exam applies the
+difference between its contribution before and after the save, so the rollups
+stay exact without ever re-scanning EyeExamination.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from .models import ExamRollup
+
+PERFORMED_FIELDS = [
+    'performed_ar_assessment', 'performed_refraction', 'performed_schirmer', 'performed_tbut',
+    'performed_slit_lamp', 'performed_fundus', 'performed_iop',
+]
+SE_BUCKETS = ['se_high_myopia_eyes', 'se_myopia_eyes', 'se_emmetropia_eyes', 'se_hyperopia_eyes']
+ROLLUP_COUNTERS = [
+    'exam_count', 'referred_count', *[f'{field}_count' for field in PERFORMED_FIELDS],
+    'refraction_eyes', 'se_sum', *SE_BUCKETS,
+]
+# Columns an exam's contribution depends on
+CONTRIBUTION_FIELDS = [
+    'date_of_visit', 'optometrist_id', 'consultant_id', *PERFORMED_FIELDS,
+    'dv_sph_re_dpt', 'dv_cyl_re_dpt', 'dv_sph_le_dpt', 'dv_cyl_le_dpt',
+]
+
+
+def se_bucket(se):
+    if se <= Decimal('-6.00'):
+        return 'se_high_myopia_eyes'
+    if se <= Decimal('-0.50'):
+        return 'se_myopia_eyes'
+    if se < Decimal('0.50'):
+        return 'se_emmetropia_eyes'
+    return 'se_hyperopia_eyes'
+
+
+def rollup_keys(date_of_visit, optometrist_id, consultant_id):
+    periods = [('day', date_of_visit), ('month', date_of_visit.replace(day=1))]
+    staff = [('optometrist', optometrist_id), ('consultant', consultant_id)]
+    return [
+        (staff_id, role, period, start)
+        for role, staff_id in staff if staff_id
+        for period, start in periods
+    ]
+
+
+def exam_contribution(values):
+    """``{rollup key: {counter: amount}}`` for one exam given a mapping of its column values."""
+    if values.get('date_of_visit') is None:
+        return {}
+    counters = defaultdict(int)
+    counters['exam_count'] = 1
+    counters['referred_count'] = 1 if values.get('consultant_id') else 0
+    for field in PERFORMED_FIELDS:
+        counters[f'{field}_count'] = 1 if values.get(field) else 0
+    for eye in ('re', 'le'):
+        sph = values.get(f'dv_sph_{eye}_dpt')
+        if sph is None:
+            continue
+        se = sph + (values.get(f'dv_cyl_{eye}_dpt') or Decimal(0)) / 2
+        counters['refraction_eyes'] += 1
+        counters['se_sum'] += se
+        counters[se_bucket(se)] += 1
+    keys = rollup_keys(values['date_of_visit'], values.get('optometrist_id'), values.get('consultant_id'))
+    return {key: dict(counters) for key in keys}
+
+
+def instance_values(exam):
+    return {field: getattr(exam, field) for field in CONTRIBUTION_FIELDS}
+
+
+def combine(target, contribution, sign=1):
+    for key, counters in contribution.items():
+        row = target.setdefault(key, defaultdict(int))
+        for counter, amount in counters.items():
+            row[counter] += sign * amount
+    return target
+
+
+# Above this many rows, apply_delta switches from one UPDATE per row to batched CASE updates
+BULK_DELTA_ROWS = 16
+
+
+def apply_delta(delta):
+    """
+    Add ``{rollup key: {counter: amount}}`` to ExamRollup: one INSERT OR IGNORE, then one
+    UPDATE per row, or for large deltas (imports, backdating) a few batched UPDATEs.
+    """
+    delta = {
+        key: {counter: amount for counter, amount in counters.items() if amount}
+        for key, counters in delta.items()
+    }
+    delta = {key: counters for key, counters in delta.items() if counters}
+    if not delta:
+        return
+    with transaction.atomic():
+        ExamRollup.objects.bulk_create(
+            [
+                ExamRollup(staff_id=staff_id, staff_role=role, period=period, period_start=start)
+                for staff_id, role, period, start in delta
+            ],
+            ignore_conflicts=True,
+        )
+        if len(delta) > BULK_DELTA_ROWS:
+            _apply_bulk_delta(delta)
+            return
+        for (staff_id, role, period, start), counters in delta.items():
+            ExamRollup.objects.filter(
+                staff_id=staff_id, staff_role=role, period=period, period_start=start
+            ).update(**{counter: F(counter) + amount for counter, amount in counters.items()})
+
+
+def _apply_bulk_delta(delta):
+    """
+    ``UPDATE .. SET counter = counter + CASE id WHEN .. THEN n .. ELSE 0 END WHERE id IN (..)``
+    over chunks of rows. Increments stay relative to the stored values, so concurrent
+    writers never lose counts. Written as SQL because bulk_update() spends far longer
+    resolving per-row Case/When expressions than the database spends running them.
+    """
+    # Over-fetches at most the other role/period rows of the same staff and dates
+    ids = {
+        (staff_id, role, period, start): pk
+        for pk, staff_id, role, period, start in ExamRollup.objects.filter(
+            staff_id__in={key[0] for key in delta}, period_start__in={key[3] for key in delta}
+        ).values_list('pk', 'staff_id', 'staff_role', 'period', 'period_start')
+    }
+    rows = [(ids[key], counters) for key, counters in delta.items()]
+    connection = connections[router.db_for_write(ExamRollup)]
+    quote = connection.ops.quote_name
+    columns = {field.name: field.column for field in ExamRollup._meta.concrete_fields}
+    # Stay under SQLite's historical 999 bound parameters per statement
+    chunk_size = max(1, 999 // (2 * len(ROLLUP_COUNTERS) + 1))
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), chunk_size):
+            chunk = rows[offset:offset + chunk_size]
+            assignments, params = [], []
+            for counter in ROLLUP_COUNTERS:
+                cases = [(pk, counters[counter]) for pk, counters in chunk if counter in counters]
+                if not cases:
+                    continue
+                column = quote(columns[counter])
+                assignments.append(
+                    f"{column} = {column} + CASE {quote('id')} {' '.join(['WHEN %s THEN %s'] * len(cases))} ELSE 0 END"
+                )
+                params.extend(value for case in cases for value in case)
+            params.extend(pk for pk, _ in chunk)
+            cursor.execute(
+                f"UPDATE {quote(ExamRollup._meta.db_table)} SET {', '.join(assignments)} "
+                f"WHERE {quote('id')} IN ({', '.join(['%s'] * len(chunk))})",
+                params,
+            )
+
+
+def record_created(exams):
+    delta = {}
+    for exam in exams:
+        combine(delta, exam_contribution(instance_values(exam)))
+    apply_delta(delta)
+
+
+def record_saved(exam, created):
+    loaded = getattr(exam, '_loaded_values', {})
+    if created:
+        delta = combine({}, exam_contribution(instance_values(exam)))
+    elif all(field in loaded for field in CONTRIBUTION_FIELDS):
+        delta = combine({}, exam_contribution(instance_values(exam)))
+        combine(delta, exam_contribution(loaded), sign=-1)
+    else:
+        # Partially loaded instance: rebuild_exam_rollups will reconcile
+        return
+    apply_delta(delta)
+
+
+def record_deleted(exam):
+    apply_delta(combine({}, exam_contribution(instance_values(exam)), sign=-1))
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class OptometristConfig(AppConfig):
     name = 'optometrist'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from phase2 import db_routing  # noqa: F401  (registers its system check)
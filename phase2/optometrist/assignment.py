@@ -0,0 +1,114 @@
+import heapq
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ConsultantLoad
+
+_NEVER = datetime.min.replace(tzinfo=dt_timezone.utc)
+
+
+class ClaimConflict(Exception):
+    pass
+
+
+class AssignmentStrategy:
+    """
+    Picks consultants for referrals that were submitted without a ``consultant_id``.
+
+    Candidates are read from the ConsultantLoad counter table. Each chosen doctor is
+    then claimed with a conditional UPDATE that only matches while their row still
+    holds the values the choice was made from. If a concurrent submission changed
+    one in between, the pick is redone from fresh rows. This works without
+    SELECT ... FOR UPDATE, which SQLite ignores. The claimed rows stay written, and
+    so locked, for the rest of the caller's transaction.
+
+    On SQLite the claim makes the transaction a writer. Under the default profile
+    a concurrent writer can then fail with "database is locked", which the exam
+    create paths retry (phase2.sqlite.retry_on_database_locked).
+    SQLITE_PROFILE=high_concurrency avoids this with IMMEDIATE transactions.
+    Subclasses only decide the order in which candidates are handed out.
+    """
+    # Picks redone after a conflicting claim before the last one is kept regardless
+    claim_attempts = 5
+
+    def candidates(self, specialization=None):
+        queryset = ConsultantLoad.objects.filter(
+            consultant__role='doctor', consultant__is_active=True
+        ).select_related('consultant')
+        if specialization:
+            queryset = queryset.filter(consultant__specialization__icontains=specialization)
+        return queryset
+
+    def assign(self, specialization=None):
+        consultants = self.assign_many(1, specialization)
+        return consultants[0] if consultants else None
+
+    def assign_many(self, count, specialization=None):
+        if count <= 0:
+            return []
+        with transaction.atomic():
+            for attempt in range(self.claim_attempts):
+                loads = list(self.candidates(specialization))
+                if not loads and specialization:
+                    # Nobody with that specialization is available; any active doctor will do
+                    loads = list(self.candidates())
+                if not loads:
+                    return []
+                chosen = self.choose(loads, count)
+                try:
+                    with transaction.atomic():
+                        self.claim(loads, chosen)
+                except ClaimConflict:
+                    if attempt < self.claim_attempts - 1:
+                        continue
+                return chosen
+
+    def claim(self, loads, chosen):
+        """Stamp each chosen doctor's row if it is unchanged since ``loads`` was read; ClaimConflict otherwise."""
+        seen = {load.pk: load for load in loads}
+        now = timezone.now()
+        for pk in {consultant.pk for consultant in chosen}:
+            claimed = ConsultantLoad.objects.filter(
+                pk=pk, open_referrals=seen[pk].open_referrals, last_assigned_at=seen[pk].last_assigned_at
+            ).update(last_assigned_at=now)
+            if not claimed:
+                raise ClaimConflict
+
+    def choose(self, loads, count):
+        raise NotImplementedError
+
+
+class LeastOutstandingStrategy(AssignmentStrategy):
+    """Each referral goes to the doctor with the fewest pending referrals, oldest assignment first on ties."""
+
+    def choose(self, loads, count):
+        # (open referrals, picked in this batch?, when/order assigned, pk, consultant)
+        heap = [
+            (load.open_referrals, 0, (load.last_assigned_at or _NEVER).timestamp(), load.pk, load.consultant)
+            for load in loads
+        ]
+        heapq.heapify(heap)
+        chosen = []
+        for sequence in range(count):
+            open_referrals, _, _, pk, consultant = heapq.heappop(heap)
+            chosen.append(consultant)
+            # Later picks in the same batch see this doctor as busier and most recently assigned
+            heapq.heappush(heap, (open_referrals + 1, 1, sequence, pk, consultant))
+        return chosen
+
+
+class RoundRobinStrategy(AssignmentStrategy):
+    """Doctors take turns, starting with whoever was assigned a referral longest ago."""
+
+    def choose(self, loads, count):
+        loads.sort(key=lambda load: (load.last_assigned_at or _NEVER, load.pk))
+        return [loads[index % len(loads)].consultant for index in range(count)]
+
+
+def get_assignment_strategy():
+    path = getattr(settings, 'CONSULTANT_ASSIGNMENT_STRATEGY', 'optometrist.assignment.LeastOutstandingStrategy')
+    return import_string(path)()
@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Optometrist
+
+# Columns carried as token claims and in the per-user cache entry
+USER_CLAIM_FIELDS = ['name', 'role', 'is_active', 'is_staff']
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+def forget_cached_users(user_ids):
+    cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
+
+def user_cache_timeout():
+    return getattr(settings, 'JWT_USER_CACHE_TIMEOUT', 0)
+
+
+@checks.register(checks.Tags.caches)
+def check_user_cache(app_configs, **kwargs):
+    # Not at module level: db_routing imports DRF's views, which load this module
+    from phase2.db_routing import PER_PROCESS_CACHES
+    if user_cache_timeout() and settings.CACHES['default']['BACKEND'] in PER_PROCESS_CACHES:
+        return [checks.Warning(
+            "JWT_USER_CACHE_TIMEOUT is set with a per-process default cache.",
+            hint="Deactivating a user only evicts the cached status in the process that saved it; "
+                 "other workers accept the user's tokens until the entry expires. Set REDIS_URL or "
+                 "JWT_USER_CACHE_TIMEOUT = 0.",
+            id='optometrist.W001',
+        )]
+    return []
+
+
+class OptometristRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry the user's name, role and status as claims."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for field in USER_CLAIM_FIELDS:
+            token[field] = getattr(user, field)
+        return token
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that does not fetch the Optometrist row on every request.
+
+    The user is built from the token claims as a partially loaded Optometrist: id,
+    name, role, is_active and is_staff are set, and every other column is deferred
+    and loaded on first access. Whether the account is still active is read from the
+    database, or with JWT_USER_CACHE_TIMEOUT from a short-lived entry in the shared
+    cache. That entry is dropped whenever the user is saved or updated through a
+    queryset, so deactivation takes effect on the next request.
+    """
+
+    def get_user(self, validated_token):
+        if not all(field in validated_token for field in USER_CLAIM_FIELDS):
+            # Token issued before the claims existed
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        state = self.get_user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not state['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        # simplejwt stores the id claim as a string
+        user_id = Optometrist._meta.get_field(api_settings.USER_ID_FIELD).to_python(user_id)
+        field_names = [api_settings.USER_ID_FIELD, *USER_CLAIM_FIELDS]
+        values = [user_id, *(state[field] for field in USER_CLAIM_FIELDS)]
+        return Optometrist.from_db(router.db_for_read(Optometrist), field_names, values)
+
+    def get_user_state(self, user_id):
+        timeout = user_cache_timeout()
+        key = user_cache_key(user_id)
+        state = cache.get(key) if timeout else None
+        if state is None:
+            state = (
+                Optometrist.objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+                .values(*USER_CLAIM_FIELDS)
+                .first()
+            )
+            if state is None:
+                return None
+            if timeout:
+                cache.set(key, state, timeout=timeout)
+        return state
@@ -0,0 +1,118 @@
+"""
+Versioned cache for the optometrist/doctor directory.
+
+Every cached directory entry is stored under the current directory version. A
+change to any Optometrist bumps the version (see signals.py), which orphans all
+old entries at once; they simply expire after their TTL.
+
+Entries are built from ``default`` even in replica-routed views: a replica that
+has not caught up with the change behind a version bump would otherwise fill the
+new version's key with the old rows for a whole TTL.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.response import Response
+
+from phase2.db_routing import primary_reads
+
+from .models import Optometrist
+from .projection import stream_json
+
+VERSION_KEY = 'directory:version'
+
+
+def _config():
+    return {'ALIAS': 'default', 'TIMEOUT': 300, **getattr(settings, 'DIRECTORY_CACHE', {})}
+
+
+def directory_cache():
+    return caches[_config()['ALIAS']]
+
+
+def directory_version():
+    cache = directory_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump_directory_version():
+    cache = directory_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Version key was evicted; any non-default value still orphans old entries
+        cache.set(VERSION_KEY, directory_version() + 1, timeout=None)
+
+
+def get_or_build(name, builder):
+    """Return the cached value for ``name`` at the current version, building and storing it on a miss."""
+    cache = directory_cache()
+    key = f'directory:{name}'
+    version = directory_version()
+    value = cache.get(key, version=version)
+    if value is None:
+        with primary_reads():
+            value = builder()
+        cache.set(key, value, timeout=_config()['TIMEOUT'], version=version)
+    return value
+
+
+class DirectoryCacheMixin:
+    """
+    Caches the serialized output of list/retrieve for directory views.
+
+    Keys include the request host and scheme because ImageField URLs are absolute.
+    With a ``projection`` (see projection.py), JSON lists skip the serializer and
+    the renderer: the body is streamed from the projected rows and cached as bytes.
+    """
+    directory_cache_name = None
+    projection = None
+
+    def directory_cache_key(self, suffix):
+        return f'{self.directory_cache_name}:{self.request.scheme}://{self.request.get_host()}:{suffix}'
+
+    def list(self, request, *args, **kwargs):
+        if self.projection is not None and request.accepted_renderer.format == 'json':
+            return self.projected_list()
+
+        def build():
+            queryset = self.filter_queryset(self.get_queryset())
+            return list(self.get_serializer(queryset, many=True).data)
+        return Response(get_or_build(self.directory_cache_key('list'), build))
+
+    def projected_list(self):
+        cache = directory_cache()
+        key = f"directory:{self.directory_cache_key('list.json')}"
+        version = directory_version()
+        body = cache.get(key, version=version)
+        if body is not None:
+            return HttpResponse(body, content_type='application/json')
+
+        # Query now, from default (see the module docstring); only encoding is deferred
+        with primary_reads():
+            rows = self.projection.rows(self.filter_queryset(self.get_queryset()), self.get_serializer_context())
+
+        def stream():
+            chunks = []
+            for chunk in stream_json(rows):
+                chunks.append(chunk)
+                yield chunk
+            cache.set(key, b''.join(chunks), timeout=_config()['TIMEOUT'], version=version)
+        return StreamingHttpResponse(stream(), content_type='application/json')
+
+    def retrieve(self, request, *args, **kwargs):
+        def build():
+            return dict(self.get_serializer(self.get_object()).data)
+        return Response(get_or_build(self.directory_cache_key(f"detail:{kwargs[self.lookup_url_kwarg or self.lookup_field]}"), build))
+
+
+def active_doctor_choices():
+    """``[{'id', 'name'}]`` of active doctors for the exam form's consultant dropdown."""
+    return get_or_build(
+        'doctor_choices',
+        lambda: list(Optometrist.objects.filter(role='doctor', is_active=True).values('id', 'name')),
+    )
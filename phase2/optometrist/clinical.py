@@ -0,0 +1,138 @@
+"""
+Parsers that turn the free-text clinical fields of EyeExamination into numbers.
+
+Every parser returns ``None`` for blank or unrecognised input rather than raising,
+so a typo in one field never blocks saving an exam.
+"""
+import math
+import re
+from decimal import Decimal, InvalidOperation
+
+# Bump when a parser changes so backfill_clinical_values re-parses existing rows
+CLINICAL_VALUES_VERSION = 1
+
+_NUMBER = re.compile(r'[-+]?\d+(?:\.\d+)?|[-+]?\.\d+')
+_SNELLEN = re.compile(r'^(\d+(?:\.\d+)?)\s*/\s*(\d+(?:\.\d+)?)')
+_N_NOTATION = re.compile(r'^N\s*(\d+(?:\.\d+)?)$')
+
+# Conventional logMAR equivalents for non-chart acuities (Schulze-Bonsel et al. 2006)
+_LOW_VISION_LOGMAR = {
+    'CF': Decimal('2.00'), 'FC': Decimal('2.00'),
+    'HM': Decimal('2.30'),
+    'PL': Decimal('2.70'), 'LP': Decimal('2.70'), 'PR': Decimal('2.70'),
+    'NPL': Decimal('3.00'), 'NLP': Decimal('3.00'),
+}
+_PLANO = {'PL', 'PLANO', 'PLAN'}
+
+
+def _clean(value):
+    return (value or '').strip().upper()
+
+
+def _first_number(text):
+    match = _NUMBER.search(text)
+    if not match:
+        return None
+    try:
+        return Decimal(match.group())
+    except InvalidOperation:
+        return None
+
+
+def _bounded(value, low, high, places):
+    if value is None or not (low <= value <= high):
+        return None
+    return value.quantize(Decimal(1).scaleb(-places))
+
+
+def parse_diopters(value):
+    """Sphere or cylinder power, e.g. ``-1.25``, ``+2.00 DS``, ``plano``."""
+    text = _clean(value)
+    if not text:
+        return None
+    if text in _PLANO:
+        return Decimal('0.00')
+    return _bounded(_first_number(text), Decimal('-40'), Decimal('40'), 2)
+
+
+def parse_axis(value):
+    """Cylinder axis in degrees, e.g. ``90``, ``x180``, ``45°``."""
+    number = _first_number(_clean(value).lstrip('X'))
+    if number is None or not (0 <= number <= 180):
+        return None
+    return int(number)
+
+
+def parse_logmar(value):
+    """
+    Visual acuity as logMAR: Snellen (``6/9``, ``20/40``, ``6/6P``), decimal (``0.5``),
+    near N-notation (``N6``, with N5 taken as logMAR 0) and CF/HM/PL/NPL.
+    """
+    text = _clean(value)
+    if not text:
+        return None
+    if text in _LOW_VISION_LOGMAR:
+        return _LOW_VISION_LOGMAR[text]
+    for prefix, logmar in _LOW_VISION_LOGMAR.items():
+        if text.startswith(prefix + ' '):
+            return logmar
+
+    snellen = _SNELLEN.match(text)
+    if snellen:
+        distance, letter_size = Decimal(snellen.group(1)), Decimal(snellen.group(2))
+        if distance <= 0 or letter_size <= 0:
+            return None
+        logmar = Decimal(math.log10(letter_size / distance))
+    else:
+        near = _N_NOTATION.match(text)
+        if near:
+            size = Decimal(near.group(1))
+            if size <= 0:
+                return None
+            logmar = Decimal(math.log10(size / 5))
+        else:
+            decimal_acuity = _first_number(text)
+            if decimal_acuity is None or not (0 < decimal_acuity <= 2):
+                return None
+            logmar = Decimal(-math.log10(decimal_acuity))
+    return _bounded(logmar, Decimal('-0.50'), Decimal('3.00'), 2)
+
+
+def parse_measurement(value, high):
+    """First number in a measurement such as ``16 mmHg`` or ``10 sec``, within ``0..high``."""
+    return _bounded(_first_number(_clean(value)), Decimal('0'), Decimal(high), 1)
+
+
+def parse_iop(value):
+    return parse_measurement(value, 80)
+
+
+def parse_seconds(value):
+    return parse_measurement(value, 120)
+
+
+def parse_millimetres(value):
+    return parse_measurement(value, 60)
+
+
+# (text field, numeric companion, parser)
+NUMERIC_FIELDS = [
+    *[(f'{kind}_vision_{eye}', f'{kind}_vision_{eye}_logmar', parse_logmar)
+      for kind in ('uncorrected', 'pinhole', 'corrected') for eye in ('re', 'le')],
+    *[(f'{distance}_{part}_{eye}', f'{distance}_{part}_{eye}_dpt', parse_diopters)
+      for distance in ('dv', 'nv') for part in ('sph', 'cyl') for eye in ('re', 'le')],
+    *[(f'{distance}_axis_{eye}', f'{distance}_axis_{eye}_deg', parse_axis)
+      for distance in ('dv', 'nv') for eye in ('re', 'le')],
+    *[(f'{distance}_vision_{eye}', f'{distance}_vision_{eye}_logmar', parse_logmar)
+      for distance in ('dv', 'nv') for eye in ('re', 'le')],
+    *[(f'iop_{eye}', f'iop_{eye}_mmhg', parse_iop) for eye in ('re', 'le')],
+    *[(f'tbut_{eye}', f'tbut_{eye}_sec', parse_seconds) for eye in ('re', 'le')],
+    *[(f'schirmer_{eye}', f'schirmer_{eye}_mm', parse_millimetres) for eye in ('re', 'le')],
+]
+NUMERIC_SOURCE_FIELDS = [source for source, _, _ in NUMERIC_FIELDS]
+NUMERIC_TARGET_FIELDS = [target for _, target, _ in NUMERIC_FIELDS]
+
+
+def parse_clinical_values(instance):
+    """Return ``{numeric field: value}`` parsed from an exam's text fields."""
+    return {target: parser(getattr(instance, source)) for source, target, parser in NUMERIC_FIELDS}
@@ -0,0 +1,138 @@
+"""
+Streaming CSV/NDJSON export of examinations.
+
+Rows are read in keyset-paginated batches (``id > last_id ORDER BY id LIMIT n``)
+of plain values() tuples, and each batch's medications come from one extra
+query. Only one batch is held in memory at a time, however large the date range,
+and no cursor stays open while a slow client is reading the response.
+"""
+import csv
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+from .clinical import NUMERIC_TARGET_FIELDS
+from .models import EyeExamination, Medication
+
+EXAM_COLUMNS = [
+    ('exam_id', 'id'),
+    ('date_of_visit', 'date_of_visit'),
+    ('created_at', 'created_at'),
+    ('status', 'status'),
+    ('patient_id', 'patient_id'),
+    ('patient_name', 'patient__name'),
+    ('patient_age', 'patient__age'),
+    ('patient_gender', 'patient__gender'),
+    ('patient_phone', 'patient__phone_number'),
+    ('optometrist_id', 'optometrist_id'),
+    ('optometrist_name', 'optometrist__name'),
+    ('consultant_id', 'consultant_id'),
+    ('consultant_name', 'consultant__name'),
+    *[(field, field) for field in [
+        'chief_complaints', 'systemic_history', 'screen_time', 'history_eye_disease', 'history_eye_surgery',
+        'uncorrected_vision_re', 'pinhole_vision_re', 'corrected_vision_re',
+        'uncorrected_vision_le', 'pinhole_vision_le', 'corrected_vision_le',
+        'dv_sph_re', 'dv_cyl_re', 'dv_axis_re', 'dv_vision_re', 'dv_sph_le', 'dv_cyl_le', 'dv_axis_le', 'dv_vision_le',
+        'nv_sph_re', 'nv_cyl_re', 'nv_axis_re', 'nv_vision_re', 'nv_sph_le', 'nv_cyl_le', 'nv_axis_le', 'nv_vision_le',
+        'performed_ar_assessment', 'performed_refraction', 'performed_schirmer', 'performed_tbut',
+        'performed_slit_lamp', 'performed_fundus', 'performed_iop',
+        'schirmer_re', 'schirmer_le', 'tbut_re', 'tbut_le', 'slit_lamp_re', 'slit_lamp_le',
+        'fundus_re', 'fundus_le', 'iop_re', 'iop_le', 'provisional_diagnosis', 'advice',
+        *NUMERIC_TARGET_FIELDS,
+    ]],
+]
+MEDICATION_FIELDS = ['name', 'eye', 'frequency', 'duration', 'quantity', 'instructions']
+HEADER = [name for name, _ in EXAM_COLUMNS] + ['medications']
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_rows(exams, batch_size=2000):
+    """Yield one list of (exam dict, medication dicts) tuples per batch, in id order."""
+    lookups = [lookup for _, lookup in EXAM_COLUMNS]
+    names = [name for name, _ in EXAM_COLUMNS]
+    last_id = 0
+    while True:
+        batch = list(exams.filter(pk__gt=last_id).order_by('pk').values_list(*lookups)[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1][0]
+        medications = {}
+        for examination_id, *values in (
+            Medication.objects.filter(examination_id__in=[row[0] for row in batch])
+            .order_by('examination_id', 'id')
+            .values_list('examination_id', *MEDICATION_FIELDS)
+        ):
+            medications.setdefault(examination_id, []).append(dict(zip(MEDICATION_FIELDS, values)))
+        yield [(dict(zip(names, row)), medications.get(row[0], [])) for row in batch]
+        if len(batch) < batch_size:
+            return
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+class _Echo:
+    """File-like object whose write() hands back what it was given, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(exams, batch_size=2000):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(HEADER)
+    for batch in export_rows(exams, batch_size):
+        lines = []
+        for exam, medications in batch:
+            summary = '; '.join(
+                ' | '.join(medication[field] or '' for field in MEDICATION_FIELDS[:5]) for medication in medications
+            )
+            lines.append(writer.writerow([*('' if value is None else value for value in exam.values()), summary]))
+        yield ''.join(lines)
+
+
+def stream_ndjson(exams, batch_size=2000):
+    for batch in export_rows(exams, batch_size):
+        yield ''.join(
+            json.dumps({**exam, 'medications': medications}, default=_json_default) + '\n'
+            for exam, medications in batch
+        )
+
+
+STREAMERS = {'csv': stream_csv, 'ndjson': stream_ndjson}
+
+
+def encode(chunks, compress=False):
+    """UTF-8 encode the text chunks, gzip-compressing them on the fly when asked."""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode()
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def filter_exams(exams, start=None, end=None, optometrist=None, consultant=None):
+    if start:
+        exams = exams.filter(date_of_visit__gte=start)
+    if end:
+        exams = exams.filter(date_of_visit__lte=end)
+    if optometrist:
+        exams = exams.filter(optometrist_id=optometrist)
+    if consultant:
+        exams = exams.filter(consultant_id=consultant)
+    return exams
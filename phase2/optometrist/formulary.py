@@ -0,0 +1,172 @@
+"""
+Medication autocomplete from an in-process prefix index of the formulary.
+
+FormularyIndex holds the active FormularyEntry rows as ready-made result rows,
+most prescribed first, plus one sorted list of the words in their labels. A
+lookup bisects that list for the query's longest word and scans the words that
+start with it, so answering a keystroke costs no query and no cache round trip.
+
+Each process builds the index when the server starts (warm_index, called from
+wsgi.py and asgi.py) and rebuilds it when the formulary version moves on. The
+version is the entry count, latest updated_at and number of prescriptions made
+from the formulary (which the ordering follows), read from the database at most
+every CHECK_SECONDS, so every process notices a change within that time; the
+one that made it (signals.py) and any lookup of an id the index does not know
+check at once.
+"""
+import heapq
+import logging
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Count, Max
+
+from .models import FormularyEntry
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r'[^\W_]+(?:\.\d+)?')
+
+
+def _config():
+    return {'CHECK_SECONDS': 5, 'LIMIT': 10, **getattr(settings, 'FORMULARY', {})}
+
+
+def formulary_version():
+    """(entry count, latest updated_at, prescription count): a save moves updated_at on, a delete the count."""
+    version = FormularyEntry.objects.aggregate(
+        count=Count('pk', distinct=True), updated_at=Max('updated_at'), prescriptions=Count('prescriptions'),
+    )
+    return version['count'], version['updated_at'], version['prescriptions']
+
+
+def words(text):
+    """Lower-cased words of ``text``; decimals such as 0.5 stay one word."""
+    return _WORD.findall((text or '').casefold())
+
+
+class FormularyIndex:
+    """Immutable snapshot of the active formulary; a refresh replaces it whole."""
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.rows = tuple(rows)
+        self.positions_by_id = {row['id']: position for position, row in enumerate(self.rows)}
+        self.row_words = tuple(tuple(words(row['name'])) for row in self.rows)
+        keys = sorted({(word, position) for position, row_words in enumerate(self.row_words) for word in row_words})
+        self.words = [word for word, _ in keys]
+        self.word_positions = array('I', [position for _, position in keys])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, pk):
+        position = self.positions_by_id.get(pk)
+        return None if position is None else self.rows[position]
+
+    def lookup(self, text, limit):
+        """Rows whose label has a word starting with every word of ``text``; labels starting with it first."""
+        terms = words(text)
+        if not terms:
+            return []
+        anchor = max(terms, key=len)
+        # Every word starting with the anchor sorts between these two bounds
+        matches = set(self.word_positions[
+            bisect_left(self.words, anchor):bisect_left(self.words, anchor + '\U0010ffff')
+        ])
+        others = [term for term in terms if term != anchor]
+        if others:
+            matches = {
+                position for position in matches
+                if all(any(word.startswith(term) for word in self.row_words[position]) for term in others)
+            }
+        # Rows are stored most prescribed first, so position breaks ties
+        first, demoted = terms[0], len(self.rows)
+        ranked = heapq.nsmallest(
+            limit, matches,
+            key=lambda position: position if self.row_words[position][0].startswith(first) else position + demoted,
+        )
+        return [self.rows[position] for position in ranked]
+
+
+def load_rows():
+    entries = (
+        FormularyEntry.objects.filter(is_active=True)
+        .annotate(prescription_count=Count('prescriptions'))
+        .order_by('-prescription_count', 'drug', 'strength', 'dosage_form')
+    )
+    return [
+        {
+            'id': entry.pk,
+            'name': entry.label,
+            'drug': entry.drug,
+            'strength': entry.strength,
+            'dosage_form': entry.dosage_form,
+            'quantity': entry.default_quantity,
+            'frequency': entry.default_frequency,
+            'eye': entry.default_eye,
+            'duration': entry.default_duration,
+            'instructions': entry.default_instructions,
+        }
+        for entry in entries
+    ]
+
+
+_lock = threading.Lock()
+_index = None
+_checked_at = 0.0
+
+
+def get_index(check=False):
+    """This process's index, rebuilt first if the formulary changed; ``check`` skips the CHECK_SECONDS wait."""
+    global _index, _checked_at
+    index = _index
+    if index is not None and not check and time.monotonic() - _checked_at < _config()['CHECK_SECONDS']:
+        return index
+    with _lock:
+        # Read the version before the rows: an entry committed in between only causes one extra rebuild
+        version = formulary_version()
+        if _index is None or _index.version != version:
+            _index = FormularyIndex(load_rows(), version)
+        _checked_at = time.monotonic()
+        return _index
+
+
+def autocomplete(text, limit=None):
+    return get_index().lookup(text, limit or _config()['LIMIT'])
+
+
+def get_entry(pk):
+    """The active entry's row, or None. An id this process has not seen yet triggers a version check."""
+    row = get_index().get(pk)
+    if row is None:
+        row = get_index(check=True).get(pk)
+    return row
+
+
+def formulary_changed():
+    global _checked_at
+    _checked_at = 0.0
+
+
+def warm_index():
+    """Build this process's index before the first request needs it."""
+    def load():
+        try:
+            get_index()
+        except DatabaseError:
+            # e.g. before the first migrate; the first lookup builds the index instead
+            logger.warning("Formulary index not loaded at startup", exc_info=True)
+        finally:
+            # Do not hand a connection opened here to forked workers
+            connections.close_all()
+
+    # On a thread of its own (and waited for), as ASGI servers may import the application inside their event loop
+    thread = threading.Thread(target=load, name='formulary-warm-up')
+    thread.start()
+    thread.join()
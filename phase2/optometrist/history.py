@@ -0,0 +1,152 @@
+"""
+Longitudinal history of one patient: every exam in visit order, with
+medications, plus per-eye trend series of refraction, acuity and IOP.
+
+A history costs three queries to build (patient, exams with their staff,
+medications), and the series come from one NumPy pass over the exams' parsed
+numeric columns (see optometrist.clinical). The result is cached under a
+digest of the rows it is built from (the patient's, their exams' and
+medications' counts and latest updated_at, and the staff's latest updated_at),
+read with one aggregate query, as report_fingerprints does for reports. Any
+change committed by any process gives a new key, so the cache needs no
+invalidation and a per-process cache is never stale, only colder.
+"""
+import hashlib
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Max, Prefetch
+
+from .models import EyeExamination, Medication, Patient
+
+EYES = ('re', 'le')
+# Series name -> parsed numeric column, per eye
+SERIES = {
+    'sphere': 'dv_sph_{eye}_dpt',
+    'cylinder': 'dv_cyl_{eye}_dpt',
+    'axis': 'dv_axis_{eye}_deg',
+    'uncorrected_acuity': 'uncorrected_vision_{eye}_logmar',
+    'corrected_acuity': 'corrected_vision_{eye}_logmar',
+    'iop': 'iop_{eye}_mmhg',
+}
+COLUMNS = [template.format(eye=eye) for eye in EYES for template in SERIES.values()]
+
+
+def _config():
+    return {'ALIAS': 'default', 'TIMEOUT': 60 * 60 * 24, **getattr(settings, 'PATIENT_HISTORY_CACHE', {})}
+
+
+def history_cache():
+    return caches[_config()['ALIAS']]
+
+
+def history_version(patient_id):
+    """Digest of the rows the patient's history is built from, in one query; None if there is no such patient."""
+    state = (
+        Patient.objects.filter(pk=patient_id)
+        .annotate(
+            exam_count=Count('examinations', distinct=True),
+            exams_updated_at=Max('examinations__updated_at'),
+            medication_count=Count('examinations__medications', distinct=True),
+            medications_updated_at=Max('examinations__medications__updated_at'),
+            # Histories print the staff names
+            optometrists_updated_at=Max('examinations__optometrist__updated_at'),
+            consultants_updated_at=Max('examinations__consultant__updated_at'),
+        )
+        .values_list(
+            'updated_at', 'exam_count', 'exams_updated_at', 'medication_count', 'medications_updated_at',
+            'optometrists_updated_at', 'consultants_updated_at',
+        )
+        .first()
+    )
+    if state is None:
+        return None
+    return hashlib.sha256(':'.join(str(value) for value in state).encode()).hexdigest()
+
+
+def _nullable(values):
+    return np.where(np.isnan(values), None, np.round(values, 2)).tolist()
+
+
+def build_series(exams):
+    """
+    ``{eye: {name: {'values': [...], 'first', 'last', 'change', 'min', 'max'}}}``, values
+    aligned with ``exams``. Missing or unparseable readings are None. Spherical
+    equivalent (sphere + cylinder / 2) is derived alongside the stored series.
+    """
+    names = [*SERIES, 'spherical_equivalent']
+    if not exams:
+        return {eye: {name: {'values': [], 'first': None, 'last': None, 'change': None, 'min': None, 'max': None}
+                      for name in names} for eye in EYES}
+
+    raw = np.array([[getattr(exam, column) for column in COLUMNS] for exam in exams], dtype=object)
+    # (exams, eyes, series)
+    values = np.where(raw == None, np.nan, raw).astype(np.float64).reshape(len(exams), len(EYES), len(SERIES))  # noqa: E711
+    sphere, cylinder = values[:, :, 0], values[:, :, 1]
+    equivalent = sphere + np.nan_to_num(cylinder) / 2
+    values = np.concatenate([values, equivalent[:, :, np.newaxis]], axis=2)
+
+    known = ~np.isnan(values)
+    measured = known.any(axis=0)
+    rows = np.arange(len(exams))[:, np.newaxis, np.newaxis]
+    first_index = np.where(known, rows, len(exams)).min(axis=0)
+    last_index = np.where(known, rows, -1).max(axis=0)
+    eye_index, series_index = np.indices(measured.shape)
+    first = np.where(measured, values[np.clip(first_index, 0, len(exams) - 1), eye_index, series_index], np.nan)
+    last = np.where(measured, values[np.clip(last_index, 0, len(exams) - 1), eye_index, series_index], np.nan)
+    lowest = np.where(measured, np.where(known, values, np.inf).min(axis=0), np.nan)
+    highest = np.where(measured, np.where(known, values, -np.inf).max(axis=0), np.nan)
+
+    columns = {
+        'values': _nullable(values.transpose(1, 2, 0)),
+        'first': _nullable(first),
+        'last': _nullable(last),
+        'change': _nullable(last - first),
+        'min': _nullable(lowest),
+        'max': _nullable(highest),
+    }
+    return {
+        eye: {
+            name: {key: column[eye_position][position] for key, column in columns.items()}
+            for position, name in enumerate(names)
+        }
+        for eye_position, eye in enumerate(EYES)
+    }
+
+
+def build_history(patient_id):
+    from .serializers import PatientSerializer, PatientHistoryExamSerializer
+    patient = Patient.objects.filter(pk=patient_id).first()
+    if patient is None:
+        return None
+    exams = list(
+        EyeExamination.objects.filter(patient=patient)
+        .select_related('optometrist', 'consultant')
+        .prefetch_related(Prefetch('medications', queryset=Medication.objects.order_by('id')))
+        .order_by('date_of_visit', 'created_at', 'id')
+    )
+    return {
+        'patient': PatientSerializer(patient).data,
+        'exams': PatientHistoryExamSerializer(exams, many=True).data,
+        'series': {
+            'exam_ids': [exam.pk for exam in exams],
+            'dates': [exam.date_of_visit.isoformat() for exam in exams],
+            **build_series(exams),
+        },
+    }
+
+
+def get_history(patient_id):
+    """The patient's history, from the cache when nothing changed since it was built; None if no such patient."""
+    version = history_version(patient_id)
+    if version is None:
+        return None
+    cache = history_cache()
+    key = f'patient-history:{patient_id}:{version}'
+    history = cache.get(key)
+    if history is None:
+        history = build_history(patient_id)
+        if history is not None:
+            cache.set(key, history, timeout=_config()['TIMEOUT'])
+    return history
@@ -0,0 +1,112 @@
+"""
+Idempotency-Key support for create endpoints.
+
+A client that may retry a POST (a timeout on a clinic network leaves it unsure
+whether the exam was saved) sends the same ``Idempotency-Key`` header with every
+attempt. The first attempt claims the key by inserting an IdempotencyKey row,
+runs the view and stores its response, all in one transaction, so the key is
+never recorded without the rows it created or vice versa. Later attempts hit
+the unique constraint and get the stored response back without touching the
+exam tables.
+
+Concurrent attempts are serialized on the key alone: on PostgreSQL the second
+INSERT waits on the first transaction's uncommitted index entry for that key
+and then sees the stored response (or, if the first rolled back, proceeds
+itself). SQLite serializes all writers anyway.
+
+Only responses below 400 are kept; after a validation error the claim rolls
+back with everything else, so the client can correct the request and retry with
+the same key. Keys live for IDEMPOTENCY['TTL_SECONDS']; purge_idempotency_keys
+deletes expired ones, and an expired key is reclaimed on its next use.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from phase2.sqlite import retry_on_database_locked
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def _config():
+    return {'TTL_SECONDS': 60 * 60 * 24, **getattr(settings, 'IDEMPOTENCY', {})}
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{request.path}\n{body}'.encode()).hexdigest()
+
+
+def replay(record):
+    return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def claim(request, key, fingerprint):
+    """Insert the key inside the caller's transaction; returns the existing live record if there is one."""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(
+                user=request.user, key=key, path=request.path, fingerprint=fingerprint,
+                expires_at=now + timedelta(seconds=_config()['TTL_SECONDS']),
+            )
+        return None
+    except IntegrityError:
+        existing = IdempotencyKey.objects.get(user=request.user, key=key)
+    if existing.expires_at <= now:
+        existing.delete()
+        return claim(request, key, fingerprint)
+    return existing
+
+
+@retry_on_database_locked()
+def run_once(request, key, handler):
+    """Run ``handler()`` unless ``key`` was already used by this user, in which case replay its response."""
+    fingerprint = request_fingerprint(request)
+    with transaction.atomic():
+        existing = claim(request, key, fingerprint)
+        if existing is not None:
+            if existing.fingerprint != fingerprint:
+                return Response(
+                    {'error': f'This {HEADER} was already used for a different request.'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            return replay(existing)
+
+        response = handler()
+        if response.status_code >= 400:
+            transaction.set_rollback(True)
+            return response
+        IdempotencyKey.objects.filter(user=request.user, key=key).update(
+            status_code=response.status_code,
+            response=json.loads(json.dumps(response.data, cls=DjangoJSONEncoder)),
+        )
+    return response
+
+
+def idempotent(post):
+    """
+    Decorator for a view's ``post``: a request with an ``Idempotency-Key`` header runs
+    at most once per key and user, and retries get the first attempt's response.
+    """
+    @wraps(post)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return post(self, request, *args, **kwargs)
+        if not key.strip() or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters.'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return run_once(request, key, lambda: post(self, request, *args, **kwargs))
+    return wrapper
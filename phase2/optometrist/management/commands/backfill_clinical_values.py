@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from optometrist.clinical import CLINICAL_VALUES_VERSION, NUMERIC_SOURCE_FIELDS, NUMERIC_TARGET_FIELDS
+from optometrist.models import EyeExamination
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the numeric refraction/acuity/IOP columns of existing examinations from their text fields. "
+        "Rows are processed in id order, one transaction per chunk; re-running resumes with the rows "
+        "that are still missing the current parser version."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many rows.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        limit = options['limit']
+        stale = EyeExamination.objects.filter(clinical_values_version__lt=CLINICAL_VALUES_VERSION)
+        total = stale.count() if limit is None else min(limit, stale.count())
+        self.stdout.write(f"{total} examinations to backfill.")
+
+        done, last_id, started = 0, 0, time.monotonic()
+        while limit is None or done < limit:
+            size = chunk_size if limit is None else min(chunk_size, limit - done)
+            chunk = list(
+                stale.filter(id__gt=last_id).order_by('id').only('id', *NUMERIC_SOURCE_FIELDS)[:size]
+            )
+            if not chunk:
+                break
+            now = timezone.now()
+            for exam in chunk:
+                exam.populate_clinical_values()
+                exam.updated_at = now
+            with transaction.atomic():
+                # Bump updated_at as a save() would: history and report fingerprints key on it
+                EyeExamination.objects.bulk_update(
+                    chunk, [*NUMERIC_TARGET_FIELDS, 'clinical_values_version', 'updated_at']
+                )
+            done += len(chunk)
+            last_id = chunk[-1].id
+            rate = done / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(f"  {done}/{total} (last id {last_id}, {rate:.0f} rows/s)")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {done} examinations."))
@@ -0,0 +1,213 @@
+import json
+import math
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from optometrist.management.commands.seed_clinic import ADMIN_PHONE, PHONE_PREFIX, SEED_PASSWORD
+from optometrist.models import Optometrist, Patient, EyeExamination
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark login, exam creation, the doctor dashboard, list/detail APIs and admin changelists "
+        "in-process against data from seed_clinic. Reports latency percentiles, throughput and SQL "
+        "queries per request. --save-baseline records the results; later runs fail when a scenario "
+        "issues more queries than its baseline or its p95 latency exceeds it by more than --tolerance. "
+        "Exam creation writes real rows, so run it against a disposable seeded database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--scenario', action='append', help="Only run the named scenario(s).")
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+        parser.add_argument('--save-baseline', action='store_true')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help="Allowed relative p95 slowdown before a scenario counts as regressed (0.5 = 50%%).",
+        )
+
+    def seeded_user(self, role):
+        user = (
+            Optometrist.objects.filter(role=role, phone_number__startswith=PHONE_PREFIX, is_active=True)
+            .exclude(phone_number=ADMIN_PHONE)
+            .order_by('pk')
+            .first()
+        )
+        if user is None:
+            raise CommandError(f"No seeded {role} found; run `manage.py seed_clinic` first.")
+        return user
+
+    def access_token(self, client, url, user):
+        response = client.post(url, {'phone_number': user.phone_number, 'password': SEED_PASSWORD})
+        if response.status_code != 200:
+            raise CommandError(f"Could not log in {user.phone_number} at {url}: {response.status_code}")
+        return response.json()['access']
+
+    def scenarios(self):
+        optometrist = self.seeded_user('optometrist')
+        doctor = (
+            Optometrist.objects.filter(role='doctor', phone_number__startswith=PHONE_PREFIX)
+            .exclude(exams_consulted=None)
+            .order_by('pk')
+            .first()
+        ) or self.seeded_user('doctor')
+        admin = Optometrist.objects.filter(phone_number=ADMIN_PHONE, is_superuser=True).first()
+        referral = EyeExamination.objects.filter(consultant=doctor).order_by('-created_at', '-id').first()
+        patient = Patient.objects.order_by('pk').first()
+        if referral is None or patient is None:
+            raise CommandError("No seeded examinations found; run `manage.py seed_clinic` first.")
+
+        anonymous = Client()
+        optometrist_api = Client(HTTP_AUTHORIZATION=f"Bearer {self.access_token(anonymous, '/api/login/', optometrist)}")
+        doctor_api = Client(HTTP_AUTHORIZATION=f"Bearer {self.access_token(anonymous, '/doctor/api/login/', doctor)}")
+        doctor_session = Client()
+        doctor_session.force_login(doctor)
+        admin_session = Client()
+        if admin is not None:
+            admin_session.force_login(admin)
+
+        exam_payload = json.dumps({
+            'patient_id': patient.pk,
+            'chief_complaints': 'Blurred distance vision',
+            'uncorrected_vision_re': '6/18', 'uncorrected_vision_le': '6/12',
+            'dv_sph_re': '-1.25', 'dv_cyl_re': '-0.50', 'dv_axis_re': '180', 'dv_vision_re': '6/6',
+            'dv_sph_le': '-1.00', 'dv_vision_le': '6/6',
+            'performed_refraction': True, 'performed_iop': True, 'iop_re': '16 mmHg', 'iop_le': '17 mmHg',
+            'provisional_diagnosis': 'Compound myopic astigmatism',
+            'advice': 'Spectacles',
+            'medications': [{'name': 'Carboxymethylcellulose 0.5%', 'quantity': '1 bottle', 'frequency': 'QID', 'duration': '1 month'}],
+        })
+        login_data = {'phone_number': optometrist.phone_number, 'password': SEED_PASSWORD}
+
+        scenarios = {
+            'login': lambda: anonymous.post('/api/login/', login_data),
+            'exam_create': lambda: optometrist_api.post(
+                '/api/exams/create/', exam_payload, content_type='application/json'
+            ),
+            'doctor_dashboard': lambda: doctor_session.get('/doctor/'),
+            'referral_list': lambda: doctor_api.get('/doctor/api/referrals/'),
+            'referral_detail': lambda: doctor_api.get(f'/doctor/api/referrals/{referral.pk}/'),
+            'optometrist_list': lambda: anonymous.get('/api/list/'),
+            'optometrist_detail': lambda: anonymous.get(f'/api/{optometrist.pk}/'),
+            'doctor_list': lambda: optometrist_api.get('/doctor/api/list/'),
+            'patient_search': lambda: optometrist_api.get('/api/patients/search/', {'q': patient.name[:3]}),
+        }
+        if admin is not None:
+            scenarios.update({
+                'admin_exam_changelist': lambda: admin_session.get('/admin/optometrist/eyeexamination/'),
+                'admin_patient_changelist': lambda: admin_session.get('/admin/optometrist/patient/'),
+                'admin_optometrist_changelist': lambda: admin_session.get('/admin/optometrist/optometrist/'),
+            })
+        else:
+            self.stderr.write(f"Superuser {ADMIN_PHONE} not found; skipping admin changelists.")
+        return scenarios
+
+    def measure(self, request, iterations, warmup):
+        for _ in range(warmup):
+            request()
+        latencies, queries, failures = [], [], 0
+        started = time.perf_counter()
+        for _ in range(iterations):
+            with CaptureQueriesContext(connections['default']) as captured:
+                request_started = time.perf_counter()
+                response = request()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                latencies.append((time.perf_counter() - request_started) * 1000)
+            queries.append(len(captured))
+            if response.status_code >= 400:
+                failures += 1
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        return {
+            'iterations': iterations,
+            'failures': failures,
+            'status': response.status_code,
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'throughput_rps': round(iterations / elapsed, 1),
+            'queries': max(queries),
+        }
+
+    def compare(self, name, result, baseline, tolerance):
+        problems = []
+        if result['queries'] > baseline['queries']:
+            problems.append(f"{name}: {result['queries']} queries, baseline {baseline['queries']}")
+        limit = baseline['p95_ms'] * (1 + tolerance)
+        if result['p95_ms'] > limit:
+            problems.append(f"{name}: p95 {result['p95_ms']:.2f} ms, baseline {baseline['p95_ms']:.2f} ms (limit {limit:.2f} ms)")
+        return problems
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError("--iterations must be at least 1.")
+        scenarios = self.scenarios()
+        if options['scenario']:
+            unknown = set(options['scenario']) - set(scenarios)
+            if unknown:
+                raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}. Known: {', '.join(scenarios)}")
+            scenarios = {name: scenarios[name] for name in options['scenario']}
+
+        baseline_path = Path(options['baseline'])
+        baseline = {}
+        if baseline_path.exists() and not options['save_baseline']:
+            baseline = json.loads(baseline_path.read_text())
+            seeded = baseline.get('dataset', {})
+            current = self.dataset()
+            if seeded and seeded != current:
+                self.stderr.write(f"Dataset differs from the baseline's ({current} vs {seeded}); latencies may not compare.")
+
+        self.stdout.write(
+            f"{'scenario':<30}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'queries':>9}{'status':>8}"
+        )
+        results, problems = {}, []
+        for name, request in scenarios.items():
+            result = results[name] = self.measure(request, options['iterations'], options['warmup'])
+            self.stdout.write(
+                f"{name:<30}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+                f"{result['throughput_rps']:>9.1f}{result['queries']:>9}{result['status']:>8}"
+            )
+            if result['failures']:
+                problems.append(f"{name}: {result['failures']}/{result['iterations']} requests failed (last status {result['status']})")
+            if name in baseline.get('scenarios', {}):
+                problems.extend(self.compare(name, result, baseline['scenarios'][name], options['tolerance']))
+
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            saved = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+            saved['dataset'] = self.dataset()
+            saved.setdefault('scenarios', {}).update(results)
+            baseline_path.write_text(json.dumps(saved, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline for {len(results)} scenarios to {baseline_path}"))
+
+        if problems:
+            raise CommandError("Performance regressions:\n  " + "\n  ".join(problems))
+        if baseline:
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def dataset(self):
+        return {
+            'vendor': connections['default'].vendor,
+            'staff': Optometrist.objects.count(),
+            'patients': Patient.objects.count(),
+        }
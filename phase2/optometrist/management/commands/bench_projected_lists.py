@@ -0,0 +1,124 @@
+import time
+
+from django.contrib.auth.models import Group, Permission
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from optometrist.models import Optometrist
+from optometrist.projection import stream_json
+from optometrist.serializers import OPTOMETRIST_PROFILE_PROJECTION, OptometristProfileSerializer
+from optometrist.thumbnails import variant_specs
+
+PHONE_PREFIX = '79'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the projected directory lists (/api/list/, /doctor/api/list/) against "
+        "OptometristProfileSerializer rendered by JSONRenderer, with and without prefetching. Adds --rows "
+        "synthetic optometrists with groups, permissions and pictures inside a transaction that is rolled "
+        "back. That the outputs are byte-identical is covered by optometrist.tests.ProjectedDirectoryTests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3, help="Timed runs per path; the best one is reported.")
+
+    def add_rows(self, count):
+        groups = [Group.objects.get_or_create(name=f'Bench group {n}')[0] for n in range(3)]
+        permissions = list(Permission.objects.order_by('pk')[:4])
+        specs = list(variant_specs())
+        profiles = []
+        for n in range(count):
+            picture = f'optometrists/bench-{n}.jpg' if n % 3 else ''
+            profiles.append(Optometrist(
+                name=f'Bench Optometrist {n} – Ünïcode ',
+                phone_number=f'{PHONE_PREFIX}{n:08d}',
+                email=f'bench{n}@example.com' if n % 4 else None,
+                role='doctor' if n % 5 == 0 else 'optometrist',
+                license_number=f'BENCH-{n}' if n % 2 else None,
+                qualification='OD' if n % 2 else None,
+                experience_years=n % 40,
+                bio='Line one\nline "two"' if n % 7 == 0 else None,
+                profile_picture=picture,
+                # Every other picture has current variants; the rest fall back to the original
+                profile_picture_variants=(
+                    {'source': picture, **{name: f'optometrists/variants/{n}-{name}.webp' for name in specs}}
+                    if picture and n % 2 else {}
+                ),
+                website='https://example.com/' if n % 6 == 0 else None,
+                is_active=n % 50 != 0,
+                password='!',
+            ))
+        created = Optometrist.objects.bulk_create(profiles, batch_size=1000)
+        Through = Optometrist.groups.through
+        Through.objects.bulk_create([
+            Through(optometrist_id=profile.pk, group_id=group.pk)
+            for n, profile in enumerate(created) for group in groups[:n % 4]
+        ], batch_size=1000)
+        PermissionThrough = Optometrist.user_permissions.through
+        PermissionThrough.objects.bulk_create([
+            PermissionThrough(optometrist_id=profile.pk, permission_id=permission.pk)
+            for n, profile in enumerate(created) if n % 9 == 0 for permission in reversed(permissions)
+        ], batch_size=1000)
+
+    def best_of(self, repeat, run):
+        timings, queries = [], []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        for _ in range(repeat):
+            queries.clear()
+            with connections['default'].execute_wrapper(count):
+                started = time.perf_counter()
+                body = run()
+                timings.append(time.perf_counter() - started)
+        return body, min(timings) * 1000, len(queries)
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['repeat'] < 1:
+            raise CommandError("--rows and --repeat must be at least 1.")
+        request = Request(RequestFactory().get('/api/list/'))
+        context = {'request': request}
+        lists = {
+            'optometrist_list': Optometrist.objects.filter(is_active=True),
+            'doctor_list': Optometrist.objects.filter(role='doctor', is_active=True),
+        }
+
+        try:
+            with transaction.atomic():
+                self.add_rows(options['rows'])
+                self.stdout.write(
+                    f"{'list':<18}{'rows':>7}{'serializer ms':>15}{'prefetched ms':>15}{'projected ms':>14}"
+                    f"{'speedup':>9}{'vs prefetched':>15}{'queries':>9}"
+                )
+                for name, queryset in lists.items():
+                    def serialized(queryset=queryset):
+                        return JSONRenderer().render(OptometristProfileSerializer(queryset, many=True, context=context).data)
+
+                    def prefetched(queryset=queryset):
+                        queryset = queryset.prefetch_related('groups', 'user_permissions')
+                        return JSONRenderer().render(OptometristProfileSerializer(queryset, many=True, context=context).data)
+
+                    def projected(queryset=queryset):
+                        return b''.join(stream_json(OPTOMETRIST_PROFILE_PROJECTION.rows(queryset, context)))
+
+                    serializer_ms = self.best_of(options['repeat'], serialized)[1]
+                    prefetched_ms = self.best_of(options['repeat'], prefetched)[1]
+                    _, projected_ms, queries = self.best_of(options['repeat'], projected)
+                    self.stdout.write(
+                        f"{name:<18}{queryset.count():>7}{serializer_ms:>15.1f}{prefetched_ms:>15.1f}{projected_ms:>14.1f}"
+                        f"{serializer_ms / projected_ms:>8.1f}x{prefetched_ms / projected_ms:>14.1f}x{queries:>9}"
+                    )
+                raise Rollback
+        except Rollback:
+            pass
@@ -0,0 +1,153 @@
+import os
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+
+from optometrist.models import EyeExamination, Optometrist
+from optometrist.serializers import EyeExaminationSerializer
+from phase2.sqlite import SQLITE_PROFILES, apply_sqlite_profile
+
+DOCTORS = 5
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare exam-submission throughput of the SQLite profiles with many concurrent writers. For each "
+        "profile, ``default`` is pointed at a freshly migrated scratch database configured by "
+        "apply_sqlite_profile, and every writer thread submits exams through EyeExaminationSerializer.create "
+        "(consultant auto-assignment, signals and retry_on_database_locked included) on its own Django "
+        "connection, while reader threads run the doctor worklist query."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16)
+        parser.add_argument('--exams-per-writer', type=int, default=50)
+        parser.add_argument('--readers', type=int, default=4, help="Concurrent dashboard-style readers.")
+
+    @contextmanager
+    def scratch_database(self, profile):
+        """Point ``default`` at a new SQLite file with ``profile`` applied, for this thread and new ones."""
+        if connection.vendor != 'sqlite':
+            raise CommandError("bench_sqlite_writers needs the default database to be SQLite.")
+        original = connections.settings['default']
+        connections.close_all()
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, 'bench.sqlite3')}
+            apply_sqlite_profile({'default': config}, profile)
+            connections.settings['default'] = connections.configure_settings({'default': config})['default']
+            del connections['default']
+            try:
+                call_command('migrate', verbosity=0)
+                yield
+            finally:
+                connections.close_all()
+                connections.settings['default'] = original
+                del connections['default']
+
+    def seed(self, writers):
+        for number in range(DOCTORS):
+            Optometrist.objects.create_user(f'7300000{number:03d}', f'Bench Doctor {number}', role='doctor')
+        return [
+            Optometrist.objects.create_user(f'7310000{number:03d}', f'Bench Optometrist {number}')
+            for number in range(writers)
+        ]
+
+    def submit_exam(self, optometrist, writer, index):
+        # A new patient created inline, in the same transaction as the exam
+        serializer = EyeExaminationSerializer(data={
+            'name': f'Patient {writer}-{index}', 'age': 40, 'gender': 'female', 'phone_number': '9845012345',
+            'chief_complaints': 'Blurred vision',
+            'dv_sph_re': '-1.25', 'dv_sph_le': '-1.50',
+            'advice': 'Spectacles',
+            'medications': [
+                {'name': 'Carboxymethylcellulose', 'quantity': '1', 'frequency': 'QID', 'duration': '1 month'},
+                {'name': 'Moxifloxacin', 'quantity': '1', 'frequency': 'TID', 'duration': '1 week'},
+            ],
+        })
+        serializer.is_valid(raise_exception=True)
+        serializer.save(optometrist=optometrist)
+
+    def run_profile(self, name, writers, per_writer, readers):
+        with self.scratch_database(name):
+            optometrists = self.seed(writers)
+            doctor_id = Optometrist.objects.filter(role='doctor').order_by('pk').values_list('pk', flat=True).first()
+
+            latencies, errors = [], []
+            lock = threading.Lock()
+            stop_readers = threading.Event()
+
+            def writer(number):
+                try:
+                    for index in range(per_writer):
+                        started = time.perf_counter()
+                        try:
+                            self.submit_exam(optometrists[number], number, index)
+                        except OperationalError as exc:
+                            with lock:
+                                errors.append(str(exc))
+                            continue
+                        with lock:
+                            latencies.append(time.perf_counter() - started)
+                finally:
+                    connection.close()
+
+            def reader():
+                try:
+                    while not stop_readers.is_set():
+                        list(
+                            EyeExamination.objects.filter(consultant_id=doctor_id)
+                            .select_related('patient').order_by('-created_at', '-id')[:25]
+                        )
+                finally:
+                    connection.close()
+
+            reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+            writer_threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+            for thread in reader_threads:
+                thread.start()
+            started = time.perf_counter()
+            for thread in writer_threads:
+                thread.start()
+            for thread in writer_threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            stop_readers.set()
+            for thread in reader_threads:
+                thread.join()
+            stored = EyeExamination.objects.count()
+
+        latencies.sort()
+        return {
+            'committed': len(latencies),
+            'stored': stored,
+            'errors': len(errors),
+            'elapsed': elapsed,
+            'throughput': len(latencies) / elapsed if elapsed else 0.0,
+            'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+            'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0.0,
+        }
+
+    def handle(self, *args, **options):
+        writers, per_writer, readers = options['writers'], options['exams_per_writer'], options['readers']
+        if writers < 1 or per_writer < 1:
+            raise CommandError("--writers and --exams-per-writer must be at least 1.")
+        self.stdout.write(f"{writers} writers x {per_writer} exams, {readers} concurrent readers\n")
+        results = {}
+        for name in SQLITE_PROFILES:
+            result = results[name] = self.run_profile(name, writers, per_writer, readers)
+            self.stdout.write(
+                f"{name:>16}: {result['committed']:>6} committed ({result['stored']} stored), "
+                f"{result['errors']:>5} locked errors, {result['throughput']:8.1f} exams/s, "
+                f"p50 {result['p50_ms']:7.2f} ms, p95 {result['p95_ms']:7.2f} ms"
+            )
+        baseline = results['default']['throughput']
+        if baseline:
+            self.stdout.write(self.style.SUCCESS(
+                f"high_concurrency throughput: {results['high_concurrency']['throughput'] / baseline:.2f}x default"
+            ))
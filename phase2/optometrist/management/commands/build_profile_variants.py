@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from optometrist.models import Optometrist
+from optometrist.thumbnails import refresh_variants, variants_current
+
+
+class Command(BaseCommand):
+    help = (
+        "Build resized profile picture variants for every optometrist whose variants are missing "
+        "or were built from a different picture. Pictures that are already current are skipped."
+    )
+
+    def handle(self, *args, **options):
+        built = skipped = failed = 0
+        profiles = Optometrist.objects.exclude(profile_picture='').exclude(profile_picture=None).only(
+            'id', 'profile_picture', 'profile_picture_variants'
+        )
+        for optometrist in profiles.iterator():
+            if variants_current(optometrist):
+                skipped += 1
+                continue
+            try:
+                built += refresh_variants(optometrist.pk)
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f"Optometrist {optometrist.pk}: {exc}")
+        self.stdout.write(self.style.SUCCESS(f"Built {built}, already current {skipped}, failed {failed}."))
@@ -0,0 +1,75 @@
+from django.contrib import admin
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from optometrist.models import Optometrist
+
+SMALL_PAGE, LARGE_PAGE = 5, 50
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the SQL query count of every optometrist ModelAdmin: changelists (plain, paged, searched), "
+        "the change form and the add form. Fails when a page exceeds --max-queries, or when a changelist "
+        f"issues more queries at {LARGE_PAGE} rows per page than at {SMALL_PAGE} (a per-row N+1 query). "
+        "Run it against a database with data, e.g. one filled by seed_clinic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-queries', type=int, default=15)
+        parser.add_argument('--search', default='an', help="Search term used for the searched changelists.")
+
+    def count_queries(self, client, url, params=None):
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = client.get(url, params or {})
+        if response.status_code != 200:
+            raise CommandError(f"GET {url} {params or ''} returned {response.status_code}.")
+        return len(queries)
+
+    def handle(self, *args, **options):
+        user = Optometrist.objects.filter(is_superuser=True, is_active=True).order_by('pk').first()
+        if user is None:
+            raise CommandError("A superuser is needed to open the admin; run `manage.py seed_clinic` first.")
+        client = Client()
+        client.force_login(user)
+
+        problems = []
+        for model, model_admin in admin.site._registry.items():
+            if model._meta.app_label != 'optometrist':
+                continue
+            info = (model._meta.app_label, model._meta.model_name)
+            changelist = reverse('admin:%s_%s_changelist' % info)
+            instance = model._default_manager.order_by('pk').first()
+
+            results = {}
+            per_page = model_admin.list_per_page
+            try:
+                model_admin.list_per_page = SMALL_PAGE
+                results[f'changelist ({SMALL_PAGE}/page)'] = self.count_queries(client, changelist)
+                if model._default_manager.all()[SMALL_PAGE:].exists():
+                    results['changelist page 2'] = self.count_queries(client, changelist, {'p': 2})
+                model_admin.list_per_page = LARGE_PAGE
+                results[f'changelist ({LARGE_PAGE}/page)'] = self.count_queries(client, changelist)
+                if model_admin.search_fields:
+                    results['search'] = self.count_queries(client, changelist, {'q': options['search']})
+            finally:
+                model_admin.list_per_page = per_page
+            if instance is not None:
+                results['change form'] = self.count_queries(client, reverse('admin:%s_%s_change' % info, args=[instance.pk]))
+            results['add form'] = self.count_queries(client, reverse('admin:%s_%s_add' % info))
+
+            name = model_admin.__class__.__name__
+            self.stdout.write(f"{name}: " + ', '.join(f"{page} {count}" for page, count in results.items()))
+            if results[f'changelist ({LARGE_PAGE}/page)'] > results[f'changelist ({SMALL_PAGE}/page)']:
+                problems.append(f"{name}: changelist queries grow with the page size (N+1)")
+            problems.extend(
+                f"{name}: {page} issued {count} queries (max {options['max_queries']})"
+                for page, count in results.items() if count > options['max_queries']
+            )
+
+        if problems:
+            raise CommandError("Admin query checks failed:\n  " + '\n  '.join(problems))
+        self.stdout.write(self.style.SUCCESS("All admin pages are within their query budget."))
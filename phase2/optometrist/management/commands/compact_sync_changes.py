@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from optometrist.models import SyncChange
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete sync changes superseded by a newer change to the same object. Safe for every "
+        "client cursor: a client behind the deleted change still receives the newer one."
+    )
+
+    def handle(self, *args, **options):
+        newest = SyncChange.objects.values('kind', 'object_id').annotate(newest=Max('seq')).values('newest')
+        deleted, _ = SyncChange.objects.exclude(seq__in=newest).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} superseded sync changes."))
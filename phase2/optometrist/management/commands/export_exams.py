@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from optometrist import exports
+from optometrist.models import EyeExamination
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream examinations with patient, staff and medications as CSV or NDJSON, "
+        "in constant memory. Writes to stdout unless --output is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(exports.STREAMERS), default='csv')
+        parser.add_argument('--start', help="First date_of_visit (YYYY-MM-DD).")
+        parser.add_argument('--end', help="Last date_of_visit (YYYY-MM-DD).")
+        parser.add_argument('--optometrist', type=int)
+        parser.add_argument('--consultant', type=int)
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--output', '-o')
+
+    def handle(self, *args, **options):
+        filters = {'optometrist': options['optometrist'], 'consultant': options['consultant']}
+        for option in ('start', 'end'):
+            if options[option]:
+                filters[option] = parse_date(options[option])
+                if filters[option] is None:
+                    raise CommandError(f"--{option} must be YYYY-MM-DD.")
+
+        exams = exports.filter_exams(EyeExamination.objects.all(), **filters)
+        chunks = exports.encode(
+            exports.STREAMERS[options['format']](exams, options['batch_size']), compress=options['gzip']
+        )
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
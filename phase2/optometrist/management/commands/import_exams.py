@@ -0,0 +1,266 @@
+import csv
+import hashlib
+import json
+import time
+from datetime import datetime, time as day_time
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from optometrist import analytics, sync
+from optometrist.models import EyeExamination, ImportJob, Optometrist, Patient
+from optometrist.serializers import EyeExaminationSerializer, PatientSerializer, preload_related
+
+GENDERS = {'m': 'male', 'male': 'male', 'f': 'female', 'female': 'female', 'o': 'other', 'other': 'other'}
+# Legacy exams are history, not new referrals: without a status column they are closed,
+# so they neither count towards consultant load nor reach the doctors' live streams
+STATUSES = {value for value, _ in EyeExamination._meta.get_field('status').choices}
+DEFAULT_STATUS = 'closed'
+MEDICATION_COLUMNS = ['name', 'eye', 'frequency', 'duration', 'quantity', 'instructions']
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_medications(value):
+    """Either a JSON list of objects or export_exams' "name | eye | frequency | duration | quantity; ..." form."""
+    value = (value or '').strip()
+    if not value:
+        return []
+    if value.startswith('['):
+        return json.loads(value)
+    medications = []
+    for entry in value.split(';'):
+        parts = [part.strip() for part in entry.split('|')]
+        if any(parts):
+            medications.append({key: part for key, part in zip(MEDICATION_COLUMNS, parts) if part})
+    return medications
+
+
+def parse_or_none(parser, value):
+    """``parser(value)``, or None for a blank or invalid value (e.g. 2023-02-30)."""
+    try:
+        return parser(value) if value else None
+    except ValueError:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Import legacy patients and examinations from a CSV file (the export_exams layout works as-is). "
+        "Rows are streamed and handled in fixed-size batches: patient columns are validated with "
+        "PatientSerializer and exams with EyeExaminationSerializer, then each batch is written with "
+        "bulk inserts in its own transaction together with a checkpoint. Rerunning the command on the "
+        "same file resumes after the last committed batch. Rows without a status are imported as closed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--optometrist', type=int, help="Optometrist id for rows without optometrist_id.")
+        parser.add_argument(
+            '--assign-consultants', action='store_true',
+            help="Auto-assign a consultant to rows without consultant_id (by default they stay unassigned).",
+        )
+        parser.add_argument('--errors', help="Write rejected rows and their errors to this CSV file.")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start from the first row.")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f"{path} does not exist.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        self.options = options
+        self.optometrist_ids = set(Optometrist.objects.filter(role='optometrist').values_list('pk', flat=True))
+        if options['optometrist'] and options['optometrist'] not in self.optometrist_ids:
+            raise CommandError(f"Optometrist {options['optometrist']} does not exist.")
+
+        job, _ = ImportJob.objects.get_or_create(source_sha256=file_sha256(path), defaults={'source_name': path.name})
+        if options['restart']:
+            job.rows_processed = job.rows_created = job.rows_failed = 0
+            job.completed_at = None
+            job.save()
+        elif job.completed_at:
+            self.stdout.write(self.style.SUCCESS(
+                f"{path.name} was already imported on {job.completed_at:%Y-%m-%d %H:%M} "
+                f"({job.rows_created} created, {job.rows_failed} failed). Use --restart to import it again."
+            ))
+            return
+        elif job.rows_processed:
+            self.stdout.write(f"Resuming {path.name} after row {job.rows_processed}.")
+
+        errors_file = open(options['errors'], 'a', newline='') if options['errors'] else None
+        self.errors = csv.writer(errors_file) if errors_file else None
+        started, rows_this_run = time.perf_counter(), 0
+        try:
+            # utf-8-sig: spreadsheet exports often start with a byte order mark
+            with open(path, newline='', encoding='utf-8-sig') as handle:
+                reader = csv.DictReader(handle)
+                rows = islice(enumerate(reader, start=2), job.rows_processed, None)
+                while batch := list(islice(rows, options['batch_size'])):
+                    created, failed = self.import_batch(job, batch)
+                    rows_this_run += len(batch)
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f"  rows {job.rows_processed}: +{created} created, +{failed} failed, "
+                        f"{rows_this_run / elapsed:,.0f} rows/s"
+                    )
+        finally:
+            if errors_file:
+                errors_file.close()
+
+        job.completed_at = timezone.now()
+        job.save(update_fields=['completed_at', 'updated_at'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {path.name}: {job.rows_created} created, {job.rows_failed} failed in total; "
+            f"{rows_this_run} rows this run in {elapsed:.1f}s ({rows_this_run / elapsed if elapsed else 0:,.0f} rows/s)."
+        ))
+
+    def reject(self, line, errors):
+        self.rejected.append([line, json.dumps(errors)])
+
+    def import_batch(self, job, batch):
+        # Rejections are written once the batch commits, so a resumed run does not repeat them
+        self.rejected = []
+        # 1. Patient columns, validated like inline patients of the exam API. One serializer
+        # instance validates every row (as ListSerializer does), so its fields are built once.
+        patient_serializer = PatientSerializer()
+        parsed = []
+        for line, row in batch:
+            data = {
+                'name': (row.get('patient_name') or '').strip(),
+                'age': row.get('patient_age'),
+                'gender': GENDERS.get((row.get('patient_gender') or '').strip().lower(), row.get('patient_gender')),
+                'phone_number': (row.get('patient_phone') or '').strip() or None,
+                'address': (row.get('patient_address') or '').strip() or None,
+            }
+            try:
+                patient = patient_serializer.run_validation(data)
+            except ValidationError as exc:
+                self.reject(line, {'patient': exc.detail})
+                continue
+            try:
+                medications = parse_medications(row.get('medications'))
+            except ValueError:
+                self.reject(line, {'medications': ['Not valid JSON.']})
+                continue
+            parsed.append((line, row, patient, medications))
+
+        with transaction.atomic():
+            # 2. Exam columns, validated by the same serializer as the API. The inline patient
+            # name stands in for patient_id, so patients are only created for rows that pass.
+            items = []
+            for line, row, patient, medications in parsed:
+                item = {
+                    key: value for key, value in row.items()
+                    if key and value not in (None, '') and not key.startswith('patient')
+                    and key not in ('exam_id', 'medications', 'optometrist_id', 'consultant_id')
+                }
+                item.update(name=patient['name'], medications=medications)
+                if row.get('consultant_id'):
+                    item['consultant_id'] = row['consultant_id']
+                items.append((line, row, patient, item))
+
+            context = {}
+            exam_serializer = EyeExaminationSerializer(context=context)
+            context['preloaded'] = preload_related(exam_serializer, [item for _, _, _, item in items])
+            valid, patients, dates = [], [], []
+            for line, row, patient, item in items:
+                optometrist_id = row.get('optometrist_id') or self.options['optometrist']
+                try:
+                    attrs, errors = exam_serializer.run_validation(item), {}
+                except ValidationError as exc:
+                    attrs, errors = None, dict(exc.detail)
+                if str(optometrist_id or '').isdigit() and int(optometrist_id) in self.optometrist_ids:
+                    optometrist_id = int(optometrist_id)
+                else:
+                    errors['optometrist_id'] = ['Unknown optometrist; pass --optometrist for rows without one.']
+                exam_status = (row.get('status') or DEFAULT_STATUS).strip().lower()
+                if exam_status not in STATUSES:
+                    errors['status'] = [f"Use one of {', '.join(sorted(STATUSES))}."]
+                visited = parse_or_none(parse_date, row.get('date_of_visit'))
+                if row.get('date_of_visit') and visited is None:
+                    errors['date_of_visit'] = ['Use YYYY-MM-DD.']
+                created_at = parse_or_none(parse_datetime, row.get('created_at'))
+                if row.get('created_at') and created_at is None:
+                    errors['created_at'] = ['Use YYYY-MM-DD HH:MM[:SS], optionally with a UTC offset.']
+                elif created_at is not None and timezone.is_naive(created_at):
+                    # Legacy timestamps without an offset are in the clinic's time zone
+                    created_at = timezone.make_aware(created_at)
+                if errors:
+                    self.reject(line, errors)
+                    continue
+                # status is read-only in the serializer, so it is set after validation
+                attrs = {**attrs, 'optometrist_id': optometrist_id, 'status': exam_status}
+                if 'consultant' not in attrs and not self.options['assign_consultants']:
+                    attrs['consultant'] = None
+                valid.append(attrs)
+                patients.append(patient)
+                dates.append((visited, created_at))
+
+            for attrs, patient in zip(valid, self.resolve_patients(patients)):
+                attrs['patient'] = patient
+            exams = EyeExaminationSerializer(many=True, context=context).create(valid) if valid else []
+            self.backdate(exams, dates)
+
+            job.rows_processed += len(batch)
+            job.rows_created += len(exams)
+            job.rows_failed += len(batch) - len(exams)
+            job.save(update_fields=['rows_processed', 'rows_created', 'rows_failed', 'updated_at'])
+        if self.errors:
+            self.errors.writerows(self.rejected)
+        return len(exams), len(batch) - len(exams)
+
+    def resolve_patients(self, patients):
+        """
+        Patient per row. Rows with the same name and phone number share one patient,
+        matched against existing patients too; rows without a phone always get a new one.
+        """
+        phones = {Patient.normalize_phone(patient.get('phone_number')) for patient in patients} - {''}
+        known = {
+            (patient.name_normalized, patient.phone_normalized): patient
+            for patient in Patient.objects.filter(phone_normalized__in=phones).order_by('pk')
+        } if phones else {}
+
+        new, keys = {}, []
+        for index, data in enumerate(patients):
+            patient = Patient(**data)
+            patient.normalize()
+            key = (patient.name_normalized, patient.phone_normalized) if patient.phone_normalized else ('#', index)
+            if key not in known and key not in new:
+                new[key] = patient
+            keys.append(key)
+        Patient.objects.bulk_create(new.values())
+        sync.record_changes('patients', [patient.pk for patient in new.values()])
+        known.update(new)
+        return [known[key] for key in keys]
+
+    def backdate(self, exams, dates):
+        """Give imported exams their historical visit dates and move their rollup counts along."""
+        changed = []
+        delta = {}
+        for exam, (visited, created_at) in zip(exams, dates):
+            if visited is None and created_at is None:
+                continue
+            analytics.combine(delta, analytics.exam_contribution(analytics.instance_values(exam)), sign=-1)
+            visited = visited or timezone.localdate(created_at)
+            exam.date_of_visit = visited
+            exam.created_at = created_at or timezone.make_aware(datetime.combine(visited, day_time(9)))
+            analytics.combine(delta, analytics.exam_contribution(analytics.instance_values(exam)))
+            changed.append(exam)
+        if changed:
+            EyeExamination.objects.bulk_update(changed, ['date_of_visit', 'created_at'])
+            analytics.apply_delta(delta)
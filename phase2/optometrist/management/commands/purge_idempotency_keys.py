@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from optometrist.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete Idempotency-Key records (and their stored responses) whose TTL has run out."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        deleted = 0
+        while True:
+            # Small batches keep each DELETE's write lock short on a busy SQLite database
+            expired = list(
+                IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not expired:
+                break
+            deleted += IdempotencyKey.objects.filter(pk__in=expired).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys."))
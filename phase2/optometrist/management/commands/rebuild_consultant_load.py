@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Q
+
+from optometrist.models import Optometrist, ConsultantLoad
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-doctor pending referral counters used by consultant auto-assignment."
+
+    def handle(self, *args, **options):
+        doctors = Optometrist.objects.filter(role='doctor').annotate(
+            pending=Count('exams_consulted', filter=Q(exams_consulted__status='pending')),
+            latest=Max('exams_consulted__created_at'),
+        )
+        loads = [
+            ConsultantLoad(consultant_id=doctor.pk, open_referrals=doctor.pending, last_assigned_at=doctor.latest)
+            for doctor in doctors
+        ]
+        with transaction.atomic():
+            ConsultantLoad.objects.exclude(consultant__role='doctor').delete()
+            ConsultantLoad.objects.bulk_create(
+                loads,
+                update_conflicts=True,
+                unique_fields=['consultant'],
+                update_fields=['open_referrals', 'last_assigned_at'],
+            )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt load counters for {len(loads)} doctors."))
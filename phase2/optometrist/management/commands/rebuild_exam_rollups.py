@@ -0,0 +1,127 @@
+import time
+from itertools import islice
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from optometrist.analytics import PERFORMED_FIELDS, SE_BUCKETS, ROLLUP_COUNTERS
+from optometrist.models import EyeExamination, ExamRollup
+
+_DATE_EPOCH = np.datetime64('1970-01-01', 'D')
+
+FIELDS = [
+    'date_of_visit', 'optometrist_id', 'consultant_id', *PERFORMED_FIELDS,
+    'dv_sph_re_dpt', 'dv_cyl_re_dpt', 'dv_sph_le_dpt', 'dv_cyl_le_dpt',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute ExamRollup from scratch. Examination columns are read --chunk-size rows at a time into "
+        "NumPy arrays and aggregated with vectorized group-by (np.unique + np.add.at) instead of a Python "
+        "loop per exam; only one chunk and the running per-group totals are held in memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=20000)
+
+    def load_chunks(self, chunk_size):
+        """Yield the examination columns as dicts of NumPy arrays, ``chunk_size`` exams at a time."""
+        rows = EyeExamination.objects.values_list(*FIELDS).iterator(chunk_size=chunk_size)
+        while chunk := list(islice(rows, chunk_size)):
+            yield self.to_columns(chunk)
+
+    def to_columns(self, rows):
+        columns = list(zip(*rows))
+
+        def numeric(column):
+            return np.array([np.nan if value is None else float(value) for value in column], dtype=np.float64)
+
+        data = {
+            'date': np.array(columns[0], dtype='datetime64[D]'),
+            'optometrist': np.array(columns[1], dtype=np.int64),
+            'consultant': np.array([0 if value is None else value for value in columns[2]], dtype=np.int64),
+        }
+        for offset, field in enumerate(PERFORMED_FIELDS, start=3):
+            data[field] = np.array(columns[offset], dtype=bool)
+        base = 3 + len(PERFORMED_FIELDS)
+        for offset, name in enumerate(['sph_re', 'cyl_re', 'sph_le', 'cyl_le']):
+            data[name] = numeric(columns[base + offset])
+        return data
+    def per_exam_counters(self, data):
+        """Counter columns for every exam, as an (exams x counters) float matrix."""
+        counters = {
+            'exam_count': np.ones(len(data['date'])),
+            'referred_count': (data['consultant'] != 0).astype(np.float64),
+        }
+        for field in PERFORMED_FIELDS:
+            counters[f'{field}_count'] = data[field].astype(np.float64)
+
+        refraction_eyes = np.zeros(len(data['date']))
+        se_sum = np.zeros(len(data['date']))
+        buckets = {bucket: np.zeros(len(data['date'])) for bucket in SE_BUCKETS}
+        for eye in ('re', 'le'):
+            sph, cyl = data[f'sph_{eye}'], data[f'cyl_{eye}']
+            known = ~np.isnan(sph)
+            se = np.where(known, sph + np.nan_to_num(cyl) / 2, 0.0)
+            refraction_eyes += known
+            se_sum += se
+            buckets['se_high_myopia_eyes'] += known & (se <= -6.0)
+            buckets['se_myopia_eyes'] += known & (se > -6.0) & (se <= -0.5)
+            buckets['se_emmetropia_eyes'] += known & (se > -0.5) & (se < 0.5)
+            buckets['se_hyperopia_eyes'] += known & (se >= 0.5)
+        counters['refraction_eyes'] = refraction_eyes
+        counters['se_sum'] = se_sum
+        counters.update(buckets)
+        return np.column_stack([counters[name] for name in ROLLUP_COUNTERS])
+
+    def aggregate(self, keys, matrix):
+        """Sum matrix rows grouped by their (staff, period start) key row."""
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+        totals = np.zeros((len(groups), matrix.shape[1]))
+        np.add.at(totals, inverse.ravel(), matrix)
+        return groups, totals
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        # (role, period) -> (group keys, totals) over the chunks read so far
+        running = {}
+        exams = 0
+        for data in self.load_chunks(options['chunk_size']):
+            exams += len(data['date'])
+            matrix = self.per_exam_counters(data)
+            days = data['date']
+            months = days.astype('datetime64[M]').astype('datetime64[D]')
+            for role, staff in (('optometrist', data['optometrist']), ('consultant', data['consultant'])):
+                assigned = staff != 0
+                for period, starts in (('day', days), ('month', months)):
+                    keys = np.column_stack([staff[assigned], starts[assigned].astype(np.int64)])
+                    rows = matrix[assigned]
+                    if (role, period) in running:
+                        previous_keys, previous_totals = running[role, period]
+                        keys, rows = np.concatenate([previous_keys, keys]), np.concatenate([previous_totals, rows])
+                    running[role, period] = self.aggregate(keys, rows)
+
+        rollups = []
+        for (role, period), (groups, totals) in running.items():
+            for (staff_id, start), row in zip(groups, totals):
+                values = dict(zip(ROLLUP_COUNTERS, row))
+                rollups.append(ExamRollup(
+                    staff_id=int(staff_id),
+                    staff_role=role,
+                    period=period,
+                    period_start=(_DATE_EPOCH + np.timedelta64(int(start), 'D')).item(),
+                    **{
+                        name: round(value, 3) if name == 'se_sum' else int(round(value))
+                        for name, value in values.items()
+                    },
+                ))
+
+        with transaction.atomic():
+            ExamRollup.objects.all().delete()
+            ExamRollup.objects.bulk_create(rollups, batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(rollups)} rollup rows from {exams} examinations in {time.monotonic() - started:.2f}s."
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from optometrist import search
+
+
+class Command(BaseCommand):
+    help = (
+        "Recreate the full-text search index over examinations (FTS5 on SQLite, tsvector on PostgreSQL) "
+        "from the exam and patient tables, in a single transaction."
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        indexed = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} examinations for search in {time.monotonic() - started:.2f}s."
+        ))
@@ -0,0 +1,200 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from optometrist import sync
+from optometrist.cache import bump_directory_version
+from optometrist.models import Optometrist, Patient, EyeExamination, Medication, FormularyEntry
+
+# Seeded staff get phone numbers under this prefix so reruns never collide with real accounts
+PHONE_PREFIX = '70'
+ADMIN_PHONE = '7000000000'
+SEED_PASSWORD = 'clinic-seed-123'
+
+FIRST_NAMES = [
+    'Aarav', 'Ananya', 'Arjun', 'Diya', 'Ishaan', 'Kavya', 'Meera', 'Nikhil', 'Priya', 'Rahul',
+    'Riya', 'Rohan', 'Saanvi', 'Sanjay', 'Sneha', 'Tanvi', 'Varun', 'Vikram', 'Zara', 'Aditi',
+]
+LAST_NAMES = [
+    'Sharma', 'Patel', 'Iyer', 'Reddy', 'Nair', 'Gupta', 'Khan', 'Das', 'Mehta', 'Joshi',
+    'Menon', 'Rao', 'Singh', 'Bose', 'Kulkarni', 'Pillai',
+]
+SPECIALIZATIONS = ['Cornea', 'Glaucoma', 'Retina', 'Pediatric Ophthalmology', 'Oculoplasty', 'Neuro-ophthalmology']
+COMPLAINTS = [
+    'Blurred distance vision', 'Difficulty reading', 'Redness and itching', 'Watering both eyes',
+    'Headache after screen use', 'Floaters RE', 'Glare while driving at night', 'Routine check-up',
+]
+DIAGNOSES = [
+    'Myopia', 'Hypermetropia', 'Compound myopic astigmatism', 'Presbyopia', 'Dry eye disease',
+    'Allergic conjunctivitis', 'Immature senile cataract', 'Glaucoma suspect', 'Diabetic retinopathy screening',
+]
+ACUITIES = ['6/6', '6/9', '6/12', '6/18', '6/24', '6/36', '6/60', 'CF', 'HM']
+NEAR_ACUITIES = ['N6', 'N8', 'N10', 'N12', 'N18']
+AXES = ['10', '45', '90', '135', '180']
+MEDICINES = [
+    ('Carboxymethylcellulose 0.5%', '1 bottle', 'QID', '1 month'),
+    ('Moxifloxacin 0.5%', '1 bottle', 'TID', '1 week'),
+    ('Olopatadine 0.1%', '1 bottle', 'BD', '2 weeks'),
+    ('Timolol 0.5%', '1 bottle', 'BD', 'Till review'),
+    ('Loteprednol 0.5%', '1 bottle', 'QID', '1 week'),
+    ('Nepafenac 0.1%', '1 bottle', 'TID', '4 weeks'),
+]
+
+
+def _diopters(rng, low, high):
+    value = rng.randint(int(low * 4), int(high * 4)) / 4
+    return 'plano' if value == 0 else f'{value:+.2f}'
+
+
+class Command(BaseCommand):
+    help = (
+        "Create synthetic optometrists, doctors, patients and examinations with medications "
+        f"for benchmarking. Staff phone numbers start with {PHONE_PREFIX} and share the password "
+        f"'{SEED_PASSWORD}'; a superuser {ADMIN_PHONE} is created for the admin."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--optometrists', type=int, default=20)
+        parser.add_argument('--doctors', type=int, default=10)
+        parser.add_argument('--patients', type=int, default=5000)
+        parser.add_argument('--exams', type=int, default=20000)
+        parser.add_argument('--max-medications', type=int, default=3)
+        parser.add_argument('--days', type=int, default=365, help="Spread visit dates over this many past days.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['optometrists'] < 1 or options['doctors'] < 1:
+            raise CommandError("At least one optometrist and one doctor are needed.")
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        # Hashing is deliberately slow, so every seeded account shares one hash
+        password = make_password(SEED_PASSWORD)
+
+        with transaction.atomic():
+            if not Optometrist.objects.filter(phone_number=ADMIN_PHONE).exists():
+                Optometrist.objects.create_superuser(ADMIN_PHONE, 'Clinic Admin', SEED_PASSWORD)
+            start = Optometrist.objects.filter(phone_number__startswith=PHONE_PREFIX).count()
+            staff = []
+            for offset in range(options['optometrists'] + options['doctors']):
+                number = start + offset
+                is_doctor = offset >= options['optometrists']
+                staff.append(Optometrist(
+                    phone_number=f'{PHONE_PREFIX}{number:08d}',
+                    name=f"{'Dr. ' if is_doctor else ''}{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                    password=password,
+                    role='doctor' if is_doctor else 'optometrist',
+                    license_number=f'SEED-{number:08d}',
+                    qualification='MS Ophthalmology' if is_doctor else 'B.Optom',
+                    specialization=rng.choice(SPECIALIZATIONS) if is_doctor else None,
+                    experience_years=rng.randint(1, 30),
+                    clinic_address=f'{rng.randint(1, 300)} MG Road, Bengaluru',
+                ))
+            Optometrist.objects.bulk_create(staff, batch_size=batch_size)
+            sync.record_changes('directory', [user.pk for user in staff])
+            optometrist_ids = [user.pk for user in staff if user.role == 'optometrist']
+            doctor_ids = [user.pk for user in staff if user.role == 'doctor']
+
+            patients = []
+            for _ in range(options['patients']):
+                patient = Patient(
+                    name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                    age=rng.randint(4, 90),
+                    gender=rng.choice(['male', 'female', 'other']),
+                    phone_number=f'9{rng.randint(100000000, 999999999)}',
+                    address=f'{rng.randint(1, 999)} {rng.choice(LAST_NAMES)} Nagar',
+                )
+                patient.normalize()
+                patients.append(patient)
+            Patient.objects.bulk_create(patients, batch_size=batch_size)
+            sync.record_changes('patients', [patient.pk for patient in patients])
+            self.stdout.write(f"Created {len(staff)} staff and {len(patients)} patients.")
+
+            # The seeded medicines are formulary drops; prescriptions point to their entries
+            formulary = {}
+            for name, quantity, frequency, duration in MEDICINES:
+                drug, strength = name.rsplit(' ', 1)
+                formulary[name], _ = FormularyEntry.objects.get_or_create(
+                    drug=drug, strength=strength, dosage_form='Eye drops',
+                    defaults={'default_quantity': quantity, 'default_frequency': frequency, 'default_duration': duration},
+                )
+
+            now = timezone.now()
+            for batch_start in range(0, options['exams'], batch_size):
+                count = min(batch_size, options['exams'] - batch_start)
+                self.create_exams(rng, count, patients, optometrist_ids, doctor_ids, formulary, now, options)
+                self.stdout.write(f"  {batch_start + count}/{options['exams']} exams")
+
+        # bulk_create skipped the signals that maintain these
+        call_command('rebuild_consultant_load', stdout=self.stdout)
+        call_command('rebuild_exam_rollups', stdout=self.stdout)
+        call_command('rebuild_exam_search', stdout=self.stdout)
+        bump_directory_version()
+        self.stdout.write(self.style.SUCCESS("Seeding complete."))
+
+    def create_exams(self, rng, count, patients, optometrist_ids, doctor_ids, formulary, now, options):
+        exams = []
+        for _ in range(count):
+            refraction = rng.random() < 0.8
+            iop = rng.random() < 0.4
+            tbut = rng.random() < 0.2
+            exam = EyeExamination(
+                patient=rng.choice(patients),
+                optometrist_id=rng.choice(optometrist_ids),
+                consultant_id=rng.choice(doctor_ids) if rng.random() < 0.9 else None,
+                chief_complaints=rng.choice(COMPLAINTS),
+                screen_time=f'{rng.randint(1, 12)} hrs/day',
+                uncorrected_vision_re=rng.choice(ACUITIES),
+                uncorrected_vision_le=rng.choice(ACUITIES),
+                corrected_vision_re=rng.choice(ACUITIES[:4]),
+                corrected_vision_le=rng.choice(ACUITIES[:4]),
+                performed_ar_assessment=refraction,
+                performed_refraction=refraction,
+                performed_slit_lamp=True,
+                performed_fundus=rng.random() < 0.5,
+                performed_iop=iop,
+                performed_tbut=tbut,
+                performed_schirmer=tbut,
+                provisional_diagnosis=rng.choice(DIAGNOSES),
+                advice=rng.choice(['Spectacles', 'Review after 6 months', 'Lubricants', 'Refer to retina clinic']),
+                status=rng.choices(['pending', 'accepted', 'closed'], weights=[5, 2, 3])[0],
+            )
+            if refraction:
+                for eye in ('re', 'le'):
+                    setattr(exam, f'dv_sph_{eye}', _diopters(rng, -8, 4))
+                    setattr(exam, f'dv_cyl_{eye}', _diopters(rng, -3, 0))
+                    setattr(exam, f'dv_axis_{eye}', rng.choice(AXES))
+                    setattr(exam, f'dv_vision_{eye}', rng.choice(ACUITIES[:3]))
+                    setattr(exam, f'nv_sph_{eye}', _diopters(rng, 0, 3))
+                    setattr(exam, f'nv_vision_{eye}', rng.choice(NEAR_ACUITIES))
+            if iop:
+                exam.iop_re, exam.iop_le = f'{rng.randint(10, 28)} mmHg', f'{rng.randint(10, 28)} mmHg'
+            if tbut:
+                exam.tbut_re, exam.tbut_le = f'{rng.randint(3, 15)} sec', f'{rng.randint(3, 15)} sec'
+                exam.schirmer_re, exam.schirmer_le = f'{rng.randint(5, 30)} mm', f'{rng.randint(5, 30)} mm'
+            exam.populate_clinical_values()
+            exams.append(exam)
+        EyeExamination.objects.bulk_create(exams)
+        sync.record_changes('examinations', [exam.pk for exam in exams])
+
+        # created_at/date_of_visit are auto_now_add, so backdate them after the insert
+        for exam in exams:
+            exam.created_at = now - timedelta(seconds=rng.randint(0, options['days'] * 86400))
+            exam.date_of_visit = timezone.localdate(exam.created_at)
+        EyeExamination.objects.bulk_update(exams, ['created_at', 'date_of_visit'])
+
+        medications = Medication.objects.bulk_create([
+            Medication(
+                examination=exam, formulary=formulary[name], name=formulary[name].label,
+                quantity=quantity, frequency=frequency, duration=duration,
+                eye=rng.choice(['Both eyes', 'Right eye', 'Left eye']),
+            )
+            for exam in exams
+            for name, quantity, frequency, duration in rng.sample(MEDICINES, rng.randint(0, options['max_medications']))
+        ])
+        sync.record_changes('medications', [medication.pk for medication in medications])
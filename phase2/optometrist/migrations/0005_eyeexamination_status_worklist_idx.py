@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('optometrist', '0004_alter_patient_options_remove_patient_complaint_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending Review'), ('accepted', 'Accepted'), ('closed', 'Closed')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='eyeexamination',
+            index=models.Index(fields=['consultant', '-created_at', '-id'], name='exam_worklist_idx'),
+        ),
+    ]
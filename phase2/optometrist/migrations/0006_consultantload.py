@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def populate_consultant_load(apps, schema_editor):
+    Optometrist = apps.get_model('optometrist', 'Optometrist')
+    ConsultantLoad = apps.get_model('optometrist', 'ConsultantLoad')
+    doctors = Optometrist.objects.filter(role='doctor').annotate(
+        open_referrals=Count('exams_consulted', filter=Q(exams_consulted__status='pending')),
+        last_assigned_at=Max('exams_consulted__created_at'),
+    )
+    ConsultantLoad.objects.bulk_create([
+        ConsultantLoad(consultant_id=doctor.pk, open_referrals=doctor.open_referrals, last_assigned_at=doctor.last_assigned_at)
+        for doctor in doctors
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('optometrist', '0005_eyeexamination_status_worklist_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsultantLoad',
+            fields=[
+                ('consultant', models.OneToOneField(limit_choices_to={'role': 'doctor'}, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='load', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('open_referrals', models.PositiveIntegerField(default=0)),
+                ('last_assigned_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['open_referrals', 'last_assigned_at'], name='consultant_load_idx')],
+            },
+        ),
+        migrations.RunPython(populate_consultant_load, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:10
+
+from django.db import migrations, models
+
+
+def backfill_search_keys(apps, schema_editor):
+    Patient = apps.get_model('optometrist', 'Patient')
+    batch = []
+    for patient in Patient.objects.only('id', 'name', 'phone_number').iterator(chunk_size=2000):
+        patient.name_normalized = ' '.join((patient.name or '').split()).casefold()[:200]
+        patient.phone_normalized = ''.join(ch for ch in (patient.phone_number or '') if ch.isdigit())[:15]
+        batch.append(patient)
+        if len(batch) >= 2000:
+            Patient.objects.bulk_update(batch, ['name_normalized', 'phone_normalized'])
+            batch = []
+    if batch:
+        Patient.objects.bulk_update(batch, ['name_normalized', 'phone_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('optometrist', '0006_consultantload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='name_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='phone_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=15),
+        ),
+        migrations.RunPython(backfill_search_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,162 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('optometrist', '0007_patient_search_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='clinical_values_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='corrected_vision_le_logmar',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='corrected_vision_re_logmar',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='dv_axis_le_deg',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='dv_axis_re_deg',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='dv_cyl_le_dpt',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='dv_cyl_re_dpt',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='dv_sph_le_dpt',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='dv_sph_re_dpt',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='dv_vision_le_logmar',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='dv_vision_re_logmar',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='iop_le_mmhg',
+            field=models.DecimalField(blank=True, decimal_places=1, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='iop_re_mmhg',
+            field=models.DecimalField(blank=True, decimal_places=1, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='nv_axis_le_deg',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='nv_axis_re_deg',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='nv_cyl_le_dpt',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='nv_cyl_re_dpt',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='nv_sph_le_dpt',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='nv_sph_re_dpt',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='nv_vision_le_logmar',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='nv_vision_re_logmar',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='pinhole_vision_le_logmar',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='pinhole_vision_re_logmar',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='schirmer_le_mm',
+            field=models.DecimalField(blank=True, decimal_places=1, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='schirmer_re_mm',
+            field=models.DecimalField(blank=True, decimal_places=1, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='tbut_le_sec',
+            field=models.DecimalField(blank=True, decimal_places=1, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='tbut_re_sec',
+            field=models.DecimalField(blank=True, decimal_places=1, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='uncorrected_vision_le_logmar',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='eyeexamination',
+            name='uncorrected_vision_re_logmar',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=4, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='eyeexamination',
+            index=models.Index(fields=['clinical_values_version', 'id'], name='exam_clinical_version_idx'),
+        ),
+    ]
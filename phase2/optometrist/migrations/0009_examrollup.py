@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('optometrist', '0008_eyeexamination_numeric_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExamRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('month', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('staff_role', models.CharField(choices=[('optometrist', 'Optometrist'), ('consultant', 'Consultant')], max_length=20)),
+                ('exam_count', models.PositiveIntegerField(default=0)),
+                ('referred_count', models.PositiveIntegerField(default=0)),
+                ('performed_ar_assessment_count', models.PositiveIntegerField(default=0)),
+                ('performed_refraction_count', models.PositiveIntegerField(default=0)),
+                ('performed_schirmer_count', models.PositiveIntegerField(default=0)),
+                ('performed_tbut_count', models.PositiveIntegerField(default=0)),
+                ('performed_slit_lamp_count', models.PositiveIntegerField(default=0)),
+                ('performed_fundus_count', models.PositiveIntegerField(default=0)),
+                ('performed_iop_count', models.PositiveIntegerField(default=0)),
+                ('refraction_eyes', models.PositiveIntegerField(default=0)),
+                ('se_sum', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('se_high_myopia_eyes', models.PositiveIntegerField(default=0, help_text='SE <= -6.00 D')),
+                ('se_myopia_eyes', models.PositiveIntegerField(default=0, help_text='-6.00 D < SE <= -0.50 D')),
+                ('se_emmetropia_eyes', models.PositiveIntegerField(default=0, help_text='-0.50 D < SE < +0.50 D')),
+                ('se_hyperopia_eyes', models.PositiveIntegerField(default=0, help_text='SE >= +0.50 D')),
+                ('staff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exam_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('staff', 'staff_role', 'period', 'period_start'), name='unique_exam_rollup')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:48
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('optometrist', '0010_optometrist_profile_picture_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medication',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
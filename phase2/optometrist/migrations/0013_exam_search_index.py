@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from optometrist import search
+
+
+def create_search_index(apps, schema_editor):
+    search.create_index(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        search.backend_for(schema_editor.connection).populate(cursor)
+
+
+def drop_search_index(apps, schema_editor):
+    search.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('optometrist', '0012_importjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
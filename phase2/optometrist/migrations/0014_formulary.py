@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('optometrist', '0013_exam_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FormularyEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('drug', models.CharField(max_length=200)),
+                ('strength', models.CharField(blank=True, help_text='e.g., 0.5%', max_length=50)),
+                ('dosage_form', models.CharField(blank=True, help_text='e.g., Eye drops, Ointment, Tablet', max_length=50)),
+                ('default_quantity', models.CharField(blank=True, max_length=50)),
+                ('default_frequency', models.CharField(blank=True, max_length=100)),
+                ('default_eye', models.CharField(choices=[('Both eyes', 'Both eyes'), ('Right eye', 'Right eye'), ('Left eye', 'Left eye'), ('-', '-')], default='Both eyes', max_length=20)),
+                ('default_duration', models.CharField(blank=True, max_length=100)),
+                ('default_instructions', models.TextField(blank=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'formulary entries',
+                'ordering': ['drug', 'strength', 'dosage_form'],
+                'constraints': [models.UniqueConstraint(fields=('drug', 'strength', 'dosage_form'), name='unique_formulary_entry')],
+            },
+        ),
+        migrations.AddField(
+            model_name='medication',
+            name='formulary',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='prescriptions', to='optometrist.formularyentry'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+SYNCED_MODELS = [
+    ('directory', 'Optometrist'),
+    ('patients', 'Patient'),
+    ('examinations', 'EyeExamination'),
+    ('medications', 'Medication'),
+]
+
+
+def record_existing_rows(apps, schema_editor):
+    # Every existing row becomes one change, so a tablet's first sync from cursor 0 receives all of them
+    table = apps.get_model('optometrist', 'SyncChange')._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        for kind, model_name in SYNCED_MODELS:
+            source = apps.get_model('optometrist', model_name)._meta.db_table
+            cursor.execute(
+                f"INSERT INTO {table} (kind, object_id, deleted, changed_at) "
+                f"SELECT %s, id, %s, updated_at FROM {source} ORDER BY updated_at, id",
+                [kind, False],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('optometrist', '0015_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('patients', 'Patient'), ('examinations', 'Eye examination'), ('medications', 'Medication'), ('directory', 'Directory entry')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id'], name='syncchange_object_idx')],
+            },
+        ),
+        migrations.RunPython(record_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('optometrist', '0016_syncchange'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='examrollup',
+            name='se_sum',
+            field=models.DecimalField(decimal_places=3, default=0, max_digits=12),
+        ),
+    ]
@@ -1,7 +1,24 @@
-from django.db import models
+from django.db import connections, models
+from django.db.models import F
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.functions import Greatest
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 
-class OptometristManager(BaseUserManager):
+from .clinical import CLINICAL_VALUES_VERSION, NUMERIC_SOURCE_FIELDS, NUMERIC_TARGET_FIELDS, parse_clinical_values
+
+class OptometristQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        from .authentication import USER_CLAIM_FIELDS, forget_cached_users
+        if not set(kwargs) & set(USER_CLAIM_FIELDS):
+            return super().update(**kwargs)
+        # No post_save here: drop the cached status ClaimsJWTAuthentication would otherwise trust
+        user_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        forget_cached_users(user_ids)
+        return rows
+
+class OptometristManager(BaseUserManager.from_queryset(OptometristQuerySet)):
     def create_user(self, phone_number, name, password=None, **extra_fields):
         if not phone_number:
             raise ValueError('The Phone Number must be set')
@@ -33,6 +50,8 @@ class Optometrist(AbstractBaseUser, PermissionsMixin):
     bio = models.TextField(blank=True, null=True)
     clinic_address = models.TextField(blank=True, null=True)
     profile_picture = models.ImageField(upload_to='optometrists/', blank=True, null=True)
+    # Resized copies of profile_picture built in the background (see optometrist.thumbnails)
+    profile_picture_variants = models.JSONField(default=dict, blank=True, editable=False)
     website = models.URLField(blank=True, null=True)
     office_hours = models.CharField(max_length=200, blank=True, null=True, help_text="e.g., Mon-Fri: 9am-5pm")
     languages = models.CharField(max_length=200, blank=True, null=True, help_text="e.g., English, Spanish")
@@ -64,12 +83,49 @@ class Patient(models.Model):
     )
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     address = models.TextField(blank=True, null=True)
+    # Search keys kept in sync with name/phone_number by save() (bulk writers call normalize())
+    name_normalized = models.CharField(max_length=200, blank=True, editable=False, db_index=True)
+    phone_normalized = models.CharField(max_length=15, blank=True, editable=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.name} ({self.age}/{self.gender})"
 
+    @staticmethod
+    def normalize_name(value):
+        return ' '.join((value or '').split()).casefold()
+
+    @staticmethod
+    def normalize_phone(value):
+        return ''.join(ch for ch in (value or '') if ch.isdigit())
+
+    @classmethod
+    def search_key(cls, query):
+        """``(normalized field, term)`` to prefix-match a search query against."""
+        phone = cls.normalize_phone(query)
+        if phone and not any(ch.isalpha() for ch in query):
+            return 'phone_normalized', phone
+        return 'name_normalized', cls.normalize_name(query)
+
+    @staticmethod
+    def filter_prefix(queryset, key, term):
+        # PostgreSQL only orders by prefix under the C collation; LIKE 'term%' uses the pattern_ops index
+        if connections[queryset.db].vendor == 'postgresql':
+            return queryset.filter(**{f'{key}__startswith': term})
+        return queryset.filter(**{f'{key}__gte': term, f'{key}__lt': term + '\U0010ffff'})
+
+    def normalize(self):
+        self.name_normalized = self.normalize_name(self.name)[:200]
+        self.phone_normalized = self.normalize_phone(self.phone_number)[:15]
+
+    def save(self, *args, **kwargs):
+        self.normalize()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'name', 'phone_number'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'name_normalized', 'phone_normalized'}
+        super().save(*args, **kwargs)
+
 class EyeExamination(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='examinations')
     optometrist = models.ForeignKey(Optometrist, on_delete=models.CASCADE, related_name='exams_conducted', limit_choices_to={'role': 'optometrist'})
@@ -139,6 +195,45 @@ class EyeExamination(models.Model):
     # 6. Diagnosis & Advice
     provisional_diagnosis = models.TextField(blank=True)
     advice = models.TextField(blank=True)
+
+    # 7. Referral workflow
+    status = models.CharField(
+        max_length=20,
+        choices=[('pending', 'Pending Review'), ('accepted', 'Accepted'), ('closed', 'Closed')],
+        default='pending'
+    )
+
+    # 8. Parsed numeric companions of the text fields above, filled in on save()
+    # (see optometrist.clinical). Acuity in logMAR, refraction in diopters.
+    uncorrected_vision_re_logmar = models.DecimalField(max_digits=4, decimal_places=2, blank=True, null=True, editable=False)
+    uncorrected_vision_le_logmar = models.DecimalField(max_digits=4, decimal_places=2, blank=True, null=True, editable=False)
+    pinhole_vision_re_logmar = models.DecimalField(max_digits=4, decimal_places=2, blank=True, null=True, editable=False)
+    pinhole_vision_le_logmar = models.DecimalField(max_digits=4, decimal_places=2, blank=True, null=True, editable=False)
+    corrected_vision_re_logmar = models.DecimalField(max_digits=4, decimal_places=2, blank=True, null=True, editable=False)
+    corrected_vision_le_logmar = models.DecimalField(max_digits=4, decimal_places=2, blank=True, null=True, editable=False)
+    dv_sph_re_dpt = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True, editable=False)
+    dv_cyl_re_dpt = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True, editable=False)
+    dv_axis_re_deg = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
+    dv_vision_re_logmar = models.DecimalField(max_digits=4, decimal_places=2, blank=True, null=True, editable=False)
+    dv_sph_le_dpt = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True, editable=False)
+    dv_cyl_le_dpt = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True, editable=False)
+    dv_axis_le_deg = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
+    dv_vision_le_logmar = models.DecimalField(max_digits=4, decimal_places=2, blank=True, null=True, editable=False)
+    nv_sph_re_dpt = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True, editable=False)
+    nv_cyl_re_dpt = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True, editable=False)
+    nv_axis_re_deg = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
+    nv_vision_re_logmar = models.DecimalField(max_digits=4, decimal_places=2, blank=True, null=True, editable=False)
+    nv_sph_le_dpt = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True, editable=False)
+    nv_cyl_le_dpt = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True, editable=False)
+    nv_axis_le_deg = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
+    nv_vision_le_logmar = models.DecimalField(max_digits=4, decimal_places=2, blank=True, null=True, editable=False)
+    iop_re_mmhg = models.DecimalField(max_digits=4, decimal_places=1, blank=True, null=True, editable=False)
+    tbut_re_sec = models.DecimalField(max_digits=4, decimal_places=1, blank=True, null=True, editable=False)
+    schirmer_re_mm = models.DecimalField(max_digits=4, decimal_places=1, blank=True, null=True, editable=False)
+    iop_le_mmhg = models.DecimalField(max_digits=4, decimal_places=1, blank=True, null=True, editable=False)
+    tbut_le_sec = models.DecimalField(max_digits=4, decimal_places=1, blank=True, null=True, editable=False)
+    schirmer_le_mm = models.DecimalField(max_digits=4, decimal_places=1, blank=True, null=True, editable=False)
+    clinical_values_version = models.PositiveSmallIntegerField(default=0, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -146,19 +241,227 @@ class EyeExamination(models.Model):
     def __str__(self):
         return f"Exam for {self.patient.name} on {self.date_of_visit}"
 
+    def populate_clinical_values(self):
+        for field, value in parse_clinical_values(self).items():
+            setattr(self, field, value)
+        self.clinical_values_version = CLINICAL_VALUES_VERSION
+
+    def save(self, *args, **kwargs):
+        self.populate_clinical_values()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(NUMERIC_SOURCE_FIELDS) & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, *NUMERIC_TARGET_FIELDS, 'clinical_values_version'}
+        super().save(*args, **kwargs)
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the values as loaded, so post_save receivers can work out what changed
+        # (consultant load counters, analytics rollups) without re-reading the row.
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    @property
+    def open_consultant_id(self):
+        return self.consultant_id if self.status == 'pending' else None
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a doctor's worklist: WHERE consultant_id = ? ORDER BY created_at DESC, id DESC
+            models.Index(fields=['consultant', '-created_at', '-id'], name='exam_worklist_idx'),
+            # Lets backfill_clinical_values find stale rows without a full scan
+            models.Index(fields=['clinical_values_version', 'id'], name='exam_clinical_version_idx'),
+        ]
+
+EYE_CHOICES = [('Both eyes', 'Both eyes'), ('Right eye', 'Right eye'), ('Left eye', 'Left eye'), ('-', '-')]
+
+class FormularyEntry(models.Model):
+    """A drug the clinic prescribes, with the defaults filled in when it is picked for an exam."""
+    drug = models.CharField(max_length=200)
+    strength = models.CharField(max_length=50, blank=True, help_text="e.g., 0.5%")
+    dosage_form = models.CharField(max_length=50, blank=True, help_text="e.g., Eye drops, Ointment, Tablet")
+    default_quantity = models.CharField(max_length=50, blank=True)
+    default_frequency = models.CharField(max_length=100, blank=True)
+    default_eye = models.CharField(max_length=20, choices=EYE_CHOICES, default='Both eyes')
+    default_duration = models.CharField(max_length=100, blank=True)
+    default_instructions = models.TextField(blank=True)
+    # Retired entries stay for the prescriptions that point to them but are no longer suggested
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['drug', 'strength', 'dosage_form']
+        verbose_name_plural = 'formulary entries'
+        constraints = [
+            models.UniqueConstraint(fields=['drug', 'strength', 'dosage_form'], name='unique_formulary_entry'),
+        ]
+
+    @property
+    def label(self):
+        return ' '.join(part for part in (self.drug, self.strength, self.dosage_form) if part)
+
+    def __str__(self):
+        return self.label
+
 class Medication(models.Model):
     examination = models.ForeignKey(EyeExamination, on_delete=models.CASCADE, related_name='medications')
+    # Set when picked from the formulary; prescribing statistics group by it
+    formulary = models.ForeignKey(
+        FormularyEntry, on_delete=models.PROTECT, null=True, blank=True, related_name='prescriptions'
+    )
     name = models.CharField(max_length=200)
     quantity = models.CharField(max_length=50, blank=True)
     frequency = models.CharField(max_length=100)
-    eye = models.CharField(
-        max_length=20,
-        choices=[('Both eyes', 'Both eyes'), ('Right eye', 'Right eye'), ('Left eye', 'Left eye'), ('-', '-')],
-        default='Both eyes'
-    )
+    eye = models.CharField(max_length=20, choices=EYE_CHOICES, default='Both eyes')
     duration = models.CharField(max_length=100)
     instructions = models.TextField(blank=True)
+    # Part of the cache key of printed exam reports (see optometrist.reports)
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return self.name
-    
\ No newline at end of file
+    
+class ConsultantLoadManager(models.Manager):
+    def adjust(self, consultant_id, delta, assigned=False):
+        updates = {'open_referrals': Greatest(F('open_referrals') + delta, 0)}
+        if assigned:
+            updates['last_assigned_at'] = timezone.now()
+        if not self.filter(consultant_id=consultant_id).update(**updates):
+            self.get_or_create(
+                consultant_id=consultant_id,
+                defaults={'open_referrals': max(delta, 0), 'last_assigned_at': timezone.now() if assigned else None}
+            )
+
+    def record_assignments(self, counts):
+        """Add ``{consultant_id: count}`` newly assigned referrals from a bulk insert, one UPDATE per doctor."""
+        for consultant_id, count in counts.items():
+            self.adjust(consultant_id, count, assigned=True)
+
+class ConsultantLoad(models.Model):
+    """
+    Running count of pending referrals per doctor, maintained by signals and bulk
+    writers so auto-assignment never has to COUNT(*) the examination table.
+    """
+    consultant = models.OneToOneField(
+        Optometrist, on_delete=models.CASCADE, primary_key=True, related_name='load', limit_choices_to={'role': 'doctor'}
+    )
+    open_referrals = models.PositiveIntegerField(default=0)
+    last_assigned_at = models.DateTimeField(blank=True, null=True)
+
+    objects = ConsultantLoadManager()
+
+    def __str__(self):
+        return f"{self.consultant.name}: {self.open_referrals} open"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['open_referrals', 'last_assigned_at'], name='consultant_load_idx'),
+        ]
+
+class ExamRollup(models.Model):
+    """
+    Per staff member, per day/month counters of examinations, maintained incrementally
+    on save/delete (see optometrist.analytics) and rebuilt in bulk by rebuild_exam_rollups.
+    """
+    PERIOD_CHOICES = [('day', 'Day'), ('month', 'Month')]
+    ROLE_CHOICES = [('optometrist', 'Optometrist'), ('consultant', 'Consultant')]
+
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    staff = models.ForeignKey(Optometrist, on_delete=models.CASCADE, related_name='exam_rollups')
+    staff_role = models.CharField(max_length=20, choices=ROLE_CHOICES)
+
+    exam_count = models.PositiveIntegerField(default=0)
+    referred_count = models.PositiveIntegerField(default=0)
+
+    performed_ar_assessment_count = models.PositiveIntegerField(default=0)
+    performed_refraction_count = models.PositiveIntegerField(default=0)
+    performed_schirmer_count = models.PositiveIntegerField(default=0)
+    performed_tbut_count = models.PositiveIntegerField(default=0)
+    performed_slit_lamp_count = models.PositiveIntegerField(default=0)
+    performed_fundus_count = models.PositiveIntegerField(default=0)
+    performed_iop_count = models.PositiveIntegerField(default=0)
+
+    # Distance spherical equivalent (sph + cyl/2) per eye with a parsed refraction
+    refraction_eyes = models.PositiveIntegerField(default=0)
+    se_sum = models.DecimalField(max_digits=12, decimal_places=3, default=0)
+    se_high_myopia_eyes = models.PositiveIntegerField(default=0, help_text="SE <= -6.00 D")
+    se_myopia_eyes = models.PositiveIntegerField(default=0, help_text="-6.00 D < SE <= -0.50 D")
+    se_emmetropia_eyes = models.PositiveIntegerField(default=0, help_text="-0.50 D < SE < +0.50 D")
+    se_hyperopia_eyes = models.PositiveIntegerField(default=0, help_text="SE >= +0.50 D")
+
+    def __str__(self):
+        return f"{self.staff_id} {self.staff_role} {self.period} {self.period_start}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['staff', 'staff_role', 'period', 'period_start'], name='unique_exam_rollup'),
+        ]
+
+class ImportJob(models.Model):
+    """
+    Progress of one import_exams run over one source file, identified by its content
+    hash. Updated in the same transaction as each imported batch, so an interrupted
+    import resumes exactly after the last committed row.
+    """
+    source_name = models.CharField(max_length=255)
+    source_sha256 = models.CharField(max_length=64, unique=True)
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_created = models.PositiveIntegerField(default=0)
+    rows_failed = models.PositiveIntegerField(default=0)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source_name} ({self.rows_processed} rows)"
+
+class IdempotencyKey(models.Model):
+    """
+    The response to a create request sent with an ``Idempotency-Key`` header, stored
+    in the same transaction as the rows it created and replayed to retries until
+    ``expires_at`` (see optometrist.idempotency).
+    """
+    user = models.ForeignKey(Optometrist, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    path = models.CharField(max_length=255)
+    # SHA-256 of the request body; reusing a key for a different request is refused
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id} {self.key}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+class SyncChange(models.Model):
+    """
+    One entry per write to a table that offline tablets sync (see optometrist.sync).
+    ``seq`` is the clients' cursor; only the newest entry per object matters, and
+    compact_sync_changes deletes the superseded ones.
+    """
+    KIND_CHOICES = [
+        ('patients', 'Patient'),
+        ('examinations', 'Eye examination'),
+        ('medications', 'Medication'),
+        ('directory', 'Directory entry'),
+    ]
+
+    seq = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.seq} {self.kind} {self.object_id}{' deleted' if self.deleted else ''}"
+
+    class Meta:
+        indexes = [models.Index(fields=['kind', 'object_id'], name='syncchange_object_idx')]
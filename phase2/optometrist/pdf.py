@@ -0,0 +1,100 @@
+"""
+A minimal PDF writer for text reports.
+
+Enough of PDF 1.4 to lay out lines of text in the standard Helvetica/Courier
+fonts, plus horizontal rules, across A4 pages. No dependencies, so printable
+reports do not pull a PDF toolkit into the deployment.
+"""
+import textwrap
+
+A4 = (595, 842)
+FONTS = {
+    'regular': ('F1', 'Helvetica'),
+    'bold': ('F2', 'Helvetica-Bold'),
+    'mono': ('F3', 'Courier'),
+}
+# Rough average glyph width as a fraction of the font size, used for wrapping
+CHAR_WIDTH = {'regular': 0.5, 'bold': 0.55, 'mono': 0.6}
+
+
+def _escape(text):
+    encoded = text.encode('cp1252', errors='replace').decode('latin-1')
+    return encoded.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+class TextDocument:
+
+    def __init__(self, page_size=A4, margin=40):
+        self.width, self.height = page_size
+        self.margin = margin
+        self.pages = []
+        self.new_page()
+
+    def new_page(self):
+        self.pages.append([])
+        self.y = self.height - self.margin
+
+    def ensure_space(self, height):
+        if self.y - height < self.margin:
+            self.new_page()
+
+    def write(self, text, style='regular', size=10, indent=0, leading=1.35):
+        """Write text at the cursor, wrapping it to the page width."""
+        usable = self.width - 2 * self.margin - indent
+        columns = max(10, int(usable / (size * CHAR_WIDTH[style])))
+        for paragraph in str(text).splitlines() or ['']:
+            for line in textwrap.wrap(paragraph, columns, replace_whitespace=False) or ['']:
+                self.ensure_space(size * leading)
+                self.y -= size * leading
+                font = FONTS[style][0]
+                self.pages[-1].append(
+                    f'BT /{font} {size} Tf {self.margin + indent:.1f} {self.y:.1f} Td ({_escape(line)}) Tj ET'
+                )
+
+    def rule(self, gap=6):
+        self.ensure_space(gap * 2)
+        self.y -= gap
+        self.pages[-1].append(f'0.5 w {self.margin} {self.y:.1f} m {self.width - self.margin} {self.y:.1f} l S')
+        self.y -= gap
+
+    def space(self, height=6):
+        self.y -= height
+
+    def render(self):
+        objects = []
+
+        def add(body):
+            objects.append(body)
+            return len(objects)
+
+        catalog = add(None)
+        pages_id = add(None)
+        font_ids = {
+            key: add(f'<< /Type /Font /Subtype /Type1 /BaseFont /{name} /Encoding /WinAnsiEncoding >>'.encode())
+            for key, name in FONTS.values()
+        }
+        resources = ' '.join(f'/{key} {object_id} 0 R' for key, object_id in font_ids.items())
+
+        page_ids = []
+        for operations in self.pages:
+            stream = '\n'.join(operations).encode('latin-1')
+            content = add(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+            page_ids.append(add(
+                f'<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {self.width} {self.height}] '
+                f'/Resources << /Font << {resources} >> >> /Contents {content} 0 R >>'.encode()
+            ))
+        objects[catalog - 1] = f'<< /Type /Catalog /Pages {pages_id} 0 R >>'.encode()
+        kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+        objects[pages_id - 1] = f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode()
+
+        output = bytearray(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(output))
+            output += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        xref = len(output)
+        output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        for offset in offsets:
+            output += b'%010d 00000 n \n' % offset
+        output += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, catalog, xref)
+        return bytes(output)
@@ -0,0 +1,15 @@
+from rest_framework import permissions
+
+
+class IsOptometrist(permissions.BasePermission):
+    message = 'This endpoint is for optometrists only.'
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and request.user.role == 'optometrist')
+
+
+class IsDoctor(permissions.BasePermission):
+    message = 'This endpoint is for doctors only.'
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and request.user.role == 'doctor')
@@ -0,0 +1,196 @@
+"""
+Printable prescription/exam reports (HTML and PDF).
+
+Rendered reports are cached under a content address: a hash of the exam's
+updated_at, its medications' count and latest updated_at, the updated_at of
+its patient, optometrist and consultant, the format and REPORT_LAYOUT_VERSION.
+Any edit changes the address, so entries never need invalidating, and a reprint
+costs one aggregate query plus a cache read.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Max, Prefetch
+from django.template.loader import render_to_string
+
+from .models import EyeExamination, Medication
+from .pdf import TextDocument
+
+# Bump when the templates or the PDF layout change so cached reports are re-rendered
+REPORT_LAYOUT_VERSION = 1
+
+CONTENT_TYPES = {
+    'html': 'text/html; charset=utf-8',
+    'pdf': 'application/pdf',
+}
+
+ACUITY_ROWS = [
+    ('Uncorrected', 'uncorrected_vision'),
+    ('Pinhole', 'pinhole_vision'),
+    ('Best corrected', 'corrected_vision'),
+]
+INVESTIGATIONS = [
+    ('Schirmer', 'performed_schirmer', 'schirmer'),
+    ('TBUT', 'performed_tbut', 'tbut'),
+    ('Slit lamp', 'performed_slit_lamp', 'slit_lamp'),
+    ('Fundus', 'performed_fundus', 'fundus'),
+    ('IOP', 'performed_iop', 'iop'),
+]
+
+
+def _config():
+    return getattr(settings, 'REPORT_CACHE', {'ALIAS': 'default', 'TIMEOUT': 60 * 60 * 24 * 30})
+
+
+def report_cache():
+    return caches[_config()['ALIAS']]
+
+
+def report_fingerprints(exams):
+    """Content address of the current report of each exam in the queryset, in one query."""
+    rows = (
+        exams.order_by()
+        .annotate(medication_count=Count('medications'), medications_updated_at=Max('medications__updated_at'))
+        .values_list(
+            'pk', 'medication_count', 'updated_at', 'medications_updated_at',
+            # The report also prints the patient's details and the staff names
+            'patient__updated_at', 'optometrist__updated_at', 'consultant__updated_at',
+        )
+    )
+    return {
+        pk: hashlib.sha256(
+            f'{REPORT_LAYOUT_VERSION}:{pk}:{count}:'
+            f'{":".join(value.isoformat() if value else "" for value in timestamps)}'.encode()
+        ).hexdigest()
+        for pk, count, *timestamps in rows
+    }
+
+
+def report_timeout():
+    return _config()['TIMEOUT']
+
+
+def report_key(fmt, fingerprint):
+    return f'report:{fmt}:{fingerprint}'
+
+
+def load_exams(exam_ids):
+    return EyeExamination.objects.filter(pk__in=exam_ids).select_related(
+        'patient', 'optometrist', 'consultant'
+    ).prefetch_related(Prefetch('medications', queryset=Medication.objects.order_by('id')))
+
+
+def report_context(exam):
+    eyes = ('re', 'le')
+    return {
+        'exam': exam,
+        'patient': exam.patient,
+        'acuity': [
+            (label, *(getattr(exam, f'{prefix}_{eye}') for eye in eyes)) for label, prefix in ACUITY_ROWS
+        ],
+        'refraction': [
+            (f'{distance.upper()} {eye.upper()}', *(getattr(exam, f'{distance}_{part}_{eye}') for part in ('sph', 'cyl', 'axis', 'vision')))
+            for distance in ('dv', 'nv') for eye in eyes
+        ],
+        'investigations': [
+            (label, getattr(exam, f'{field}_re'), getattr(exam, f'{field}_le'))
+            for label, flag, field in INVESTIGATIONS if getattr(exam, flag)
+        ],
+        'medications': list(exam.medications.all()),
+    }
+
+
+def render_html(exam):
+    return render_to_string('optometrist/exam_report.html', report_context(exam)).encode()
+
+
+def _table(document, header, rows, widths):
+    def line(cells):
+        return ' '.join(str(cell or '-')[:width].ljust(width) for cell, width in zip(cells, widths))
+    document.write(line(header), style='mono', size=9)
+    for row in rows:
+        document.write(line(row), style='mono', size=9)
+
+
+def render_pdf(exam):
+    context = report_context(exam)
+    patient = context['patient']
+    document = TextDocument()
+    document.write('EyeSphere - Eye Examination Report', style='bold', size=16)
+    document.write(
+        f'Exam #{exam.pk}   Date of visit: {exam.date_of_visit:%d %b %Y}   '
+        f'Optometrist: {exam.optometrist.name}'
+        + (f'   Consultant: {exam.consultant.name}' if exam.consultant else ''),
+        size=9,
+    )
+    document.rule()
+    document.write(
+        f'Patient: {patient.name}   Age/Sex: {patient.age}/{patient.get_gender_display()}'
+        + (f'   Phone: {patient.phone_number}' if patient.phone_number else ''),
+        style='bold', size=11,
+    )
+    if exam.chief_complaints:
+        document.write(f'Chief complaints: {exam.chief_complaints}')
+
+    document.space()
+    document.write('Visual acuity', style='bold', size=11)
+    _table(document, ('', 'RE', 'LE'), context['acuity'], (16, 12, 12))
+
+    document.space()
+    document.write('Refraction', style='bold', size=11)
+    _table(document, ('', 'SPH', 'CYL', 'AXIS', 'VISION'), context['refraction'], (8, 10, 10, 8, 10))
+
+    if context['investigations']:
+        document.space()
+        document.write('Investigations', style='bold', size=11)
+        _table(document, ('', 'RE', 'LE'), context['investigations'], (12, 30, 30))
+
+    document.space()
+    document.write('Provisional diagnosis', style='bold', size=11)
+    document.write(exam.provisional_diagnosis or '-')
+
+    document.space()
+    document.write('Rx - Medications', style='bold', size=11)
+    if context['medications']:
+        _table(
+            document,
+            ('MEDICINE', 'EYE', 'FREQUENCY', 'DURATION', 'QTY'),
+            [(m.name, m.eye, m.frequency, m.duration, m.quantity) for m in context['medications']],
+            (30, 10, 14, 14, 10),
+        )
+        for medication in context['medications']:
+            if medication.instructions:
+                document.write(f'{medication.name}: {medication.instructions}', size=9)
+    else:
+        document.write('None prescribed')
+
+    document.space()
+    document.write('Advice', style='bold', size=11)
+    document.write(exam.advice or '-')
+    return document.render()
+
+
+RENDERERS = {'html': render_html, 'pdf': render_pdf}
+
+
+def get_reports(exams, fmt):
+    """
+    Return {exam_id: report bytes} for the exams in the queryset, rendering only
+    the ones not already cached. Misses are fetched in two queries and rendered
+    one after another: rendering is pure Python, so threads would only contend
+    for the GIL.
+    """
+    fingerprints = report_fingerprints(exams)
+    cache = report_cache()
+    keys = {pk: report_key(fmt, fingerprint) for pk, fingerprint in fingerprints.items()}
+    cached = cache.get_many(keys.values())
+    reports = {pk: cached[key] for pk, key in keys.items() if key in cached}
+
+    missing = [pk for pk in keys if pk not in reports]
+    if missing:
+        render = RENDERERS[fmt]
+        rendered = {exam.pk: render(exam) for exam in load_exams(missing)}
+        cache.set_many({keys[pk]: body for pk, body in rendered.items()}, timeout=report_timeout())
+        reports.update(rendered)
+    return reports
@@ -0,0 +1,238 @@
+"""
+Full-text search over examinations.
+
+One search document per exam holds chief_complaints, provisional_diagnosis,
+advice, history_eye_disease and the patient's name. On SQLite it lives in an
+FTS5 table ranked with bm25(); on PostgreSQL in a table of weighted tsvectors
+with a GIN index, ranked with ts_rank(). Other backends fall back to icontains.
+
+Documents are written in the same transaction as the exam (signals for single
+saves, index_exams() from bulk paths), and rebuild_exam_search recreates them all.
+"""
+import re
+
+from django.db import connections, router, transaction
+
+FTS_TABLE = 'optometrist_exam_fts'
+TSVECTOR_TABLE = 'optometrist_exam_search'
+DOCUMENT_FIELDS = ['chief_complaints', 'provisional_diagnosis', 'advice', 'history_eye_disease', 'patient_name']
+# Relative importance of each field, in DOCUMENT_FIELDS order
+FIELD_WEIGHTS = [2.0, 3.0, 1.0, 1.0, 2.0]
+POSTGRES_WEIGHTS = ['B', 'A', 'C', 'C', 'B']
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def query_terms(text):
+    return _TOKEN.findall(text or '')[:16]
+
+
+# The same document built in SQL, for (re)indexing every exam in one statement
+DOCUMENT_SELECT = (
+    "SELECT e.id, e.chief_complaints, e.provisional_diagnosis, e.advice, "
+    "CASE WHEN e.history_eye_disease = 'NA' THEN '' ELSE e.history_eye_disease END, p.name "
+    "FROM optometrist_eyeexamination e INNER JOIN optometrist_patient p ON p.id = e.patient_id"
+)
+
+
+def exam_document(exam):
+    return [
+        exam.chief_complaints or '',
+        exam.provisional_diagnosis or '',
+        exam.advice or '',
+        '' if exam.history_eye_disease in (None, 'NA') else exam.history_eye_disease,
+        exam.patient.name if exam.patient_id else '',
+    ]
+
+
+class FTS5Backend:
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"{', '.join(DOCUMENT_FIELDS)}, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+    def index(self, cursor, documents):
+        # rowid is the exam id
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk, _ in documents])
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(DOCUMENT_FIELDS)}) VALUES (%s, %s, %s, %s, %s, %s)",
+            [(pk, *fields) for pk, fields in documents],
+        )
+
+    def remove(self, cursor, exam_ids):
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in exam_ids])
+
+    def clear(self, cursor):
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    def populate(self, cursor):
+        cursor.execute(f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(DOCUMENT_FIELDS)}) {DOCUMENT_SELECT}")
+
+    def search(self, cursor, text, subquery, params, limit):
+        # Every term must match; each one also matches as a prefix ("catar" finds "cataract")
+        match = ' '.join(f'"{term}"*' for term in query_terms(text))
+        if not match:
+            return []
+        weights = ', '.join(str(weight) for weight in FIELD_WEIGHTS)
+        cursor.execute(
+            f"SELECT rowid, bm25({FTS_TABLE}, {weights}) AS score FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid IN ({subquery}) ORDER BY score LIMIT %s",
+            [match, *params, limit],
+        )
+        return [(pk, -score) for pk, score in cursor.fetchall()]
+
+
+class PostgresBackend:
+    config = 'english'
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {TSVECTOR_TABLE} ("
+            f"exam_id integer PRIMARY KEY REFERENCES optometrist_eyeexamination (id) "
+            f"ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, document tsvector NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TSVECTOR_TABLE}_document_idx ON {TSVECTOR_TABLE} USING GIN (document)"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {TSVECTOR_TABLE}")
+
+    def _vector_sql(self, columns):
+        return ' || '.join(
+            f"setweight(to_tsvector('{self.config}', {column}), '{weight}')"
+            for column, weight in zip(columns, POSTGRES_WEIGHTS)
+        )
+
+    def index(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {TSVECTOR_TABLE} (exam_id, document) VALUES (%s, {self._vector_sql(['%s'] * len(DOCUMENT_FIELDS))}) "
+            f"ON CONFLICT (exam_id) DO UPDATE SET document = EXCLUDED.document",
+            [(pk, *fields) for pk, fields in documents],
+        )
+
+    def remove(self, cursor, exam_ids):
+        cursor.execute(f"DELETE FROM {TSVECTOR_TABLE} WHERE exam_id = ANY(%s)", [list(exam_ids)])
+
+    def clear(self, cursor):
+        cursor.execute(f"TRUNCATE {TSVECTOR_TABLE}")
+
+    def populate(self, cursor):
+        columns = [f'd.c{number}' for number in range(len(DOCUMENT_FIELDS))]
+        cursor.execute(
+            f"INSERT INTO {TSVECTOR_TABLE} (exam_id, document) SELECT d.id, {self._vector_sql(columns)} "
+            f"FROM ({DOCUMENT_SELECT}) AS d (id, {', '.join(column[2:] for column in columns)})"
+        )
+
+    def search(self, cursor, text, subquery, params, limit):
+        terms = query_terms(text)
+        if not terms:
+            return []
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        cursor.execute(
+            f"SELECT exam_id, ts_rank(document, query) AS score "
+            f"FROM {TSVECTOR_TABLE}, to_tsquery('{self.config}', %s) AS query "
+            f"WHERE document @@ query AND exam_id IN ({subquery}) ORDER BY score DESC LIMIT %s",
+            [tsquery, *params, limit],
+        )
+        return cursor.fetchall()
+
+
+class ContainsBackend:
+    """No search index: every term has to appear in one of the document fields."""
+
+    def create(self, cursor):
+        pass
+
+    drop = create
+
+    def index(self, cursor, documents):
+        pass
+
+    def remove(self, cursor, exam_ids):
+        pass
+
+    def clear(self, cursor):
+        pass
+
+    populate = clear
+
+
+BACKENDS = {'sqlite': FTS5Backend, 'postgresql': PostgresBackend}
+
+
+def backend_for(connection):
+    return BACKENDS.get(connection.vendor, ContainsBackend)()
+
+
+def _write_connection():
+    from .models import EyeExamination
+    return connections[router.db_for_write(EyeExamination)]
+
+
+def index_exams(exams):
+    """(Re)write the search documents of these exams; patients should be select_related or cached."""
+    exams = list(exams)
+    if not exams:
+        return
+    connection = _write_connection()
+    with connection.cursor() as cursor:
+        backend_for(connection).index(cursor, [(exam.pk, exam_document(exam)) for exam in exams])
+
+
+def unindex_exams(exam_ids):
+    exam_ids = list(exam_ids)
+    if not exam_ids:
+        return
+    connection = _write_connection()
+    with connection.cursor() as cursor:
+        backend_for(connection).remove(cursor, exam_ids)
+
+
+def search_exams(queryset, text, limit=50):
+    """
+    ``[(exam_id, score), ...]`` for exams in ``queryset`` matching every term of ``text``,
+    best first. The queryset is applied inside the search query, so restricting it
+    (e.g. to a doctor's referrals) does not cost an extra round trip.
+    """
+    connection = connections[queryset.db]
+    backend = backend_for(connection)
+    if isinstance(backend, ContainsBackend):
+        from django.db.models import Q
+        for term in query_terms(text):
+            queryset = queryset.filter(
+                Q(chief_complaints__icontains=term) | Q(provisional_diagnosis__icontains=term)
+                | Q(advice__icontains=term) | Q(history_eye_disease__icontains=term)
+                | Q(patient__name__icontains=term)
+            )
+        return [(pk, 1.0) for pk in queryset.order_by('-created_at').values_list('pk', flat=True)[:limit]]
+    subquery, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        return backend.search(cursor, text, subquery, params, limit)
+
+
+def create_index(connection):
+    with connection.cursor() as cursor:
+        backend_for(connection).create(cursor)
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        backend_for(connection).drop(cursor)
+
+
+def rebuild():
+    """Recreate every search document in one transaction. Returns the number of exams indexed."""
+    from .models import EyeExamination
+    connection = _write_connection()
+    backend = backend_for(connection)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        backend.create(cursor)
+        backend.clear(cursor)
+        backend.populate(cursor)
+    return EyeExamination.objects.using(connection.alias).count()
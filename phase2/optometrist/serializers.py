@@ -1,6 +1,11 @@
 from rest_framework import serializers
 from .models import Optometrist
 from django.contrib.auth.hashers import make_password
+from collections import Counter
+from itertools import zip_longest
+from django.db import transaction
+from .thumbnails import variant_urls
+from .projection import Computed, Projection
 
 class OptometristSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,27 +24,175 @@ class OptometristSerializer(serializers.ModelSerializer):
         return Optometrist.objects.create_user(**validated_data)
 
 class OptometristProfileSerializer(serializers.ModelSerializer):
+    profile_picture_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Optometrist
         exclude = ['password']
         read_only_fields = ['id', 'email', 'license_number', 'created_at', 'updated_at']
 
-from .models import Patient, EyeExamination, Medication
+    def get_profile_picture_variants(self, obj):
+        picture = obj.profile_picture
+        return profile_picture_variant_urls(self.context, obj.pk, picture.name, obj.profile_picture_variants)
+
+def profile_picture_variant_urls(context, optometrist_id, picture_name, variants):
+    urls = variant_urls(Optometrist._meta.get_field('profile_picture').storage, picture_name, variants)
+    request = context.get('request')
+    if urls is not None and request is not None:
+        urls = {name: request.build_absolute_uri(url) for name, url in urls.items()}
+    return urls
+
+OPTOMETRIST_PROFILE_PROJECTION = Projection(OptometristProfileSerializer, computed={
+    'profile_picture_variants': Computed(['id', 'profile_picture', 'profile_picture_variants'], profile_picture_variant_urls),
+})
+
+from .models import Patient, EyeExamination, Medication, ConsultantLoad
+from phase2.sqlite import retry_on_database_locked
+from . import analytics, formulary, search, sync
+from .signals import exams_created
+from .assignment import get_assignment_strategy
 
 class PatientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patient
-        fields = '__all__'
+        exclude = ['name_normalized', 'phone_normalized']
+
+class PatientSearchResultSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Patient
+        fields = ['id', 'name', 'age', 'gender', 'phone_number']
+
+class FormularyEntryField(serializers.IntegerField):
+    """A FormularyEntry id, checked against the in-process formulary index; an unknown id rechecks the database first."""
+    default_error_messages = {
+        'does_not_exist': 'Formulary entry "{pk_value}" does not exist or is no longer prescribed.',
+    }
+
+    def to_internal_value(self, data):
+        pk = super().to_internal_value(data)
+        if formulary.get_entry(pk) is None:
+            self.fail('does_not_exist', pk_value=pk)
+        return pk
 
 class MedicationSerializer(serializers.ModelSerializer):
+    # Picking a formulary entry fills in whatever the prescriber left out from its defaults
+    formulary = FormularyEntryField(source='formulary_id', required=False, allow_null=True)
+
     class Meta:
         model = Medication
-        fields = ['name', 'quantity', 'frequency', 'eye', 'duration', 'instructions']
+        fields = ['formulary', 'name', 'quantity', 'frequency', 'eye', 'duration', 'instructions']
+        extra_kwargs = {field: {'required': False} for field in ('name', 'frequency', 'duration')}
+
+    def validate(self, attrs):
+        entry = formulary.get_entry(attrs['formulary_id']) if attrs.get('formulary_id') else None
+        if entry is not None:
+            for field in ('name', 'quantity', 'frequency', 'eye', 'duration', 'instructions'):
+                if not attrs.get(field):
+                    attrs[field] = entry[field]
+        missing = {field: 'This field is required.' for field in ('name', 'frequency', 'duration') if not attrs.get(field)}
+        if missing:
+            raise serializers.ValidationError(missing)
+        return attrs
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Looks related rows up in ``context['preloaded'][field_name]`` when a batch
+    has already fetched them with one ``in_bulk`` query, instead of one query per item.
+    """
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get('preloaded', {}).get(self.field_name)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in preloaded:
+            self.fail('does_not_exist', pk_value=data)
+        return preloaded[pk]
+
+
+def preload_related(serializer, items):
+    """Fetch every PreloadedPrimaryKeyRelatedField target referenced by ``items`` in one query per field."""
+    preloaded = {}
+    for field_name, field in serializer.fields.items():
+        if not isinstance(field, PreloadedPrimaryKeyRelatedField):
+            continue
+        pks = set()
+        for item in items:
+            value = item.get(field_name) if isinstance(item, dict) else None
+            try:
+                pks.add(int(value))
+            except (TypeError, ValueError):
+                continue
+        preloaded[field_name] = field.get_queryset().in_bulk(pks) if pks else {}
+    return preloaded
+
+
+class EyeExaminationListSerializer(serializers.ListSerializer):
+
+    @retry_on_database_locked()
+    def create(self, validated_data):
+        # One transaction and three multi-row INSERTs (patients, exams, medications)
+        # regardless of how many exams are in the batch.
+        with transaction.atomic():
+            rows = []
+            for attrs in validated_data:
+                attrs = dict(attrs)
+                medications_data = attrs.pop('medications', [])
+                patient = self.child.pop_patient(attrs)
+                rows.append((attrs, patient, medications_data))
+
+            new_patients = [patient for _, patient, _ in rows if patient.pk is None]
+            for patient in new_patients:
+                patient.normalize()
+            Patient.objects.bulk_create(new_patients)
+            sync.record_changes('patients', [patient.pk for patient in new_patients])
+
+            # Auto-assign consultants for the whole batch, one strategy call per specialization
+            unassigned = {}
+            for attrs, _, _ in rows:
+                specialization = attrs.pop('specialization', None)
+                if 'consultant' not in attrs:
+                    unassigned.setdefault(specialization, []).append(attrs)
+            strategy = get_assignment_strategy()
+            for specialization, group in unassigned.items():
+                consultants = strategy.assign_many(len(group), specialization)
+                for attrs, consultant in zip_longest(group, consultants):
+                    attrs['consultant'] = consultant
+
+            exams = []
+            for attrs, patient, _ in rows:
+                attrs['patient'] = patient
+                exam = EyeExamination(**attrs)
+                exam.populate_clinical_values()
+                exams.append(exam)
+            EyeExamination.objects.bulk_create(exams)
+            sync.record_changes('examinations', [exam.pk for exam in exams])
+            # bulk_create skips post_save, so move the load counters and rollups here
+            ConsultantLoad.objects.record_assignments(
+                Counter(exam.open_consultant_id for exam in exams if exam.open_consultant_id)
+            )
+            analytics.record_created(exams)
+            search.index_exams(exams)
+
+            medications = Medication.objects.bulk_create([
+                Medication(examination=exam, **med_data)
+                for exam, (_, _, medications_data) in zip(exams, rows)
+                for med_data in medications_data
+            ])
+            sync.record_changes('medications', [medication.pk for medication in medications])
+            exams_created.send(sender=EyeExamination, exams=exams)
+        return exams
+
 
 class EyeExaminationSerializer(serializers.ModelSerializer):
     medications = MedicationSerializer(many=True, required=False)
     patient = PatientSerializer(read_only=True)
-    patient_id = serializers.PrimaryKeyRelatedField(
+    patient_id = PreloadedPrimaryKeyRelatedField(
         queryset=Patient.objects.all(), source='patient', write_only=True, required=False
     )
     # Fields to create new patient inline
@@ -50,19 +203,28 @@ class EyeExaminationSerializer(serializers.ModelSerializer):
     address = serializers.CharField(write_only=True, required=False)
     
     # Consultant selection
-    consultant_id = serializers.PrimaryKeyRelatedField(
+    consultant_id = PreloadedPrimaryKeyRelatedField(
         queryset=Optometrist.objects.filter(role='doctor'), source='consultant', write_only=True, required=False
     )
+    # Preferred specialization when the consultant is auto-assigned
+    specialization = serializers.CharField(write_only=True, required=False, allow_blank=True)
 
     class Meta:
         model = EyeExamination
-        fields = '__all__'
-        read_only_fields = ['optometrist', 'date_of_visit', 'consultant']
+        exclude = ['clinical_values_version']
+        read_only_fields = ['optometrist', 'date_of_visit', 'consultant', 'status']
+        list_serializer_class = EyeExaminationListSerializer
 
-    def create(self, validated_data):
-        medications_data = validated_data.pop('medications', [])
-        
-        # Patient Handling
+    def validate(self, attrs):
+        if not attrs.get('patient') and not attrs.get('name'):
+            raise serializers.ValidationError("Patient must be provided or created (name is required).")
+        return attrs
+
+    def pop_patient(self, validated_data):
+        """
+        Remove the inline patient fields from ``validated_data`` and return the
+        patient to attach: the existing one, or a new unsaved instance.
+        """
         patient = validated_data.pop('patient', None)
         
         # Extract patient fields validation data
@@ -72,18 +234,32 @@ class EyeExaminationSerializer(serializers.ModelSerializer):
         phone = validated_data.pop('phone_number', '')
         addr = validated_data.pop('address', '')
         
-        if not patient and name:
-            # Create new patient
-            patient = Patient.objects.create(
+        if not patient:
+            patient = Patient(
                 name=name,
                 age=age,
                 gender=gender,
                 phone_number=phone,
                 address=addr
             )
+        return patient
+
+    @retry_on_database_locked()
+    def create(self, validated_data):
+        with transaction.atomic():
+            # The consultant rows claimed by the assignment strategy stay locked until the exam is saved.
+            # _create pops keys, so it gets a copy that a locked-database retry can redo from.
+            return self._create(dict(validated_data))
+
+    def _create(self, validated_data):
+        medications_data = validated_data.pop('medications', [])
+        specialization = validated_data.pop('specialization', None)
         
-        if not patient:
-            raise serializers.ValidationError("Patient must be provided or created (name is required).")
+        # Patient Handling
+        patient = self.pop_patient(validated_data)
+        if patient.pk is None:
+            # Create new patient
+            patient.save()
             
         validated_data['patient'] = patient
         
@@ -91,7 +267,7 @@ class EyeExaminationSerializer(serializers.ModelSerializer):
         # If consultant_id was passed, it's already validated and put into validated_data key 'consultant' by source='consultant'
         if 'consultant' not in validated_data:
             # Fallback: Auto-assign a doctor (Consultant)
-            doctor = Optometrist.objects.filter(role='doctor', is_active=True).first()
+            doctor = get_assignment_strategy().assign(specialization)
             if doctor:
                 validated_data['consultant'] = doctor
             else:
@@ -102,7 +278,49 @@ class EyeExaminationSerializer(serializers.ModelSerializer):
         exam = EyeExamination.objects.create(**validated_data)
         
         # Create Medications
-        for med_data in medications_data:
-            Medication.objects.create(examination=exam, **med_data)
+        medications = Medication.objects.bulk_create([
+            Medication(examination=exam, **med_data) for med_data in medications_data
+        ])
+        sync.record_changes('medications', [medication.pk for medication in medications])
             
         return exam
+
+from .clinical import NUMERIC_TARGET_FIELDS
+
+class PatientHistoryExamSerializer(serializers.ModelSerializer):
+    """One visit in a patient's history; the patient and parsed values are given once for the whole history."""
+    medications = MedicationSerializer(many=True, read_only=True)
+    optometrist_name = serializers.CharField(source='optometrist.name', read_only=True)
+    consultant_name = serializers.CharField(source='consultant.name', read_only=True, default=None)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+
+    class Meta:
+        model = EyeExamination
+        exclude = ['clinical_values_version', 'patient', *NUMERIC_TARGET_FIELDS]
+
+class SyncExaminationSerializer(serializers.ModelSerializer):
+    """An exam as delta sync sends it: related rows by id, since they sync on their own."""
+    class Meta:
+        model = EyeExamination
+        exclude = ['clinical_values_version', *NUMERIC_TARGET_FIELDS]
+
+class SyncMedicationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Medication
+        fields = '__all__'
+
+from .models import ExamRollup
+
+class ExamRollupSerializer(serializers.ModelSerializer):
+    referral_rate = serializers.SerializerMethodField()
+    mean_spherical_equivalent = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExamRollup
+        exclude = ['id']
+
+    def get_referral_rate(self, obj):
+        return round(obj.referred_count / obj.exam_count, 4) if obj.exam_count else None
+
+    def get_mean_spherical_equivalent(self, obj):
+        return round(float(obj.se_sum) / obj.refraction_eyes, 2) if obj.refraction_eyes else None
@@ -0,0 +1,156 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import Signal, receiver
+
+from . import analytics, formulary, search, sync
+from .authentication import forget_cached_user
+from .cache import bump_directory_version
+from .models import Optometrist, Patient, EyeExamination, Medication, ConsultantLoad, FormularyEntry
+from .thumbnails import schedule_variants, variants_current
+
+# Sent with exams=[...] by bulk writers that skip post_save (EyeExaminationListSerializer.create)
+exams_created = Signal()
+
+
+@receiver(post_save, sender=Optometrist)
+def ensure_consultant_load(sender, instance, created, **kwargs):
+    if instance.role == 'doctor':
+        ConsultantLoad.objects.get_or_create(consultant=instance)
+
+
+@receiver(post_save, sender=Optometrist)
+@receiver(post_delete, sender=Optometrist)
+def invalidate_directory_cache(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login; letting that lag by one TTL keeps the directory cache useful
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_directory_version()
+
+
+@receiver(post_save, sender=Optometrist)
+@receiver(post_delete, sender=Optometrist)
+def revoke_cached_user(sender, instance, update_fields=None, **kwargs):
+    # Deactivation, role or name changes must reach ClaimsJWTAuthentication on the next request
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    forget_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=Optometrist)
+def queue_profile_picture_variants(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'profile_picture' not in update_fields:
+        return
+    # New or replaced picture, or a removed one whose variants need deleting
+    if instance.profile_picture and not variants_current(instance):
+        schedule_variants(instance.pk)
+    elif not instance.profile_picture and instance.profile_picture_variants:
+        schedule_variants(instance.pk)
+
+
+@receiver(m2m_changed, sender=Optometrist.groups.through)
+@receiver(m2m_changed, sender=Optometrist.user_permissions.through)
+def invalidate_directory_cache_on_m2m(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_directory_version()
+
+
+@receiver(post_save, sender=EyeExamination)
+def track_consultant_load_on_save(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_values', {})
+    if created:
+        previous_consultant_id = previous = None
+    elif 'consultant_id' in loaded and 'status' in loaded:
+        previous_consultant_id = loaded['consultant_id']
+        previous = previous_consultant_id if loaded['status'] == 'pending' else None
+    else:
+        # Saved from a partially loaded instance; nothing to compare against
+        return
+
+    current = instance.open_consultant_id
+    if previous != current:
+        if previous:
+            ConsultantLoad.objects.adjust(previous, -1)
+        if current:
+            ConsultantLoad.objects.adjust(current, 1, assigned=previous_consultant_id != instance.consultant_id)
+
+
+@receiver(post_delete, sender=EyeExamination)
+def track_consultant_load_on_delete(sender, instance, **kwargs):
+    if instance.open_consultant_id:
+        ConsultantLoad.objects.adjust(instance.open_consultant_id, -1)
+
+
+@receiver(post_save, sender=EyeExamination)
+def update_rollups_on_save(sender, instance, created, **kwargs):
+    analytics.record_saved(instance, created)
+
+
+@receiver(post_delete, sender=EyeExamination)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    analytics.record_deleted(instance)
+
+
+SEARCH_DOCUMENT_FIELDS = {'chief_complaints', 'provisional_diagnosis', 'advice', 'history_eye_disease', 'patient'}
+
+
+@receiver(post_save, sender=EyeExamination)
+def update_search_index_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCH_DOCUMENT_FIELDS & set(update_fields):
+        return
+    search.index_exams([instance])
+
+
+@receiver(post_delete, sender=EyeExamination)
+def update_search_index_on_delete(sender, instance, **kwargs):
+    search.unindex_exams([instance.pk])
+
+
+@receiver(post_save, sender=Patient)
+def update_search_index_on_patient_save(sender, instance, created, update_fields=None, **kwargs):
+    # The patient's name is part of each of their exams' documents
+    if created or (update_fields is not None and 'name' not in update_fields):
+        return
+    exams = list(EyeExamination.objects.filter(patient=instance).only(
+        'id', 'patient', 'chief_complaints', 'provisional_diagnosis', 'advice', 'history_eye_disease'
+    ))
+    for exam in exams:
+        exam.patient = instance
+    search.index_exams(exams)
+
+
+@receiver(post_save, sender=FormularyEntry)
+@receiver(post_delete, sender=FormularyEntry)
+def refresh_formulary_index(sender, instance, **kwargs):
+    transaction.on_commit(formulary.formulary_changed)
+
+
+SYNC_KINDS = {Patient: 'patients', EyeExamination: 'examinations', Medication: 'medications', Optometrist: 'directory'}
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=EyeExamination)
+@receiver(post_save, sender=Medication)
+@receiver(post_save, sender=Optometrist)
+def record_sync_change_on_save(sender, instance, update_fields=None, **kwargs):
+    if sender is Optometrist and update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    sync.record_changes(SYNC_KINDS[sender], [instance.pk])
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=EyeExamination)
+@receiver(post_delete, sender=Medication)
+@receiver(post_delete, sender=Optometrist)
+def record_sync_change_on_delete(sender, instance, **kwargs):
+    sync.record_changes(SYNC_KINDS[sender], [instance.pk], deleted=True)
+
+
+@receiver(m2m_changed, sender=Optometrist.groups.through)
+@receiver(m2m_changed, sender=Optometrist.user_permissions.through)
+def record_sync_change_on_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    # Directory entries list their groups and permissions
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    ids = pk_set if reverse else [instance.pk]
+    if ids:
+        sync.record_changes('directory', ids)
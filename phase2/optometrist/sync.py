@@ -0,0 +1,91 @@
+"""
+Delta sync for offline clinic tablets.
+
+Every write to a synced table appends a SyncChange in the same transaction:
+signals cover single saves and deletes, record_changes() the bulk writers. A
+change's ``seq`` only grows, so a tablet keeps the ``seq`` of the last change it
+applied as its cursor and asks for what came after it. A page reads at most
+``limit`` changes, keeps the newest per object, and loads the current rows of
+the changed objects with one query per kind; objects that are gone (or not
+visible to the user) are sent as tombstones. A visible exam brings its patient
+along, since it may be the one that makes the patient visible. The cost of a reconnect follows
+the number of changes since the cursor, not the size of the tables.
+
+SQLite commits one writer at a time, so changes become visible in ``seq``
+order. Other databases can commit a lower ``seq`` after a higher one, so there
+only changes older than SYNC['SETTLE_SECONDS'] are handed out; the setting must
+exceed the longest write transaction.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .models import Medication, Optometrist, SyncChange
+
+KINDS = [kind for kind, _ in SyncChange.KIND_CHOICES]
+
+
+def _config():
+    return {'PAGE_SIZE': 500, 'MAX_PAGE_SIZE': 2000, 'SETTLE_SECONDS': 5, **getattr(settings, 'SYNC', {})}
+
+
+def record_changes(kind, ids, deleted=False):
+    """Log writes that bypassed the model signals (bulk_create, update())."""
+    SyncChange.objects.bulk_create([SyncChange(kind=kind, object_id=pk, deleted=deleted) for pk in ids])
+
+
+def page_size(value):
+    config = _config()
+    return min(int(value), config['MAX_PAGE_SIZE']) if str(value).isdigit() and int(value) > 0 else config['PAGE_SIZE']
+
+
+def _load(kind, ids, exams, patients, context):
+    from .serializers import (
+        OptometristProfileSerializer, PatientSerializer, SyncExaminationSerializer, SyncMedicationSerializer,
+    )
+    if kind == 'patients':
+        return PatientSerializer(patients.filter(pk__in=ids), many=True).data
+    if kind == 'examinations':
+        return SyncExaminationSerializer(exams.filter(pk__in=ids), many=True).data
+    if kind == 'medications':
+        medications = Medication.objects.filter(pk__in=ids, examination__in=exams.values('pk'))
+        return SyncMedicationSerializer(medications, many=True).data
+    directory = Optometrist.objects.filter(pk__in=ids, is_active=True).prefetch_related('groups', 'user_permissions')
+    return OptometristProfileSerializer(directory, many=True, context=context).data
+
+
+def changes_since(cursor, limit, exams, patients, context=None):
+    """
+    One page of changes after ``cursor``: ``{'cursor', 'has_more', 'changes': {kind: [row, ...]},
+    'deleted': {kind: [id, ...]}}``. ``exams`` and ``patients`` are the examinations and
+    patients the user may see; medications follow their exam.
+    """
+    changes = SyncChange.objects.filter(seq__gt=cursor)
+    if connections[changes.db].vendor != 'sqlite':
+        changes = changes.filter(changed_at__lte=timezone.now() - timedelta(seconds=_config()['SETTLE_SECONDS']))
+    entries = list(changes.order_by('seq').values_list('seq', 'kind', 'object_id', 'deleted')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # The newest change per object wins
+    latest = {kind: {} for kind in KINDS}
+    for _, kind, object_id, deleted in entries:
+        latest[kind][object_id] = deleted
+
+    page = {
+        'cursor': entries[-1][0] if entries else cursor, 'has_more': has_more,
+        'changes': dict.fromkeys(KINDS), 'deleted': dict.fromkeys(KINDS),
+    }
+    # Examinations first, so their patients can be sent with them
+    for kind in sorted(KINDS, key=lambda kind: kind != 'examinations'):
+        upserted = {pk for pk, deleted in latest[kind].items() if not deleted}
+        if kind == 'patients':
+            upserted |= {row['patient'] for row in page['changes']['examinations']}
+        rows = _load(kind, upserted, exams, patients, context) if upserted else []
+        present = {row['id'] for row in rows}
+        page['changes'][kind] = rows
+        # Deleted, deleted later in the log, or not visible to this user
+        page['deleted'][kind] = sorted(pk for pk in latest[kind] if pk not in present)
+    return page
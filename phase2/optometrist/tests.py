@@ -1,3 +1,1074 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import zipfile
+from decimal import Decimal
+from unittest.mock import Mock, patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from doctors.views import DoctorListView
+from phase2.db_routing import PIN_COOKIE, recent_write_key
+from phase2.profiling import RequestProfilingMiddleware
+from phase2.sqlite import apply_sqlite_profile, retry_on_database_locked
+from . import analytics, clinical, exports, formulary, history, reports
+from .assignment import LeastOutstandingStrategy
+from .authentication import ClaimsJWTAuthentication, OptometristRefreshToken, check_user_cache, user_cache_key
+from .management.commands.bench_endpoints import percentile
+from .models import (
+    ConsultantLoad, EyeExamination, ExamRollup, FormularyEntry, IdempotencyKey, Medication, Optometrist, Patient,
+)
+from .projection import stream_json
+from .serializers import OPTOMETRIST_PROFILE_PROJECTION, MedicationSerializer, OptometristProfileSerializer
+from .thumbnails import refresh_variants, variant_specs, variant_urls
+from .views import OptometristListView
+
+
+def bearer(user):
+    return {'HTTP_AUTHORIZATION': f'Bearer {OptometristRefreshToken.for_user(user).access_token}'}
+
+
+class ReplicaRoutingTests(TestCase):
+    """default and replica_1 are separate SQLite files that are not replicated in tests."""
+    databases = {'default', 'replica_1'}
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = Optometrist.objects.create_user('7100000001', 'Dr Replica', 'pw', role='doctor')
+        self.optometrist = Optometrist.objects.create_user('7100000002', 'Opto Replica', 'pw')
+        self.patient = Patient.objects.create(name='Asha Rao', age=40, gender='female')
+        # Replication stand-in: copy the shared rows to the replica once
+        for obj in (self.doctor, self.optometrist, self.patient):
+            obj.save(using='replica_1', force_insert=True)
+
+    def worklist_ids(self):
+        response = self.client.get('/doctor/api/referrals/', **bearer(self.doctor))
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def create_exam(self, user, **data):
+        return self.client.post(
+            '/api/exams/create/',
+            {'patient_id': self.patient.pk, 'consultant_id': self.doctor.pk, 'chief_complaints': 'Blur', **data},
+            content_type='application/json', **bearer(user),
+        )
+
+    def test_replica_view_reads_from_replica(self):
+        exam = EyeExamination(patient=self.patient, optometrist=self.optometrist, consultant=self.doctor)
+        exam.save(using='replica_1')
+        self.assertFalse(EyeExamination.objects.using('default').exists())
+        self.assertEqual(self.worklist_ids(), [exam.pk])
+
+    def test_directory_miss_builds_from_default(self):
+        self.client.get('/api/list/')
+        # The replica still has the old name when the rename bumps the directory version
+        self.optometrist.name = 'Opto Renamed'
+        self.optometrist.save()
+        listing = self.client.get('/api/list/')
+        self.assertIn(b'Opto Renamed', b''.join(listing.streaming_content))
+        self.assertContains(self.client.get(f'/api/{self.optometrist.pk}/'), 'Opto Renamed')
+        # Hits are served from the entries built above
+        self.assertContains(self.client.get('/api/list/'), 'Opto Renamed')
+
+    def test_writes_go_to_default(self):
+        response = self.create_exam(self.optometrist)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(EyeExamination.objects.using('default').filter(pk=response.json()['id']).exists())
+        self.assertFalse(EyeExamination.objects.using('replica_1').exists())
+
+    def test_writer_reads_from_default_after_exam_post(self):
+        response = self.create_exam(self.doctor)
+        self.assertEqual(response.status_code, 201)
+        # The replica has not caught up, but the writer is pinned to default
+        self.assertEqual(self.worklist_ids(), [response.json()['id']])
+
+        cache.delete(recent_write_key(self.doctor.pk))
+        del self.client.cookies[PIN_COOKIE]
+        self.assertEqual(self.worklist_ids(), [])
+
+    def test_pin_cookie_holds_on_another_worker(self):
+        response = self.create_exam(self.doctor)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.cookies[PIN_COOKIE]['httponly'])
+        # Another worker process: its own cache has no pin, only the cookie carries it
+        cache.clear()
+        self.assertEqual(self.worklist_ids(), [response.json()['id']])
+
+    def test_pin_cookie_is_per_user(self):
+        self.assertEqual(self.create_exam(self.optometrist).status_code, 201)
+        cache.clear()
+        # Same browser, other user: the optometrist's pin does not apply to the doctor
+        self.assertEqual(self.worklist_ids(), [])
+
+    def test_failed_post_does_not_pin(self):
+        response = self.create_exam(self.doctor, patient_id=None)
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(cache.get(recent_write_key(self.doctor.pk)))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+class AssignmentClaimTests(TestCase):
+
+    def setUp(self):
+        self.busy = Optometrist.objects.create_user('7100000011', 'Dr Busy', 'pw', role='doctor')
+        self.free = Optometrist.objects.create_user('7100000012', 'Dr Free', 'pw', role='doctor')
+        ConsultantLoad.objects.filter(pk=self.busy.pk).update(open_referrals=3)
+        ConsultantLoad.objects.filter(pk=self.free.pk).update(open_referrals=1)
+
+    def test_least_outstanding_claims_doctor(self):
+        self.assertEqual(LeastOutstandingStrategy().assign(), self.free)
+        self.assertIsNotNone(ConsultantLoad.objects.get(pk=self.free.pk).last_assigned_at)
+
+    def test_conflicting_claim_repicks_from_fresh_rows(self):
+        free = self.free
+
+        class RacedStrategy(LeastOutstandingStrategy):
+            raced = False
+
+            def candidates(self, specialization=None):
+                loads = list(super().candidates(specialization))
+                if not self.raced:
+                    # Another submission assigns two referrals to the least loaded doctor right after our read
+                    self.raced = True
+                    ConsultantLoad.objects.adjust(free.pk, 2, assigned=True)
+                return loads
+
+        self.assertEqual(RacedStrategy().assign(), self.busy)
+
+
+class ExamReportCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.optometrist = Optometrist.objects.create_user('7100000021', 'Opto Report', 'pw')
+        self.patient = Patient.objects.create(name='Meena Iyer', age=61, gender='female', phone_number='9800000001')
+        self.exam = EyeExamination.objects.create(patient=self.patient, optometrist=self.optometrist)
+        self.url = f'/api/exams/{self.exam.pk}/report.html'
+
+    def test_patient_edit_changes_report(self):
+        first = self.client.get(self.url, **bearer(self.optometrist))
+        self.assertContains(first, 'Meena Iyer')
+        self.patient.name = 'Meena Subramanian'
+        self.patient.save()
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'], **bearer(self.optometrist))
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertContains(second, 'Meena Subramanian')
+
+    def test_staff_rename_changes_report(self):
+        first = self.client.get(self.url, **bearer(self.optometrist))
+        self.optometrist.name = 'Opto Renamed'
+        self.optometrist.save()
+        second = self.client.get(self.url, **bearer(self.optometrist))
+        self.assertContains(second, 'Opto Renamed')
+        self.assertNotEqual(second['ETag'], first['ETag'])
+
+
+    def test_batch_renders_only_misses(self):
+        other = Optometrist.objects.create_user('7100000022', 'Opto Other', 'pw')
+        second = EyeExamination.objects.create(patient=self.patient, optometrist=self.optometrist)
+        hidden = EyeExamination.objects.create(patient=self.patient, optometrist=other)
+        self.client.get(self.url, **bearer(self.optometrist))  # caches the first report
+
+        def post():
+            return self.client.post(
+                '/api/exams/reports/batch/', {'ids': [second.pk, self.exam.pk, hidden.pk], 'format': 'html'},
+                content_type='application/json', **bearer(self.optometrist),
+            )
+        with patch.dict(reports.RENDERERS, html=Mock(wraps=reports.render_html)) as renderers:
+            response = post()
+            self.assertEqual(renderers['html'].call_count, 1)
+            with zipfile.ZipFile(io.BytesIO(response.content)) as bundle:
+                self.assertEqual(bundle.namelist(), [f'exam-{second.pk}.html', f'exam-{self.exam.pk}.html'])
+                self.assertIn(b'Meena Iyer', bundle.read(f'exam-{second.pk}.html'))
+            post()
+            self.assertEqual(renderers['html'].call_count, 1)
+
+
+class ExamExportTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.optometrist = Optometrist.objects.create_user('7100000141', 'Opto Export', 'pw')
+        other = Optometrist.objects.create_user('7100000142', 'Opto Elsewhere', 'pw')
+        patient = Patient.objects.create(name='Farah Sheikh', age=38, gender='female')
+        self.exams = [
+            EyeExamination.objects.create(patient=patient, optometrist=self.optometrist, chief_complaints=f'Visit {number}')
+            for number in range(5)
+        ]
+        EyeExamination.objects.create(patient=patient, optometrist=other, chief_complaints='Not mine')
+        Medication.objects.create(examination=self.exams[0], name='Tears', eye='Both eyes', frequency='QID')
+        EyeExamination.objects.filter(pk=self.exams[4].pk).update(date_of_visit=datetime.date(2024, 1, 15))
+
+    def export(self, fmt, **params):
+        response = self.client.get(f'/api/exams/export.{fmt}', params, **bearer(self.optometrist))
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_lists_visible_exams_with_medications(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('csv').decode())))
+        self.assertEqual([int(row['exam_id']) for row in rows], [exam.pk for exam in self.exams])
+        self.assertEqual(rows[0]['medications'], 'Tears | Both eyes | QID |  | ')
+        self.assertEqual(rows[1]['consultant_id'], '')
+
+    def test_filters_and_gzip(self):
+        body = self.export('ndjson', start='2024-01-01', end='2024-01-31')
+        self.assertEqual([json.loads(line)['exam_id'] for line in body.splitlines()], [self.exams[4].pk])
+        self.assertEqual(gzip.decompress(self.export('ndjson', gzip='1')), self.export('ndjson'))
+        response = self.client.get('/api/exams/export.csv', {'start': '15/01/2024'}, **bearer(self.optometrist))
+        self.assertEqual(response.status_code, 400)
+
+    def test_rows_are_read_in_keyset_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            chunks = list(exports.stream_ndjson(EyeExamination.objects.filter(optometrist=self.optometrist), batch_size=2))
+        self.assertEqual([chunk.count('\n') for chunk in chunks], [2, 2, 1])
+        # One exam query and one medication query per batch, none with OFFSET
+        self.assertEqual(len(queries), 6)
+        self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+
+
+class ImportExamsTests(TestCase):
+
+    def setUp(self):
+        self.optometrist = Optometrist.objects.create_user('7100000031', 'Opto Import', 'pw')
+
+    def import_rows(self, rows):
+        columns = ['patient_name', 'patient_age', 'patient_gender', 'patient_phone', 'optometrist_id',
+                   'consultant_id', 'status', 'created_at', 'chief_complaints']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'legacy.csv')
+            with open(path, 'w', newline='') as handle:
+                writer = csv.DictWriter(handle, columns)
+                writer.writeheader()
+                writer.writerows(rows)
+            call_command('import_exams', path, stdout=io.StringIO())
+
+    def row(self, **values):
+        return {'patient_name': 'Lakshmi Menon', 'patient_age': '58', 'patient_gender': 'F',
+                'patient_phone': '9811111111', 'optometrist_id': self.optometrist.pk,
+                'chief_complaints': 'Glare', **values}
+
+    def test_naive_created_at_is_in_local_time(self):
+        self.import_rows([self.row(created_at='2023-05-01 10:00')])
+        exam = EyeExamination.objects.get()
+        self.assertEqual(timezone.localtime(exam.created_at).replace(tzinfo=None).isoformat(), '2023-05-01T10:00:00')
+        self.assertEqual(exam.date_of_visit.isoformat(), '2023-05-01')
+
+    def test_rejected_exam_creates_no_patient(self):
+        self.import_rows([
+            self.row(optometrist_id='999999'),
+            self.row(patient_name='Joseph Thomas', patient_phone='9822222222', created_at='2023-02-30 10:00'),
+        ])
+        self.assertFalse(EyeExamination.objects.exists())
+        self.assertFalse(Patient.objects.exists())
+
+    def test_legacy_referrals_are_closed_history(self):
+        doctor = Optometrist.objects.create_user('7100000032', 'Dr Import', 'pw', role='doctor')
+        ConsultantLoad.objects.filter(pk=doctor.pk).update(open_referrals=2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.import_rows([self.row(consultant_id=doctor.pk), self.row(consultant_id=doctor.pk, status='Accepted')])
+        self.assertEqual(sorted(EyeExamination.objects.values_list('status', flat=True)), ['accepted', 'closed'])
+        self.assertEqual(ConsultantLoad.objects.get(pk=doctor.pk).open_referrals, 2)
+        self.assertEqual(callbacks, [])
+
+    def test_pending_status_is_kept_and_counted(self):
+        doctor = Optometrist.objects.create_user('7100000033', 'Dr Pending', 'pw', role='doctor')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.import_rows([self.row(consultant_id=doctor.pk, status='pending'), self.row(status='reviewed')])
+        self.assertEqual(EyeExamination.objects.get().status, 'pending')
+        self.assertEqual(ConsultantLoad.objects.get(pk=doctor.pk).open_referrals, 1)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_rows_share_a_patient(self):
+        self.import_rows([self.row(), self.row(chief_complaints='Itching')])
+        self.assertEqual(Patient.objects.count(), 1)
+        self.assertEqual(EyeExamination.objects.count(), 2)
+
+
+class AdminQueryTests(TestCase):
+    """Query counts of every optometrist ModelAdmin; they must not grow with the rows on the page."""
+
+    def setUp(self):
+        self.admin = Optometrist.objects.create_superuser('7100000041', 'Admin Queries', 'pw')
+        self.client.force_login(self.admin)
+        optometrist = Optometrist.objects.create_user('7100000042', 'Opto Queries', 'pw')
+        doctor = Optometrist.objects.create_user('7100000043', 'Dr Queries', 'pw', role='doctor')
+        Optometrist.objects.bulk_create(
+            Optometrist(phone_number=f'71000001{number:02d}', name=f'Staff {number}', password='!') for number in range(12)
+        )
+        for number in range(12):
+            patient = Patient.objects.create(name=f'Patient {number}', age=30 + number, gender='male')
+            exam = EyeExamination.objects.create(patient=patient, optometrist=optometrist, consultant=doctor)
+            entry = FormularyEntry.objects.create(drug=f'Drug {number}', strength='0.5%')
+            Medication.objects.create(examination=exam, formulary=entry, name=entry.label)
+        self.exam, self.patient, self.entry = exam, patient, entry
+
+    def assert_changelist_queries(self, model, queries):
+        url = reverse(f'admin:optometrist_{model._meta.model_name}_changelist')
+        for per_page in (3, 10):
+            with patch.object(admin.site._registry[model], 'list_per_page', per_page):
+                with self.assertNumQueries(queries):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                with self.assertNumQueries(queries):
+                    self.assertEqual(self.client.get(url, {'p': 2}).status_code, 200)
+
+    def assert_form_queries(self, model, obj, change_queries, add_queries):
+        with self.assertNumQueries(change_queries):
+            url = reverse(f'admin:optometrist_{model._meta.model_name}_change', args=[obj.pk])
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(add_queries):
+            self.assertEqual(self.client.get(reverse(f'admin:optometrist_{model._meta.model_name}_add')).status_code, 200)
+
+    def test_exam_admin(self):
+        self.assert_changelist_queries(EyeExamination, 6)
+        self.assert_form_queries(EyeExamination, self.exam, 10, 2)
+
+    def test_patient_admin(self):
+        self.assert_changelist_queries(Patient, 6)
+        self.assert_form_queries(Patient, self.patient, 4, 2)
+
+    def test_optometrist_admin(self):
+        self.assert_changelist_queries(Optometrist, 7)
+        self.assert_form_queries(Optometrist, self.admin, 8, 4)
+
+    def test_formulary_admin(self):
+        self.assert_changelist_queries(FormularyEntry, 6)
+        self.assert_form_queries(FormularyEntry, self.entry, 4, 2)
+
+    def test_next_page_seeks_past_last_row(self):
+        url = reverse('admin:optometrist_patient_changelist')
+        newest_first = list(Patient.objects.order_by('-pk').values_list('pk', flat=True))
+        with patch.object(admin.site._registry[Patient], 'list_per_page', 5):
+            first = self.client.get(url)
+            self.assertEqual([row.pk for row in first.context['cl'].result_list], newest_first[:5])
+            self.assertContains(first, f'?after={newest_first[4]}&amp;p=2')
+            with CaptureQueriesContext(connection) as queries:
+                second = self.client.get(url, {'p': 2, 'after': newest_first[4]})
+            self.assertEqual([row.pk for row in second.context['cl'].result_list], newest_first[5:10])
+            self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+            # Links to other pages do not carry the cursor
+            self.assertContains(second, '?p=1"')
+            self.assertContains(second, f'?after={newest_first[9]}&amp;p=3')
+
+    @override_settings(ADMIN_COUNT_LIMIT=4)
+    def test_pages_past_count_limit(self):
+        url = reverse('admin:optometrist_patient_changelist')
+        newest_first = list(Patient.objects.order_by('-pk').values_list('pk', flat=True))
+        seen, params = [], {'gender': 'male'}
+        with patch.object(admin.site._registry[Patient], 'list_per_page', 3):
+            for number in range(1, 5):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'More than 4 patients')
+                rows = [row.pk for row in response.context['cl'].result_list]
+                seen += rows
+                if number < 4:
+                    next_link = f'?after={rows[-1]}&amp;gender=male&amp;p={number + 1}'
+                    self.assertContains(response, next_link)
+                    params = {'gender': 'male', 'after': rows[-1], 'p': number + 1}
+                else:
+                    self.assertNotContains(response, 'p=5')
+            self.assertEqual(seen, newest_first)
+            # Without the cursor, pages past the limit are read by OFFSET
+            self.assertEqual(
+                [row.pk for row in self.client.get(url, {'gender': 'male', 'p': 3}).context['cl'].result_list],
+                newest_first[6:9],
+            )
+            self.assertRedirects(self.client.get(url, {'gender': 'male', 'p': 5}), f'{url}?e=1', fetch_redirect_response=False)
+
+
+class PatientHistoryCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        optometrist = Optometrist.objects.create_user('7100000051', 'Opto History', 'pw')
+        self.patient = Patient.objects.create(name='Suresh Pillai', age=66, gender='male')
+        self.exam = EyeExamination.objects.create(patient=self.patient, optometrist=optometrist, iop_re='18 mmHg')
+        self.medication = Medication.objects.create(examination=self.exam, name='Timolol 0.5%', frequency='BD')
+
+    def test_cached_history_costs_one_query(self):
+        first = history.get_history(self.patient.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(history.get_history(self.patient.pk), first)
+
+    def test_change_without_signals_is_seen(self):
+        history.get_history(self.patient.pk)
+        # As a write from another process would look to this one's cache: no signal, no invalidation
+        Medication.objects.filter(pk=self.medication.pk).update(frequency='OD', updated_at=timezone.now())
+        self.assertEqual(history.get_history(self.patient.pk)['exams'][0]['medications'][0]['frequency'], 'OD')
+
+    def test_deleted_medication_is_seen(self):
+        history.get_history(self.patient.pk)
+        Medication.objects.filter(pk=self.medication.pk).delete()
+        self.assertEqual(history.get_history(self.patient.pk)['exams'][0]['medications'], [])
+
+    def test_unknown_patient(self):
+        self.assertIsNone(history.get_history(self.patient.pk + 1))
+
+    def test_backfill_is_seen(self):
+        # A row saved before the parser existed
+        EyeExamination.objects.filter(pk=self.exam.pk).update(iop_re_mmhg=None, clinical_values_version=0)
+        self.assertEqual(history.get_history(self.patient.pk)['series']['re']['iop']['values'], [None])
+        fingerprint = reports.report_fingerprints(EyeExamination.objects.filter(pk=self.exam.pk))
+        call_command('backfill_clinical_values', stdout=io.StringIO())
+        self.assertEqual(history.get_history(self.patient.pk)['series']['re']['iop']['values'], [18.0])
+        self.assertNotEqual(reports.report_fingerprints(EyeExamination.objects.filter(pk=self.exam.pk)), fingerprint)
+
+
+class ClaimsAuthenticationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = Optometrist.objects.create_user('7100000111', 'Opto Claims', 'pw', role='doctor')
+
+    def authenticate(self, token=None):
+        token = token or OptometristRefreshToken.for_user(self.user).access_token
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        user, _ = ClaimsJWTAuthentication().authenticate(request)
+        return user
+
+    def test_user_is_built_from_claims_and_cached_state(self):
+        with self.assertNumQueries(1):
+            user = self.authenticate()
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual((user.pk, user.name, user.role, user.is_active), (self.user.pk, 'Opto Claims', 'doctor', True))
+        with self.assertNumQueries(1):
+            self.assertEqual(user.phone_number, '7100000111')
+
+    def test_token_without_claims_loads_the_row(self):
+        user = self.authenticate(RefreshToken.for_user(self.user).access_token)
+        self.assertEqual(user, self.user)
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+    def test_deactivation_is_seen_on_the_next_request(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_queryset_update_is_seen_on_the_next_request(self):
+        self.authenticate()
+        Optometrist.objects.filter(pk=self.user.pk).update(role='optometrist')
+        self.assertEqual(self.authenticate().role, 'optometrist')
+        Optometrist.objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    @override_settings(JWT_USER_CACHE_TIMEOUT=0)
+    def test_state_is_not_cached_without_a_timeout(self):
+        self.authenticate()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        # As a deactivation saved by another worker looks to this one
+        with patch('optometrist.signals.forget_cached_user'):
+            self.user.is_active = False
+            self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_per_process_cache_check(self):
+        self.assertEqual([message.id for message in check_user_cache(None)], ['optometrist.W001'])
+        with override_settings(JWT_USER_CACHE_TIMEOUT=0):
+            self.assertEqual(check_user_cache(None), [])
+        redis = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379'}
+        with override_settings(CACHES={'default': redis}):
+            self.assertEqual(check_user_cache(None), [])
+
+
+class ClinicalParserTests(SimpleTestCase):
+
+    def test_diopters(self):
+        self.assertEqual(clinical.parse_diopters('-1.25'), Decimal('-1.25'))
+        self.assertEqual(clinical.parse_diopters(' +2.00 DS'), Decimal('2.00'))
+        self.assertEqual(clinical.parse_diopters('plano'), Decimal('0.00'))
+        self.assertEqual(clinical.parse_diopters('-0.5'), Decimal('-0.50'))
+        self.assertIsNone(clinical.parse_diopters(''))
+        self.assertIsNone(clinical.parse_diopters('see notes'))
+        self.assertIsNone(clinical.parse_diopters('-55'))
+
+    def test_axis(self):
+        self.assertEqual(clinical.parse_axis('x180'), 180)
+        self.assertEqual(clinical.parse_axis('45°'), 45)
+        self.assertIsNone(clinical.parse_axis('190'))
+        self.assertIsNone(clinical.parse_axis(None))
+
+    def test_logmar(self):
+        self.assertEqual(clinical.parse_logmar('6/6'), Decimal('0.00'))
+        self.assertEqual(clinical.parse_logmar('6/60'), Decimal('1.00'))
+        self.assertEqual(clinical.parse_logmar('20/40'), Decimal('0.30'))
+        self.assertEqual(clinical.parse_logmar('6/9P'), Decimal('0.18'))
+        self.assertEqual(clinical.parse_logmar('1.0'), Decimal('0.00'))
+        self.assertEqual(clinical.parse_logmar('N5'), Decimal('0.00'))
+        self.assertEqual(clinical.parse_logmar('hm'), Decimal('2.30'))
+        self.assertEqual(clinical.parse_logmar('CF 1m'), Decimal('2.00'))
+        self.assertIsNone(clinical.parse_logmar('6/0'))
+        self.assertIsNone(clinical.parse_logmar('blurred'))
+
+    def test_measurements(self):
+        self.assertEqual(clinical.parse_iop('18 mmHg'), Decimal('18.0'))
+        self.assertEqual(clinical.parse_seconds('10 sec'), Decimal('10.0'))
+        self.assertEqual(clinical.parse_millimetres('15mm'), Decimal('15.0'))
+        self.assertIsNone(clinical.parse_iop('120'))
+        self.assertIsNone(clinical.parse_seconds('-3'))
+
+    def test_save_fills_numeric_columns(self):
+        exam = EyeExamination(dv_sph_re='-2.25', dv_cyl_re='-0.75', dv_axis_re='x90', iop_le='21')
+        exam.populate_clinical_values()
+        self.assertEqual(
+            (exam.dv_sph_re_dpt, exam.dv_cyl_re_dpt, exam.dv_axis_re_deg, exam.iop_le_mmhg, exam.dv_sph_le_dpt),
+            (Decimal('-2.25'), Decimal('-0.75'), 90, Decimal('21.0'), None),
+        )
+        self.assertEqual(exam.clinical_values_version, clinical.CLINICAL_VALUES_VERSION)
+
+
+class FormularyIndexTests(TestCase):
+    """Writes through queryset methods send no signals, as writes made by another process look to this one."""
+
+    def setUp(self):
+        formulary._index = None
+        self.entry = FormularyEntry.objects.create(drug='Latanoprost', strength='0.005%', default_frequency='HS')
+
+    def test_new_entry_is_accepted_at_once(self):
+        formulary.get_index()
+        entry, = FormularyEntry.objects.bulk_create([FormularyEntry(drug='Brimonidine', strength='0.2%')])
+        serializer = MedicationSerializer(data={'formulary': entry.pk, 'frequency': 'BD', 'duration': '3 months'})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data['name'], 'Brimonidine 0.2%')
+
+    @override_settings(FORMULARY={'CHECK_SECONDS': 0})
+    def test_retired_entry_drops_out(self):
+        self.assertEqual([row['id'] for row in formulary.autocomplete('lata')], [self.entry.pk])
+        FormularyEntry.objects.filter(pk=self.entry.pk).update(is_active=False, updated_at=timezone.now())
+        self.assertEqual(formulary.autocomplete('lata'), [])
+        self.assertIsNone(formulary.get_entry(self.entry.pk))
+
+    @override_settings(FORMULARY={'CHECK_SECONDS': 0})
+    def test_new_prescriptions_reorder(self):
+        other = FormularyEntry.objects.create(drug='Lataprost', strength='0.005%')
+        self.assertEqual([row['id'] for row in formulary.autocomplete('lata')], [self.entry.pk, other.pk])
+        optometrist = Optometrist.objects.create_user('7100000056', 'Opto Formulary', 'pw')
+        exam = EyeExamination.objects.create(
+            patient=Patient.objects.create(name='Meena Iyer', age=58, gender='female'), optometrist=optometrist,
+        )
+        Medication.objects.bulk_create([Medication(examination=exam, formulary=other, name=other.label)])
+        self.assertEqual([row['id'] for row in formulary.autocomplete('lata')], [other.pk, self.entry.pk])
+
+
+class SyncScopeTests(TestCase):
+
+    def setUp(self):
+        self.mine = Optometrist.objects.create_user('7100000061', 'Opto Mine', 'pw')
+        self.other = Optometrist.objects.create_user('7100000062', 'Opto Other', 'pw')
+        self.seen = Patient.objects.create(name='Kavya Nair', age=29, gender='female')
+        self.unseen = Patient.objects.create(name='Arjun Das', age=47, gender='male')
+        self.walk_in = Patient.objects.create(name='Nisha Patel', age=35, gender='female')
+        EyeExamination.objects.create(patient=self.seen, optometrist=self.mine)
+        EyeExamination.objects.create(patient=self.unseen, optometrist=self.other)
+
+    def sync(self, user, cursor=0):
+        response = self.client.get('/api/sync/', {'cursor': cursor}, **bearer(user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_patients_limited_to_visible_exams(self):
+        page = self.sync(self.mine)
+        self.assertEqual([row['id'] for row in page['changes']['patients']], [self.seen.pk])
+        self.assertEqual(page['deleted']['patients'], sorted([self.unseen.pk, self.walk_in.pk]))
+
+    def test_staff_see_every_patient(self):
+        self.mine.is_staff = True
+        self.mine.save()
+        page = self.sync(self.mine)
+        self.assertEqual(
+            sorted(row['id'] for row in page['changes']['patients']),
+            sorted([self.seen.pk, self.unseen.pk, self.walk_in.pk]),
+        )
+
+    def test_new_exam_brings_its_patient(self):
+        cursor = self.sync(self.mine)['cursor']
+        EyeExamination.objects.create(patient=self.unseen, optometrist=self.mine)
+        page = self.sync(self.mine, cursor)
+        self.assertEqual([row['id'] for row in page['changes']['patients']], [self.unseen.pk])
+
+
+class ProjectedDirectoryTests(TestCase):
+    """The directory lists are streamed from OPTOMETRIST_PROFILE_PROJECTION; the bytes must match the serializer's."""
+
+    def setUp(self):
+        specs = list(variant_specs())
+        picture = 'optometrists/asha.jpg'
+        profiles = Optometrist.objects.bulk_create([
+            # No picture at all, and an empty one
+            Optometrist(phone_number='7100000071', name='Asha – Ünïcode ', password='!', profile_picture=None),
+            Optometrist(phone_number='7100000072', name='Dr Bose', role='doctor', password='!', profile_picture='',
+                        email='bose@example.com', bio='Line one\nline "two"', experience_years=12),
+            # Current variants, and a picture whose variants are stale
+            Optometrist(phone_number='7100000073', name='Opto Chandra', password='!', profile_picture=picture,
+                        profile_picture_variants={'source': picture, **{name: f'optometrists/variants/{name}.webp' for name in specs}}),
+            Optometrist(phone_number='7100000074', name='Dr Dutta', role='doctor', password='!',
+                        profile_picture='optometrists/dutta.jpg', profile_picture_variants={'source': 'optometrists/old.jpg'},
+                        license_number='KMC-1', website='https://example.com/'),
+            Optometrist(phone_number='7100000075', name='Dr Retired', role='doctor', password='!', is_active=False),
+        ])
+        groups = [Group.objects.create(name='Front desk'), Group.objects.create(name='Surgeons')]
+        profiles[1].groups.set(groups)
+        profiles[2].groups.set(groups[:1])
+        profiles[1].user_permissions.set(Permission.objects.order_by('-pk')[:3])
+        self.context = {'request': Request(RequestFactory().get('/api/list/'))}
+
+    def assert_identical(self, queryset):
+        expected = JSONRenderer().render(OptometristProfileSerializer(queryset, many=True, context=self.context).data)
+        projected = b''.join(stream_json(OPTOMETRIST_PROFILE_PROJECTION.rows(queryset, self.context)))
+        self.assertEqual(projected, expected)
+
+    def test_optometrist_list(self):
+        self.assertEqual(OptometristListView.queryset.all().count(), 4)
+        self.assert_identical(OptometristListView.queryset.all())
+
+    def test_doctor_list(self):
+        self.assertEqual(DoctorListView.queryset.all().count(), 2)
+        self.assert_identical(DoctorListView.queryset.all())
+
+    def test_empty_list(self):
+        self.assert_identical(Optometrist.objects.none())
+
+
+class BatchExamCreateTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.optometrist = Optometrist.objects.create_user('7100000081', 'Opto Batch', 'pw')
+        self.doctor = Optometrist.objects.create_user('7100000082', 'Dr Batch', 'pw', role='doctor')
+        self.patient = Patient.objects.create(name='Rekha Joshi', age=50, gender='female')
+
+    def item(self, number, **values):
+        return {
+            'name': f'Batch Patient {number}', 'age': 40, 'gender': 'male', 'chief_complaints': 'Blur',
+            'dv_sph_re': '-1.25', 'medications': [{'name': 'Tears', 'frequency': 'QID', 'duration': '1 month'}],
+            **values,
+        }
+
+    def post(self, items):
+        return self.client.post('/api/exams/batch/', items, content_type='application/json', **bearer(self.optometrist))
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        self.post([self.item(0)])  # caches the user's claims row
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.post([self.item(n) for n in range(2)]).status_code, 201)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.post([self.item(n) for n in range(10, 18)]).status_code, 201)
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(EyeExamination.objects.count(), 11)
+        self.assertEqual(Medication.objects.count(), 11)
+
+    def test_invalid_items_are_reported_by_index(self):
+        response = self.post([self.item(0), {'chief_complaints': 'No patient'}, self.item(2, patient_id=self.patient.pk)])
+        self.assertEqual(response.status_code, 207)
+        body = response.json()
+        self.assertEqual((body['created'], body['failed']), (2, 1))
+        self.assertEqual([result['status'] for result in body['results']], ['created', 'error', 'created'])
+        exam = EyeExamination.objects.get(pk=body['results'][2]['id'])
+        self.assertEqual((exam.patient, exam.optometrist), (self.patient, self.optometrist))
+        self.assertEqual(exam.dv_sph_re_dpt, Decimal('-1.25'))
+
+    def test_status_cannot_be_set_by_the_client(self):
+        response = self.post([self.item(0, status='closed', consultant_id=self.doctor.pk)])
+        self.assertEqual(response.status_code, 201)
+        exam = EyeExamination.objects.get(pk=response.json()['results'][0]['id'])
+        self.assertEqual(exam.status, 'pending')
+        self.assertEqual(ConsultantLoad.objects.get(pk=self.doctor.pk).open_referrals, 1)
+
+
+class IdempotencyTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.optometrist = Optometrist.objects.create_user('7100000151', 'Opto Retry', 'pw')
+        self.patient = Patient.objects.create(name='Lakshmi Menon', age=61, gender='female')
+
+    def post(self, key, **data):
+        return self.client.post(
+            '/api/exams/create/', {'patient_id': self.patient.pk, 'chief_complaints': 'Blur', **data},
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY=key, **bearer(self.optometrist),
+        )
+
+    def test_retry_replays_first_response(self):
+        first = self.post('visit-1')
+        self.assertEqual(first.status_code, 201)
+        second = self.post('visit-1')
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(EyeExamination.objects.count(), 1)
+        # Another key is another exam
+        self.assertEqual(self.post('visit-2').status_code, 201)
+        self.assertEqual(EyeExamination.objects.count(), 2)
+
+    def test_key_reused_for_different_request(self):
+        self.assertEqual(self.post('visit-1').status_code, 201)
+        response = self.post('visit-1', chief_complaints='Itching')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(EyeExamination.objects.get().chief_complaints, 'Blur')
+
+    def test_rejected_request_does_not_use_the_key(self):
+        self.assertEqual(self.post('visit-1', patient_id=None).status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        response = self.post('visit-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+
+class ExamRollupTests(TestCase):
+
+    def setUp(self):
+        self.optometrist = Optometrist.objects.create_user('7100000091', 'Opto Rollup', 'pw')
+        self.patient = Patient.objects.create(name='Kavya Rao', age=34, gender='female')
+
+    def rollups(self):
+        return sorted(
+            ExamRollup.objects.exclude(exam_count=0)
+            .values_list('staff_id', 'staff_role', 'period', 'period_start', *analytics.ROLLUP_COUNTERS)
+        )
+
+    def assert_matches_rebuild(self):
+        incremental = self.rollups()
+        call_command('rebuild_exam_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_quarter_diopter_cylinder_keeps_se_sum_exact(self):
+        EyeExamination.objects.create(patient=self.patient, optometrist=self.optometrist, dv_sph_re='-1.00', dv_cyl_re='-0.25')
+        rollup = ExamRollup.objects.get(staff_id=self.optometrist.pk, period='day')
+        self.assertEqual(rollup.se_sum, Decimal('-1.125'))
+        self.assert_matches_rebuild()
+
+    def test_edits_move_counts_between_rows(self):
+        doctor = Optometrist.objects.create_user('7100000092', 'Dr Rollup', 'pw', role='doctor')
+        exam = EyeExamination.objects.create(
+            patient=self.patient, optometrist=self.optometrist, dv_sph_le='+1.00', performed_iop=True,
+        )
+        exam = EyeExamination.objects.get(pk=exam.pk)
+        exam.consultant = doctor
+        exam.dv_sph_le = '-7.00'
+        exam.save()
+        rollup = ExamRollup.objects.get(staff_id=self.optometrist.pk, period='month')
+        self.assertEqual((rollup.exam_count, rollup.referred_count, rollup.performed_iop_count), (1, 1, 1))
+        self.assertEqual((rollup.se_hyperopia_eyes, rollup.se_high_myopia_eyes), (0, 1))
+        self.assertEqual(ExamRollup.objects.get(staff_id=doctor.pk, period='day').exam_count, 1)
+        self.assert_matches_rebuild()
+        exam.delete()
+        self.assertEqual(self.rollups(), [])
+
+    def test_large_delta_takes_the_batched_path(self):
+        EyeExamination.objects.bulk_create(
+            EyeExamination(patient=self.patient, optometrist=self.optometrist, dv_sph_re=f'-{number}.25',
+                           dv_cyl_re='-0.25', clinical_values_version=0)
+            for number in range(24)
+        )
+        exams = list(EyeExamination.objects.order_by('pk'))
+        for number, exam in enumerate(exams):
+            exam.date_of_visit = datetime.date(2024, 1 + number % 3, 1 + number)
+            exam.populate_clinical_values()
+        EyeExamination.objects.bulk_update(exams, ['date_of_visit', *clinical.NUMERIC_TARGET_FIELDS])
+        ExamRollup.objects.all().delete()
+        with patch.object(analytics, '_apply_bulk_delta', wraps=analytics._apply_bulk_delta) as bulk:
+            analytics.record_created(exams)
+        bulk.assert_called_once()
+        self.assertEqual(ExamRollup.objects.filter(period='day').count(), 24)
+        self.assert_matches_rebuild()
+
+
+class PatientSearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.optometrist = Optometrist.objects.create_superuser('7100000101', 'Opto Search', 'pw')
+        self.anita = Patient.objects.create(name='  Anita   DESAI ', age=45, gender='female', phone_number='+91 98450-12345')
+        self.anil = Patient.objects.create(name='Anil Desai', age=52, gender='male', phone_number='98450 67890')
+        self.rahul = Patient.objects.create(name='Rahul Anand', age=29, gender='male', phone_number='99000 11111')
+
+    def search(self, query):
+        response = self.client.get('/api/patients/search/', {'q': query}, **bearer(self.optometrist))
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()]
+
+    def admin_search(self, query):
+        self.client.force_login(self.optometrist)
+        response = self.client.get(reverse('admin:optometrist_patient_changelist'), {'q': query})
+        return [patient.pk for patient in response.context['cl'].result_list]
+
+    def test_save_normalizes_search_keys(self):
+        self.assertEqual((self.anita.name_normalized, self.anita.phone_normalized), ('anita desai', '919845012345'))
+        self.anita.name = 'Anita  Rao'
+        self.anita.save(update_fields=['name'])
+        self.anita.refresh_from_db()
+        self.assertEqual(self.anita.name_normalized, 'anita rao')
+
+    def test_search_key(self):
+        self.assertEqual(Patient.search_key(' 98450-6'), ('phone_normalized', '984506'))
+        self.assertEqual(Patient.search_key('Ward 9'), ('name_normalized', 'ward 9'))
+        self.assertEqual(Patient.search_key('ANI'), ('name_normalized', 'ani'))
+
+    def test_view_matches_prefixes_only(self):
+        self.assertEqual(self.search('ANI'), [self.anil.pk, self.anita.pk])
+        self.assertEqual(self.search('anita  d'), [self.anita.pk])
+        self.assertEqual(self.search('98450'), [self.anil.pk])
+        self.assertEqual(self.search('9198450'), [self.anita.pk])
+        self.assertEqual(self.search('desai'), [])
+        self.assertEqual(self.search('a'), [])
+
+    def test_admin_uses_the_same_lookup(self):
+        self.assertEqual(self.admin_search('ani'), [self.anil.pk, self.anita.pk])
+        self.assertEqual(self.admin_search('99000-1'), [self.rahul.pk])
+        self.assertEqual(self.admin_search('anand'), [])
+
+    def test_postgresql_uses_startswith(self):
+        queryset = Patient.objects.all()
+        with patch.object(connection, 'vendor', 'postgresql'):
+            self.assertIn(' LIKE ', str(Patient.filter_prefix(queryset, 'name_normalized', 'ani').query))
+        self.assertNotIn(' LIKE ', str(Patient.filter_prefix(queryset, 'name_normalized', 'ani').query))
+
+
+class SQLiteProfileTests(SimpleTestCase):
+
+    def test_profile_merges_into_sqlite_entries_only(self):
+        databases = apply_sqlite_profile({
+            'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'a.sqlite3', 'OPTIONS': {'timeout': 5}},
+            'reports': {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'reports'},
+        }, 'high_concurrency')
+        self.assertEqual(databases['default']['OPTIONS']['timeout'], 5)
+        self.assertEqual(databases['default']['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertEqual(databases['default']['CONN_MAX_AGE'], 600)
+        self.assertNotIn('OPTIONS', databases['reports'])
+        self.assertEqual(apply_sqlite_profile({'default': {'ENGINE': 'django.db.backends.sqlite3'}}, 'default'),
+                         {'default': {'ENGINE': 'django.db.backends.sqlite3'}})
+
+    def test_high_concurrency_connection_uses_wal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Connected as 'edge', an alias SimpleTestCase does not block
+            handler = ConnectionHandler(apply_sqlite_profile({
+                'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, 'unused.sqlite3')},
+                'edge': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, 'wal.sqlite3')},
+            }, 'high_concurrency'))
+            try:
+                with handler['edge'].cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            finally:
+                handler.close_all()
+
+
+@patch('phase2.sqlite.time.sleep')
+class RetryOnDatabaseLockedTests(SimpleTestCase):
+
+    def flaky(self, *errors):
+        calls = []
+
+        @retry_on_database_locked(attempts=3)
+        def write():
+            calls.append(1)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return 'written'
+        return write, calls
+
+    def test_locked_writes_are_retried(self, sleep):
+        write, calls = self.flaky(OperationalError('database is locked'), OperationalError('database is locked'))
+        with patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(write(), 'written')
+        self.assertEqual((len(calls), sleep.call_count), (3, 2))
+
+    def test_gives_up_after_the_last_attempt(self, sleep):
+        write, calls = self.flaky(*[OperationalError('database is locked')] * 3)
+        with patch.object(connection, 'in_atomic_block', False), self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 3)
+
+    def test_other_errors_and_inner_transactions_are_not_retried(self, sleep):
+        write, calls = self.flaky(OperationalError('no such table: optometrist_patient'))
+        with patch.object(connection, 'in_atomic_block', False), self.assertRaises(OperationalError):
+            write()
+        write, calls = self.flaky(OperationalError('database is locked'))
+        with patch.object(connection, 'in_atomic_block', True), self.assertRaises(OperationalError):
+            write()
+        self.assertEqual((len(calls), sleep.call_count), (1, 0))
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class SeedAndBenchmarkTests(TestCase):
+
+    def seed(self, **options):
+        options = {'optometrists': 2, 'doctors': 2, 'patients': 6, 'exams': 14, 'batch_size': 5, **options}
+        call_command('seed_clinic', *[f'--{name.replace("_", "-")}={value}' for name, value in options.items()],
+                     stdout=io.StringIO())
+
+    def test_seed_clinic_keeps_derived_tables_consistent(self):
+        self.seed()
+        self.assertEqual(Optometrist.objects.filter(phone_number__startswith='70').count(), 5)
+        self.assertEqual((Patient.objects.count(), EyeExamination.objects.count()), (6, 14))
+        self.assertFalse(EyeExamination.objects.filter(clinical_values_version=0).exists())
+        self.assertEqual(
+            sum(ExamRollup.objects.filter(staff_role='optometrist', period='day').values_list('exam_count', flat=True)), 14,
+        )
+        for load in ConsultantLoad.objects.all():
+            open_referrals = EyeExamination.objects.filter(consultant=load.pk, status='pending').count()
+            self.assertEqual(load.open_referrals, open_referrals)
+        # A second run adds staff after the first run's phone numbers
+        self.seed(exams=1)
+        self.assertEqual(Optometrist.objects.filter(phone_number__startswith='70').count(), 9)
+
+    def test_bench_endpoints_saves_and_checks_a_baseline(self):
+        self.seed()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            bench = ['bench_endpoints', '--iterations=2', '--warmup=0', f'--baseline={path}',
+                     '--scenario=referral_list', '--scenario=optometrist_detail']
+            call_command(*bench, '--save-baseline', stdout=io.StringIO())
+            with open(path) as handle:
+                saved = json.load(handle)
+            self.assertEqual(set(saved['scenarios']), {'referral_list', 'optometrist_detail'})
+            self.assertEqual(saved['scenarios']['referral_list']['failures'], 0)
+
+            saved['scenarios']['referral_list']['queries'] = 0
+            with open(path, 'w') as handle:
+                json.dump(saved, handle)
+            with self.assertRaisesMessage(CommandError, 'referral_list:'):
+                call_command(*bench, stdout=io.StringIO())
+
+    def test_bench_endpoints_needs_seeded_data(self):
+        with self.assertRaisesMessage(CommandError, 'seed_clinic'):
+            call_command('bench_endpoints', '--iterations=1', stdout=io.StringIO())
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, pct) for pct in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertEqual(percentile([], 95), 0.0)
+
+
+class RequestProfilingTests(TestCase):
+
+    def setUp(self):
+        Optometrist.objects.create_user('7100000121', 'Opto Profiled', 'pw')
+
+    def profiled(self, get_response, **config):
+        config = {**settings.REQUEST_PROFILING, 'SLOW_REQUEST_MS': 60000, **config}
+        with override_settings(REQUEST_PROFILING=config):
+            return RequestProfilingMiddleware(get_response)(RequestFactory().get('/profiled/'))
+
+    def timings(self, response):
+        return dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_sampled_request_reports_queries_and_render_time(self):
+        url = reverse('detail_api', args=[Optometrist.objects.get().pk])
+        with override_settings(REQUEST_PROFILING={**settings.REQUEST_PROFILING, 'SAMPLE_RATE': 1}):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+        timings = self.timings(response)
+        self.assertEqual(list(timings), ['total', 'db', 'render', 'app'])
+        self.assertIn(f'desc="{len(queries)} queries"', timings['db'])
+
+    def test_unsampled_request_reports_total_only(self):
+        response = self.profiled(lambda request: HttpResponse('ok'), SAMPLE_RATE=0)
+        self.assertEqual(list(self.timings(response)), ['total'])
+        response = self.profiled(lambda request: HttpResponse('ok'), ENABLED=False)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_repeated_statement_is_logged(self):
+        def get_response(request):
+            for optometrist in Optometrist.objects.all()[:1]:
+                for _ in range(5):
+                    Optometrist.objects.filter(pk=optometrist.pk).exists()
+            return HttpResponse('ok')
+
+        with self.assertLogs('phase2.profiling', 'WARNING') as logs:
+            self.profiled(get_response, SAMPLE_RATE=1)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['event'], record['queries'], record['path']), ('duplicate_queries', 6, '/profiled/'))
+        self.assertEqual(record['duplicates'][0]['count'], 5)
+
+    def test_slow_request_is_logged_without_sampling(self):
+        with self.assertLogs('phase2.profiling', 'WARNING') as logs:
+            self.profiled(lambda request: HttpResponse('ok'), SAMPLE_RATE=0, SLOW_REQUEST_MS=0)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['event'], record['sampled']), ('slow_request', False))
+        self.assertNotIn('queries', record)
+
+
+class ProfilePictureVariantTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.optometrist = Optometrist.objects.create_user('7100000131', 'Opto Pictured', 'pw')
+
+    def upload(self, name='portrait.png'):
+        image = io.BytesIO()
+        Image.new('RGB', (640, 480), 'teal').save(image, format='PNG')
+        self.optometrist.profile_picture.save(name, ContentFile(image.getvalue()), save=False)
+        self.optometrist.save()
+
+    def test_upload_schedules_a_build_and_lookups_do_not(self):
+        with patch('optometrist.signals.schedule_variants') as schedule:
+            self.upload()
+        schedule.assert_called_once_with(self.optometrist.pk)
+        with patch('optometrist.thumbnails.schedule_variants') as schedule, self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.get(reverse('detail_api', args=[self.optometrist.pk]))
+        schedule.assert_not_called()
+        self.assertEqual(callbacks, [])
+        original = response.json()['profile_picture']
+        self.assertEqual(response.json()['profile_picture_variants'], {name: original for name in variant_specs()})
+
+    def test_build_writes_every_variant(self):
+        with patch('optometrist.signals.schedule_variants'):
+            self.upload()
+        self.assertTrue(refresh_variants(self.optometrist.pk))
+        self.optometrist.refresh_from_db()
+        variants = self.optometrist.profile_picture_variants
+        self.assertEqual(variants['source'], self.optometrist.profile_picture.name)
+        storage = self.optometrist.profile_picture.storage
+        with storage.open(variants['thumb']) as thumb:
+            self.assertEqual(Image.open(thumb).size, (96, 96))
+        with storage.open(variants['large']) as large:
+            self.assertEqual(Image.open(large).size, (640, 480))
+        urls = variant_urls(storage, self.optometrist.profile_picture.name, variants)
+        self.assertEqual(urls, {name: storage.url(variants[name]) for name in variant_specs()})
+        self.assertFalse(refresh_variants(self.optometrist.pk))
+
+    def test_command_builds_only_stale_pictures(self):
+        with patch('optometrist.signals.schedule_variants'):
+            self.upload()
+        out = io.StringIO()
+        call_command('build_profile_variants', stdout=out)
+        self.assertIn('Built 1, already current 0, failed 0.', out.getvalue())
+        out = io.StringIO()
+        call_command('build_profile_variants', stdout=out)
+        self.assertIn('Built 0, already current 1, failed 0.', out.getvalue())
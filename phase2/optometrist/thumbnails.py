@@ -0,0 +1,170 @@
+"""
+Resized variants of Optometrist.profile_picture.
+
+Variants are built with Pillow outside the request: post_save queues a job when
+the uploaded file changes, and the build_profile_variants command converts
+existing pictures. Serializing a profile only looks variants up. Each job
+records its output in ``profile_picture_variants`` with the source file name it
+was built from; a variant is only rebuilt when that name no longer matches.
+"""
+import atexit
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# name -> (width, height, crop). Cropped variants fill the box; the others fit inside it.
+DEFAULT_VARIANTS = {
+    'thumb': (96, 96, True),
+    'card': (320, 320, True),
+    'large': (800, 800, False),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+
+
+def variant_specs():
+    return getattr(settings, 'PROFILE_PICTURE_VARIANTS', DEFAULT_VARIANTS)
+
+
+def variants_match(picture_name, variants):
+    variants = variants or {}
+    return bool(picture_name) and variants.get('source') == picture_name and set(variant_specs()) <= set(variants)
+
+
+def variants_current(optometrist):
+    return variants_match(optometrist.profile_picture.name, optometrist.profile_picture_variants)
+
+
+def variant_urls(storage, picture_name, variants):
+    """
+    URL per variant name, or None without a picture. Until the background build has
+    caught up with the current picture, every variant points at the original upload.
+    """
+    if not picture_name:
+        return None
+    if variants_match(picture_name, variants):
+        return {name: storage.url(path) for name, path in variants.items() if name != 'source'}
+    url = storage.url(picture_name)
+    return {name: url for name in variant_specs()}
+
+
+def render_variant(image, width, height, crop):
+    if crop:
+        resized = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+    else:
+        resized = image.copy()
+        resized.thumbnail((width, height), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    resized.save(buffer, format='JPEG', quality=82, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def build_variants(optometrist):
+    """Write every variant of the current picture and return the new variants mapping."""
+    picture = optometrist.profile_picture
+    storage = picture.storage
+    digest = hashlib.sha1(picture.name.encode()).hexdigest()[:12]
+    with picture.open('rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+
+    variants = {'source': picture.name}
+    for name, (width, height, crop) in variant_specs().items():
+        path = f'optometrists/variants/{optometrist.pk}/{name}-{digest}.jpg'
+        if storage.exists(path):
+            storage.delete(path)
+        variants[name] = storage.save(path, ContentFile(render_variant(image, width, height, crop)))
+    return variants
+
+
+def remove_variants(storage, variants, keep=()):
+    for name, path in (variants or {}).items():
+        if name != 'source' and path not in keep and storage.exists(path):
+            storage.delete(path)
+
+
+def refresh_variants(optometrist_id):
+    """Rebuild the variants of one optometrist if the picture changed. Returns True if built."""
+    from .cache import bump_directory_version
+    from .sync import record_changes
+    from .models import Optometrist
+
+    optometrist = Optometrist.objects.filter(pk=optometrist_id).only(
+        'id', 'profile_picture', 'profile_picture_variants'
+    ).first()
+    if optometrist is None:
+        return False
+    picture = optometrist.profile_picture
+    storage = picture.storage
+    previous = optometrist.profile_picture_variants or {}
+    if not picture:
+        if previous:
+            remove_variants(storage, previous)
+            Optometrist.objects.filter(pk=optometrist_id, profile_picture__in=['', None]).update(
+                profile_picture_variants={}
+            )
+            bump_directory_version()
+            record_changes('directory', [optometrist_id])
+        return False
+    if variants_current(optometrist):
+        return False
+
+    variants = build_variants(optometrist)
+    # update() so a concurrent upload is not overwritten and updated_at/post_save stay untouched
+    updated = Optometrist.objects.filter(pk=optometrist_id, profile_picture=picture.name).update(
+        profile_picture_variants=variants
+    )
+    if updated:
+        remove_variants(storage, previous, keep=set(variants.values()))
+        bump_directory_version()
+        record_changes('directory', [optometrist_id])
+    else:
+        remove_variants(storage, variants)
+    return bool(updated)
+
+
+def _run(optometrist_id):
+    try:
+        refresh_variants(optometrist_id)
+    except Exception:
+        logger.exception("Building profile picture variants failed for optometrist %s", optometrist_id)
+    finally:
+        with _executor_lock:
+            _pending.discard(optometrist_id)
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'PROFILE_PICTURE_WORKERS', 2),
+            thread_name_prefix='profile-variants',
+        )
+        atexit.register(_executor.shutdown, wait=False)
+    return _executor
+
+
+def schedule_variants(optometrist_id):
+    """Queue a variant build once the current transaction commits; duplicate requests are dropped."""
+    def submit():
+        with _executor_lock:
+            if optometrist_id in _pending:
+                return
+            _pending.add(optometrist_id)
+            executor = _get_executor()
+        executor.submit(_run, optometrist_id)
+
+    transaction.on_commit(submit)
@@ -1,7 +1,10 @@
-from django.urls import path
+from django.urls import path, re_path
 from .views import (
     RegisterOptometrist, LoginOptometrist, OptometristListView, OptometristDetailView,
-    OptometristDashboardPageView, LandingPageView, EyeExaminationCreateAPIView, NewExaminationPageView
+    OptometristDashboardPageView, LandingPageView, EyeExaminationCreateAPIView, NewExaminationPageView,
+    EyeExaminationBatchCreateAPIView, PatientSearchView, ExamRollupListView, ExamReportView, ExamReportBatchView,
+    ExamExportView, PatientHistoryView, FormularyAutocompleteView,
+    SyncView
 )
 
 urlpatterns = [
@@ -11,6 +14,15 @@ urlpatterns = [
     path('api/list/', OptometristListView.as_view(), name='list_api'),
     path('api/<int:pk>/', OptometristDetailView.as_view(), name='detail_api'),
     path('api/exams/create/', EyeExaminationCreateAPIView.as_view(), name='create_exam_api'),
+    path('api/exams/batch/', EyeExaminationBatchCreateAPIView.as_view(), name='batch_create_exam_api'),
+    re_path(r'^api/exams/(?P<pk>\d+)/report\.(?P<fmt>html|pdf)$', ExamReportView.as_view(), name='exam_report'),
+    re_path(r'^api/exams/export\.(?P<fmt>csv|ndjson)$', ExamExportView.as_view(), name='exam_export'),
+    path('api/exams/reports/batch/', ExamReportBatchView.as_view(), name='exam_report_batch_api'),
+    path('api/patients/search/', PatientSearchView.as_view(), name='patient_search_api'),
+    path('api/patients/<int:pk>/history/', PatientHistoryView.as_view(), name='patient_history_api'),
+    path('api/formulary/', FormularyAutocompleteView.as_view(), name='formulary_autocomplete_api'),
+    path('api/sync/', SyncView.as_view(), name='sync_api'),
+    path('api/analytics/rollups/', ExamRollupListView.as_view(), name='exam_rollups_api'),
     
     # Template pages
     path('', LandingPageView.as_view(), name='landing_page'),
@@ -1,10 +1,12 @@
 from rest_framework import status, generics, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.hashers import check_password
 from .models import Optometrist
-from .serializers import OptometristSerializer, OptometristProfileSerializer
+from .authentication import OptometristRefreshToken
+from .serializers import OptometristSerializer, OptometristProfileSerializer, OPTOMETRIST_PROFILE_PROJECTION
+from .cache import DirectoryCacheMixin, active_doctor_choices
+from phase2.db_routing import ReplicaReadMixin
 from django.shortcuts import render
 from django.views.generic import TemplateView
 
@@ -46,7 +48,7 @@ class LoginOptometrist(APIView):
             # Log user into session for TemplateView support
             login(request, user)
                 
-            refresh = RefreshToken.for_user(user)
+            refresh = OptometristRefreshToken.for_user(user)
             return Response({
                 'refresh': str(refresh),
                 'access': str(refresh.access_token),
@@ -61,28 +63,159 @@ class LoginOptometrist(APIView):
         
         return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
 
-class OptometristListView(generics.ListAPIView):
+class OptometristListView(ReplicaReadMixin, DirectoryCacheMixin, generics.ListAPIView):
     queryset = Optometrist.objects.filter(is_active=True)
     serializer_class = OptometristProfileSerializer
     permission_classes = [permissions.AllowAny]
+    directory_cache_name = 'optometrists'
+    projection = OPTOMETRIST_PROFILE_PROJECTION
 
-class OptometristDetailView(generics.RetrieveAPIView):
+class OptometristDetailView(ReplicaReadMixin, DirectoryCacheMixin, generics.RetrieveAPIView):
     queryset = Optometrist.objects.filter(is_active=True)
     serializer_class = OptometristProfileSerializer
     permission_classes = [permissions.AllowAny]
+    directory_cache_name = 'optometrists'
 
 from .models import Patient, EyeExamination
-from .serializers import PatientSerializer, EyeExaminationSerializer
+from .serializers import PatientSerializer, PatientSearchResultSerializer, EyeExaminationSerializer, preload_related
+from .idempotency import idempotent
 
 class EyeExaminationCreateAPIView(generics.CreateAPIView):
     queryset = EyeExamination.objects.all()
     serializer_class = EyeExaminationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         # Assign the logged-in optometrist
         serializer.save(optometrist=self.request.user)
 
+class EyeExaminationBatchCreateAPIView(generics.GenericAPIView):
+    """
+    Accepts a JSON list of exams (same shape as EyeExaminationCreateAPIView) and
+    writes every valid one in a single transaction. Invalid items are reported by
+    index and do not block the rest of the batch.
+    """
+    queryset = EyeExamination.objects.all()
+    serializer_class = EyeExaminationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    max_batch_size = 500
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'error': 'Expected a list of examinations.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not items:
+            return Response({'error': 'The batch is empty.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.max_batch_size:
+            return Response(
+                {'error': f'A batch may contain at most {self.max_batch_size} examinations.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        context = self.get_serializer_context()
+        context['preloaded'] = preload_related(self.get_serializer(), items)
+
+        results = [None] * len(items)
+        valid_indexes, valid_data = [], []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer_class()(data=item, context=context)
+            if serializer.is_valid():
+                valid_indexes.append(index)
+                valid_data.append({**serializer.validated_data, 'optometrist': request.user})
+            else:
+                results[index] = {'index': index, 'status': 'error', 'errors': serializer.errors}
+
+        if valid_data:
+            exams = self.get_serializer_class()(many=True, context=context).create(valid_data)
+            for index, exam in zip(valid_indexes, exams):
+                results[index] = {'index': index, 'status': 'created', 'id': exam.id}
+
+        if not valid_data:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(valid_data) < len(items):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response({
+            'created': len(valid_data),
+            'failed': len(items) - len(valid_data),
+            'results': results,
+        }, status=response_status)
+
+class PatientSearchView(generics.ListAPIView):
+    """
+    Search-as-you-type lookup so staff can reuse ``patient_id`` instead of creating duplicates.
+
+    ``?q=`` is matched as a prefix of the normalized phone number when it is made of
+    digits, otherwise as a prefix of the normalized name. On SQLite's binary collation the
+    prefix is an index range scan (``key >= q AND key < q + U+10FFFF``). PostgreSQL compares
+    by the column's collation, which is not a prefix order unless it is C, so there it is a
+    ``LIKE 'q%'`` served by the varchar_pattern_ops index Django adds to indexed CharFields.
+    """
+    serializer_class = PatientSearchResultSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    min_query_length = 2
+    max_results = 20
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '')
+        key, term = Patient.search_key(query)
+        if len(term) < self.min_query_length:
+            return Patient.objects.none()
+        return (
+            Patient.filter_prefix(Patient.objects.all(), key, term)
+            .order_by(key, 'id')
+            .only('id', 'name', 'age', 'gender', 'phone_number')[:self.max_results]
+        )
+
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError as APIValidationError, PermissionDenied
+from .models import ExamRollup
+from .serializers import ExamRollupSerializer
+
+class ExamRollupListView(ReplicaReadMixin, generics.ListAPIView):
+    """
+    Precomputed exam statistics: ``?period=day|month&role=optometrist|consultant&staff=<id>&start=&end=``.
+
+    Reads only ExamRollup rows, so the cost depends on the date range, not on how many
+    exams exist. Staff users may query anyone; others only their own figures.
+    """
+    serializer_class = ExamRollupSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    max_rows = 1000
+
+    def get_queryset(self):
+        params = self.request.query_params
+        period = params.get('period', 'month')
+        if period not in dict(ExamRollup.PERIOD_CHOICES):
+            raise APIValidationError({'period': 'Must be "day" or "month".'})
+
+        user = self.request.user
+        staff_id = params.get('staff')
+        if staff_id is None:
+            staff_id = user.pk
+        elif str(staff_id) != str(user.pk) and not user.is_staff:
+            raise PermissionDenied('You may only view your own statistics.')
+
+        queryset = ExamRollup.objects.filter(period=period, staff_id=staff_id)
+        role = params.get('role', 'consultant' if user.role == 'doctor' and str(staff_id) == str(user.pk) else 'optometrist')
+        if role not in dict(ExamRollup.ROLE_CHOICES):
+            raise APIValidationError({'role': 'Must be "optometrist" or "consultant".'})
+        queryset = queryset.filter(staff_role=role)
+
+        for param, lookup in (('start', 'period_start__gte'), ('end', 'period_start__lte')):
+            if params.get(param):
+                value = parse_date(params[param])
+                if value is None:
+                    raise APIValidationError({param: 'Use YYYY-MM-DD.'})
+                queryset = queryset.filter(**{lookup: value})
+        return queryset.order_by('period_start')[:self.max_rows]
+
 class NewExaminationPageView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
     template_name = 'optometrist/new_examination.html'
     login_url = '/api/login/'
@@ -92,5 +225,199 @@ class NewExaminationPageView(LoginRequiredMixin, UserPassesTestMixin, TemplateVi
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['doctors'] = Optometrist.objects.filter(role='doctor', is_active=True)
+        context['doctors'] = active_doctor_choices()
         return context
+
+import io
+import zipfile
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from rest_framework.authentication import SessionAuthentication
+from .authentication import ClaimsJWTAuthentication
+from . import reports
+
+def visible_exams(user):
+    """Exams a user may print or export: ones they examined or were consulted on; staff see all."""
+    exams = EyeExamination.objects.all()
+    if not user.is_staff:
+        exams = exams.filter(Q(optometrist=user) | Q(consultant=user))
+    return exams
+
+def visible_patients(user):
+    """Patients with an exam in visible_exams(user); staff see all."""
+    patients = Patient.objects.all()
+    if not user.is_staff:
+        patients = patients.filter(pk__in=visible_exams(user).values('patient_id'))
+    return patients
+
+class ExamReportView(APIView):
+    """
+    Printable report for one exam at ``api/exams/<pk>/report.html`` or ``.pdf``.
+
+    The report's content address doubles as its ETag, so a reprint from the browser
+    cache costs one query and a reprint from the server cache costs one query plus a cache read.
+    """
+    # Session auth too, so the report can be opened straight from the dashboards
+    authentication_classes = [ClaimsJWTAuthentication, SessionAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk, fmt):
+        pk = int(pk)
+        fingerprint = reports.report_fingerprints(visible_exams(request.user).filter(pk=pk)).get(pk)
+        if fingerprint is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        etag = quote_etag(f'{fmt}-{fingerprint}')
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache = reports.report_cache()
+            key = reports.report_key(fmt, fingerprint)
+            body = cache.get(key)
+            if body is None:
+                body = reports.RENDERERS[fmt](reports.load_exams([pk]).get())
+                cache.set(key, body, timeout=reports.report_timeout())
+            response = HttpResponse(body, content_type=reports.CONTENT_TYPES[fmt])
+            if fmt == 'pdf':
+                response['Content-Disposition'] = f'inline; filename="exam-{pk}.pdf"'
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+class ExamReportBatchView(APIView):
+    """
+    End-of-day print runs: POST ``{"ids": [...], "format": "pdf"|"html"}`` and get a ZIP
+    with one report per exam. Cached reports are reused and only the rest are
+    rendered. Exams the user may not print are left out.
+    """
+    authentication_classes = [ClaimsJWTAuthentication, SessionAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    max_batch_size = 200
+
+    def post(self, request):
+        ids, fmt = request.data.get('ids'), request.data.get('format', 'pdf')
+        if fmt not in reports.RENDERERS:
+            return Response({'error': 'format must be "html" or "pdf".'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(ids, list) or not ids or not all(isinstance(pk, int) for pk in ids):
+            return Response({'error': 'ids must be a non-empty list of exam ids.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.max_batch_size:
+            return Response(
+                {'error': f'At most {self.max_batch_size} reports per batch.'}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rendered = reports.get_reports(visible_exams(request.user).filter(pk__in=ids), fmt)
+        if not rendered:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        archive = io.BytesIO()
+        # Reports are small and PDFs are already compressed internally; storing is enough
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as bundle:
+            for pk in dict.fromkeys(ids):
+                if pk in rendered:
+                    bundle.writestr(f'exam-{pk}.{fmt}', rendered[pk])
+        response = HttpResponse(archive.getvalue(), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="exam-reports-{fmt}.zip"'
+        return response
+
+from django.http import StreamingHttpResponse
+from . import exports
+
+class ExamExportView(APIView):
+    """
+    Stream examinations with patient, staff and medications as ``api/exams/export.csv``
+    or ``export.ndjson``. Filters: ``start``/``end`` (date_of_visit, YYYY-MM-DD),
+    ``optometrist``, ``consultant``; ``gzip=1`` compresses the stream on the fly.
+    Memory use does not grow with the size of the range (see optometrist.exports).
+    """
+    authentication_classes = [ClaimsJWTAuthentication, SessionAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, fmt):
+        params = request.query_params
+        filters = {}
+        for param in ('start', 'end'):
+            if params.get(param):
+                filters[param] = parse_date(params[param])
+                if filters[param] is None:
+                    raise APIValidationError({param: 'Use YYYY-MM-DD.'})
+        for param in ('optometrist', 'consultant'):
+            if params.get(param):
+                if not params[param].isdigit():
+                    raise APIValidationError({param: 'Must be a staff id.'})
+                filters[param] = int(params[param])
+
+        exams = exports.filter_exams(visible_exams(request.user), **filters)
+        compress = params.get('gzip') in ('1', 'true')
+        response = StreamingHttpResponse(
+            exports.encode(exports.STREAMERS[fmt](exams), compress=compress),
+            content_type='application/gzip' if compress else exports.CONTENT_TYPES[fmt],
+        )
+        filename = f'examinations.{fmt}' + ('.gz' if compress else '')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['Cache-Control'] = 'no-store'
+        return response
+
+from . import history
+
+class PatientHistoryView(APIView):
+    """
+    ``api/patients/<pk>/history/``: the patient, every exam in visit order with its
+    medications, and per-eye trend series (sphere, cylinder, axis, acuity, IOP).
+    Built in three queries and cached until one of the patient's records changes.
+    Optometrists and staff see any patient; a consultant only patients referred to them.
+    """
+    authentication_classes = [ClaimsJWTAuthentication, SessionAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        user = request.user
+        if not (user.is_staff or user.role == 'optometrist' or visible_exams(user).filter(patient_id=pk).exists()):
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        data = history.get_history(pk)
+        if data is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(data)
+
+from . import formulary
+
+class FormularyAutocompleteView(APIView):
+    """
+    ``api/formulary/?q=timo``: active formulary entries matching the typed words, with the
+    defaults to fill into the prescription row. Answered from the in-process index
+    (see optometrist.formulary) without touching the database.
+    """
+    authentication_classes = [ClaimsJWTAuthentication, SessionAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    max_limit = 50
+
+    def get(self, request):
+        limit = request.query_params.get('limit', '')
+        limit = min(int(limit), self.max_limit) if limit.isdigit() and int(limit) > 0 else None
+        return Response(formulary.autocomplete(request.query_params.get('q', ''), limit))
+
+from django.utils.decorators import method_decorator
+from django.views.decorators.gzip import gzip_page
+from . import sync
+
+@method_decorator(gzip_page, name='dispatch')
+class SyncView(APIView):
+    """
+    Delta sync for offline tablets: ``api/sync/?cursor=<seq>&limit=`` returns patients,
+    examinations, medications and directory entries changed after the cursor, plus
+    tombstones, and the cursor to send next; repeat while ``has_more``. Start from
+    ``cursor=0``. Examinations, medications and patients are limited to the ones the
+    user may see (see visible_exams). Gzip-compressed when the client accepts it.
+    """
+    authentication_classes = [ClaimsJWTAuthentication, SessionAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        cursor = request.query_params.get('cursor', '0')
+        if not cursor.isdigit():
+            raise APIValidationError({'cursor': 'Must be a cursor returned by a previous sync, or 0.'})
+        page = sync.changes_since(
+            int(cursor), sync.page_size(request.query_params.get('limit', '')),
+            exams=visible_exams(request.user), patients=visible_patients(request.user), context={'request': request},
+        )
+        response = Response(page)
+        response['Cache-Control'] = 'no-store'
+        return response
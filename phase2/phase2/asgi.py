@@ -13,4 +13,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'phase2.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Load the medication formulary index now rather than on the first autocomplete keystroke
+from optometrist.formulary import warm_index  # noqa: E402
+
+warm_index()
+
+# Referral Server-Sent Events are served next to Django rather than through it (see doctors/events.py)
+from doctors.events import ReferralStreamApp  # noqa: E402
+
+application = ReferralStreamApp(django_application)
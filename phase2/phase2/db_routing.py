@@ -0,0 +1,139 @@
+"""
+Read-replica routing.
+
+Views opt in with ReplicaReadMixin. While such a view runs, ReplicaRouter sends
+ORM reads to a randomly chosen alias from settings.DATABASE_REPLICAS. All other
+views, and every write, use ``default``. A user who has just written something
+(see ReadYourWritesMiddleware) stays on ``default`` for READ_YOUR_WRITES_SECONDS,
+so their own changes are visible even while replicas lag behind.
+
+The pin travels with the client as a signed cookie, so it holds whichever worker
+process serves the next request. It is also stored in the default cache for API
+clients that do not keep cookies; that only reaches other workers when the cache
+is shared (REDIS_URL), which the phase2.W001 check points out.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from rest_framework.views import APIView
+
+_read_from_replica = ContextVar('read_from_replica', default=False)
+
+PIN_COOKIE = 'primary_pin'
+PIN_SALT = 'phase2.db_routing.primary-pin'
+PER_PROCESS_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def pin_seconds():
+    return getattr(settings, 'READ_YOUR_WRITES_SECONDS', 10)
+
+
+def recent_write_key(user_id):
+    return f'db:recent-write:{user_id}'
+
+
+def mark_recent_write(user_id, response):
+    cache.set(recent_write_key(user_id), True, timeout=pin_seconds())
+    response.set_signed_cookie(
+        PIN_COOKIE, str(user_id), salt=PIN_SALT, max_age=pin_seconds(),
+        httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+    )
+
+
+def pinned_by_cookie(request, user):
+    # The signature's timestamp enforces the window even if the browser keeps the cookie longer
+    value = request.get_signed_cookie(PIN_COOKIE, default=None, salt=PIN_SALT, max_age=pin_seconds())
+    return value == str(user.pk)
+
+
+def replica_allowed(request):
+    if not getattr(settings, 'DATABASE_REPLICAS', None):
+        return False
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and (
+        pinned_by_cookie(request, user) or cache.get(recent_write_key(user.pk))
+    ):
+        return False
+    return True
+
+
+@checks.register(checks.Tags.caches)
+def check_pin_cache(app_configs, **kwargs):
+    if getattr(settings, 'DATABASE_REPLICAS', None) and settings.CACHES['default']['BACKEND'] in PER_PROCESS_CACHES:
+        return [checks.Warning(
+            "Read replicas are configured with a per-process default cache.",
+            hint="Clients that do not send cookies back may read from a lagging replica right after "
+                 "their own write when another worker serves them; set REDIS_URL to share the pin.",
+            id='phase2.W001',
+        )]
+    return []
+
+
+@contextmanager
+def primary_reads():
+    """Send the reads made inside the block to ``default``, even within a ReplicaReadMixin view."""
+    token = _read_from_replica.set(False)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', None)
+        if replicas and _read_from_replica.get():
+            return random.choice(replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as default
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    Serve this view's reads from a replica. For DRF views the decision is made
+    after authentication (in ``initial``), so JWT users get read-your-writes too.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _read_from_replica.set(False)
+        try:
+            if not isinstance(self, APIView):
+                _read_from_replica.set(replica_allowed(request))
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _read_from_replica.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        _read_from_replica.set(replica_allowed(request))
+
+
+class ReadYourWritesMiddleware:
+    """Pin a user to the primary for a short window after any successful write."""
+
+    unsafe_methods = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if settings.DATABASE_REPLICAS and request.method in self.unsafe_methods and response.status_code < 400:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                mark_recent_write(user.pk, response)
+        return response
@@ -0,0 +1,162 @@
+"""
+Per-request SQL and timing instrumentation.
+
+RequestProfilingMiddleware times every request. For a sampled fraction of them
+(settings.REQUEST_PROFILING['SAMPLE_RATE']) it also wraps every database
+connection to count queries, sum their time, keep the slowest statements and
+spot the same statement running many times (the usual N+1 signature), and it
+times template/renderer output. Results go out as a Server-Timing header, so
+browser dev tools show them per request, and as one JSON log line on the
+``phase2.profiling`` logger when the request is slow or looks like an N+1.
+"""
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('phase2.profiling')
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Fraction of requests that get query instrumentation; all requests get total time
+    'SAMPLE_RATE': 0.05,
+    'SLOW_REQUEST_MS': 500,
+    'SLOWEST_STATEMENTS': 3,
+    # A statement executed this many times in one request is reported as a likely N+1
+    'DUPLICATE_THRESHOLD': 5,
+    'SERVER_TIMING_HEADER': True,
+}
+
+
+def profiling_settings():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_PROFILING', {})}
+
+
+class QueryRecorder:
+    """execute_wrapper that records the duration of every statement, success or not."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.durations = defaultdict(float)
+        self.executions = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.total += elapsed
+            # sql is still parameterised here, so repeats with different params group together
+            self.durations[sql] = max(self.durations[sql], elapsed)
+            self.executions[sql] += 1
+
+    def slowest(self, limit):
+        ranked = sorted(self.durations.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{'sql': sql[:500], 'ms': round(duration * 1000, 2)} for sql, duration in ranked]
+
+    def duplicates(self, threshold):
+        return [
+            {'sql': sql[:500], 'count': count}
+            for sql, count in self.executions.most_common()
+            if count >= threshold
+        ]
+
+
+class RequestProfile:
+
+    def __init__(self, sampled):
+        self.sampled = sampled
+        self.queries = QueryRecorder() if sampled else None
+        self.render_started = None
+        self.render_time = 0.0
+
+    def start_render(self):
+        self.render_started = time.perf_counter()
+
+    def finish_render(self, response):
+        if self.render_started is not None:
+            self.render_time += time.perf_counter() - self.render_started
+            self.render_started = None
+        return response
+
+
+class RequestProfilingMiddleware:
+    """Keep first in MIDDLEWARE so "total" covers the other middleware too."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = profiling_settings()
+        if not config['ENABLED']:
+            return self.get_response(request)
+
+        sampled = settings.DEBUG or random.random() < config['SAMPLE_RATE']
+        profile = request._profile = RequestProfile(sampled)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            if sampled:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(profile.queries))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        if config['SERVER_TIMING_HEADER']:
+            response['Server-Timing'] = self.server_timing(profile, total)
+        self.log(request, response, profile, total, config)
+        return response
+
+    def process_template_response(self, request, response):
+        # Called last among the template-response hooks, right before the handler renders
+        # (DRF responses included, so "render" covers JSON rendering too)
+        profile = getattr(request, '_profile', None)
+        if profile is not None and profile.sampled:
+            profile.start_render()
+            response.add_post_render_callback(profile.finish_render)
+        return response
+
+    def server_timing(self, profile, total):
+        metrics = [f'total;dur={total * 1000:.1f}']
+        if profile.sampled:
+            queries = profile.queries
+            metrics.append(f'db;dur={queries.total * 1000:.1f};desc="{queries.count} queries"')
+            metrics.append(f'render;dur={profile.render_time * 1000:.1f}')
+            # Queries run lazily from templates count in both db and render, hence the clamp
+            app = max(0.0, total - queries.total - profile.render_time)
+            metrics.append(f'app;dur={app * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def log(self, request, response, profile, total, config):
+        total_ms = total * 1000
+        slow = total_ms >= config['SLOW_REQUEST_MS']
+        duplicates = profile.queries.duplicates(config['DUPLICATE_THRESHOLD']) if profile.sampled else []
+        if not slow and not duplicates:
+            return
+
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'event': 'slow_request' if slow else 'duplicate_queries',
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 1),
+            'sampled': profile.sampled,
+        }
+        if profile.sampled:
+            record.update({
+                'queries': profile.queries.count,
+                'db_ms': round(profile.queries.total * 1000, 1),
+                'render_ms': round(profile.render_time * 1000, 1),
+                'slowest': profile.queries.slowest(config['SLOWEST_STATEMENTS']),
+                'duplicates': duplicates,
+            })
+        logger.warning(json.dumps(record))
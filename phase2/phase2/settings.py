@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,11 +45,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'phase2.profiling.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'phase2.db_routing.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -80,9 +83,56 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Read replicas kept in sync outside Django (e.g. LiteFS/Litestream), listed as
+# DB_REPLICAS="/var/lib/eyesphere/replica1.sqlite3,/var/lib/eyesphere/replica2.sqlite3".
+# Views using phase2.db_routing.ReplicaReadMixin read from one of these; writes always go to default.
+DATABASE_REPLICAS = []
+replica_paths = [path.strip() for path in os.environ.get('DB_REPLICAS', '').split(',') if path.strip()]
+for index, path in enumerate(replica_paths, start=1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'TEST': {'NAME': BASE_DIR / f'test_{alias}.sqlite3'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['phase2.db_routing.ReplicaRouter']
+
+# SQLITE_PROFILE=high_concurrency enables WAL, IMMEDIATE transactions, tuned PRAGMAs and
+# persistent connections for many concurrent writers (see phase2/sqlite.py).
+from phase2.sqlite import apply_sqlite_profile
+apply_sqlite_profile(DATABASES, os.environ.get('SQLITE_PROFILE', 'default'))
+
+# Request instrumentation (see phase2/profiling.py). Every request gets a total
+# time; SAMPLE_RATE of them also get query counts, DB/render time and N+1 checks.
+REQUEST_PROFILING = {
+    'ENABLED': os.environ.get('REQUEST_PROFILING', '1') == '1',
+    'SAMPLE_RATE': float(os.environ.get('REQUEST_PROFILING_SAMPLE_RATE', 0.05)),
+    'SLOW_REQUEST_MS': int(os.environ.get('SLOW_REQUEST_MS', 500)),
+    'SLOWEST_STATEMENTS': 3,
+    'DUPLICATE_THRESHOLD': 5,
+    'SERVER_TIMING_HEADER': True,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'phase2.profiling': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
+# Seconds a user keeps reading from default after a successful write
+READ_YOUR_WRITES_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -120,11 +170,24 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# User uploads (profile pictures and their resized variants)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Resized profile picture variants, name -> (width, height, crop), built by a
+# background pool of PROFILE_PICTURE_WORKERS threads (see optometrist/thumbnails.py)
+PROFILE_PICTURE_VARIANTS = {
+    'thumb': (96, 96, True),
+    'card': (320, 320, True),
+    'large': (800, 800, False),
+}
+PROFILE_PICTURE_WORKERS = 2
+
 AUTH_USER_MODEL = 'optometrist.Optometrist'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'optometrist.authentication.ClaimsJWTAuthentication',
     )
 }
 
@@ -143,3 +206,83 @@ SIMPLE_JWT = {
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
+
+# Seconds ClaimsJWTAuthentication trusts a cached user status before re-reading it; 0 reads it
+# on every request. Only cached with a shared cache (REDIS_URL): with a per-process one, a
+# deactivated user would stay signed in on every worker except the one that saved the change.
+JWT_USER_CACHE_TIMEOUT = 60 if os.environ.get('REDIS_URL') else 0
+
+# Strategy used to pick a consultant when an exam is submitted without consultant_id.
+# Built-in: optometrist.assignment.LeastOutstandingStrategy, optometrist.assignment.RoundRobinStrategy
+# Concurrent auto-assignments on SQLite may hit "database is locked" and be retried unless
+# SQLITE_PROFILE=high_concurrency is set (see optometrist/assignment.py)
+CONSULTANT_ASSIGNMENT_STRATEGY = 'optometrist.assignment.LeastOutstandingStrategy'
+
+# Admin changelists count matching rows up to this many and show that number beyond it
+# (unfiltered lists use the database's row estimate instead); see optometrist/admin_performance.py
+ADMIN_COUNT_LIMIT = 10000
+
+# Caching
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'eyesphere',
+    }
+}
+if os.environ.get('REDIS_URL'):
+    # Share cached data (and invalidations) between worker processes
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+# Rendered exam reports: cache alias and entry TTL in seconds
+REPORT_CACHE = {
+    'ALIAS': os.environ.get('REPORT_CACHE_ALIAS', 'default'),
+    'TIMEOUT': int(os.environ.get('REPORT_CACHE_TIMEOUT', 60 * 60 * 24 * 30)),
+}
+
+# Patient history API (see optometrist/history.py): cache alias and entry TTL in seconds
+PATIENT_HISTORY_CACHE = {
+    'ALIAS': os.environ.get('PATIENT_HISTORY_CACHE_ALIAS', 'default'),
+    'TIMEOUT': int(os.environ.get('PATIENT_HISTORY_CACHE_TIMEOUT', 60 * 60 * 24)),
+}
+
+# Live referral stream for the doctor dashboard (ASGI only, see doctors/events.py): seconds between
+# keep-alive comments, referrals replayed on reconnect before the client reloads instead, and
+# maximum stream lifetime in seconds
+REFERRAL_STREAM = {
+    'HEARTBEAT_SECONDS': 15,
+    'REPLAY_LIMIT': 50,
+    'MAX_AGE_SECONDS': 60 * 60,
+}
+
+# Idempotency-Key on exam create endpoints (see optometrist/idempotency.py): how long a key and its
+# stored response are kept; run `manage.py purge_idempotency_keys` periodically to delete expired ones
+IDEMPOTENCY = {
+    'TTL_SECONDS': int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 60 * 60 * 24)),
+}
+
+# Delta sync for offline tablets (see optometrist/sync.py): changes per page by default and at most, and,
+# on databases other than SQLite, how old (seconds) a change must be before it is sent; keep it above
+# the longest write transaction. Run `manage.py compact_sync_changes` periodically.
+SYNC = {
+    'PAGE_SIZE': 500,
+    'MAX_PAGE_SIZE': 2000,
+    'SETTLE_SECONDS': 5,
+}
+
+# Medication formulary autocomplete (see optometrist/formulary.py): how often (seconds) each process
+# checks the database for formulary changes made elsewhere, and default result count
+FORMULARY = {
+    'CHECK_SECONDS': 5,
+    'LIMIT': 10,
+}
+
+# Optometrist/doctor directory cache: which CACHES alias to use and entry TTL in seconds
+DIRECTORY_CACHE = {
+    'ALIAS': os.environ.get('DIRECTORY_CACHE_ALIAS', 'default'),
+    'TIMEOUT': int(os.environ.get('DIRECTORY_CACHE_TIMEOUT', 300)),
+}
@@ -0,0 +1,83 @@
+"""
+SQLite tuning for clinic edge boxes.
+
+HIGH_CONCURRENCY_PROFILE is merged into every SQLite entry in DATABASES when
+SQLITE_PROFILE=high_concurrency. It turns on:
+- WAL, so readers never block the single writer and the writer never blocks readers
+- IMMEDIATE transactions, which take the write lock up front instead of failing
+  a read-to-write upgrade with "database is locked"
+- a busy timeout
+- persistent connections
+
+retry_on_database_locked covers the remaining case where the busy timeout runs
+out under a burst of writers.
+"""
+import random
+import time
+from functools import wraps
+
+from django.db import OperationalError, connection
+
+HIGH_CONCURRENCY_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    # Durable across application crashes; only a power loss can roll back the last commits
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -20000',  # ~20 MB page cache per connection
+    'PRAGMA mmap_size = 268435456',  # 256 MB memory-mapped reads
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA wal_autocheckpoint = 1000',
+]
+
+HIGH_CONCURRENCY_PROFILE = {
+    'CONN_MAX_AGE': 600,
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        'timeout': 20,
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': '; '.join(HIGH_CONCURRENCY_PRAGMAS),
+    },
+}
+
+SQLITE_PROFILES = {
+    'default': {},
+    'high_concurrency': HIGH_CONCURRENCY_PROFILE,
+}
+
+
+def apply_sqlite_profile(databases, profile_name):
+    profile = SQLITE_PROFILES[profile_name]
+    for config in databases.values():
+        if config.get('ENGINE') != 'django.db.backends.sqlite3':
+            continue
+        for key, value in profile.items():
+            if key == 'OPTIONS':
+                config['OPTIONS'] = {**value, **config.get('OPTIONS', {})}
+            else:
+                config.setdefault(key, value)
+    return databases
+
+
+def is_database_locked(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def retry_on_database_locked(attempts=5, base_delay=0.05, max_delay=1.0):
+    """
+    Retry a function that runs its own transaction when SQLite reports the database
+    as locked, with jittered exponential backoff. Inside an outer atomic block the
+    error is re-raised at once, because only the outermost transaction can be retried.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(attempts):
+                try:
+                    return func(*args, **kwargs)
+                except OperationalError as exc:
+                    if not is_database_locked(exc) or connection.in_atomic_block or attempt == attempts - 1:
+                        raise
+                    delay = min(max_delay, base_delay * (2 ** attempt))
+                    time.sleep(delay * random.uniform(0.5, 1.5))
+        return wrapper
+    return decorator
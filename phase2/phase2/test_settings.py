@@ -0,0 +1,21 @@
+"""
+Settings for the test suite: the production settings plus one read replica.
+
+The replica is a separate SQLite file that nothing replicates into, so
+ReplicaRoutingTests can tell which database a view read from. manage.py uses
+this module for the ``test`` command; other runners should point
+DJANGO_SETTINGS_MODULE at it.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES
+
+DATABASES['replica_1'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': BASE_DIR / 'replica_1.sqlite3',
+    'TEST': {'NAME': BASE_DIR / 'test_replica_1.sqlite3'},
+}
+DATABASE_REPLICAS = ['replica_1']
+# One process: the per-process cache shares the read-your-writes pin and the
+# cached JWT user state with every request
+JWT_USER_CACHE_TIMEOUT = 60
+SILENCED_SYSTEM_CHECKS = ['phase2.W001', 'optometrist.W001']
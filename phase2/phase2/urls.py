@@ -14,6 +14,8 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
@@ -22,3 +24,6 @@ urlpatterns = [
     path('', include('optometrist.urls')),
     path('doctor/', include('doctors.urls')),
 ]
+
+# Serves uploads under runserver with DEBUG=True; production serves MEDIA_ROOT from the web server
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'phase2.settings')
 
 application = get_wsgi_application()
+
+# Load the medication formulary index now rather than on the first autocomplete keystroke
+from optometrist.formulary import warm_index  # noqa: E402
+
+warm_index()